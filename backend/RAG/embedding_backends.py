@@ -0,0 +1,228 @@
+"""
+Embedding backends behind one interface, so the RAG pipeline can embed through OpenAI or fully offline.
+
+Every backend has:
+    model_id   name recorded in the embedding store and cache, e.g.
+               "text-embedding-ada-002", "local:all-MiniLM-L6-v2:int8", or
+               "local:minilm@3f2a9c0d1e7b" for a model directory, identified
+               by a hash of its files (config, tokenizer and weights);
+               vectors with different ids are never mixed
+    dim        embedding dimension
+    embed(texts) -> (len(texts), dim) float32 array, in input order
+    stats()    backend-specific throughput counters
+
+Backends:
+    OpenAIEmbeddingBackend      EmbeddingClient against the OpenAI API (or
+                                fake_embeddings_server.py)
+    SentenceTransformerBackend  local sentence-transformers model. Texts are
+                                sorted by length before batching so each batch
+                                pads to similar lengths, can be encoded by a
+                                pool of CPU processes, and the model's Linear
+                                layers can be dynamically quantized to int8.
+
+Configuration (embedding_backend_from_env):
+    EMBED_BACKEND       openai (default) or local
+    EMBED_OPENAI_MODEL  OpenAI model (default text-embedding-ada-002)
+    EMBED_LOCAL_MODEL   sentence-transformers model (default all-MiniLM-L6-v2)
+    EMBED_BATCH_SIZE    local batch size (default 128)
+    EMBED_PROCESSES     local encoding processes; 0 or 1 encodes in-process (default 0)
+    EMBED_INT8          1 to quantize the local model to int8 (default 0)
+"""
+import hashlib
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from embedding_client import EmbeddingClient
+
+OPENAI_DIMENSIONS = {
+    "text-embedding-ada-002": 1536,
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+}
+LOCAL_PREFIX = "local:"
+
+
+class OpenAIEmbeddingBackend:
+    """
+    Embed through the OpenAI embeddings API.
+
+    Args:
+        model (str): OpenAI embedding model
+        api_key (str | None): Defaults to the OPENAI environment variable
+        base_url (str | None): Defaults to OPENAI_BASE_URL, else the OpenAI API
+    """
+
+    def __init__(self, model="text-embedding-ada-002", api_key=None, base_url=None):
+        api_key = api_key or os.getenv("OPENAI")
+        if not api_key:
+            raise ValueError("OPENAI environment variable not set")
+        self.model_id = model
+        self.client = EmbeddingClient(
+            api_key,
+            model=model,
+            base_url=base_url or os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1"),
+            max_batch_tokens=int(os.getenv("EMBED_BATCH_TOKENS", "8000")),
+            concurrency=int(os.getenv("EMBED_CONCURRENCY", "4")),
+        )
+        self._dim = OPENAI_DIMENSIONS.get(model)
+
+    @property
+    def dim(self):
+        if self._dim is None:
+            self._dim = len(self.client.embed(["dimension probe"], progress=False)[0])
+        return self._dim
+
+    def embed(self, texts):
+        embeddings = np.asarray(self.client.embed(texts), dtype=np.float32).reshape(len(texts), -1)
+        stats = self.client.stats()
+        print(f"Embedded {len(texts)} chunks with {stats['requests']} requests ({stats['retries']} retries): "
+              f"{stats['tokens_per_sec']:.0f} tokens/s, {stats['requests_per_sec']:.1f} requests/s")
+        return embeddings
+
+    def stats(self):
+        return self.client.stats()
+
+
+def model_fingerprint(directory):
+    """Short SHA-256 over the relative paths and contents of every file in a model directory."""
+    digest = hashlib.sha256()
+    for root, directories, files in os.walk(directory):
+        directories.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            digest.update(os.path.relpath(path, directory).encode("utf-8") + b"\0")
+            with open(path, "rb") as file:
+                for block in iter(lambda: file.read(1 << 20), b""):
+                    digest.update(block)
+    return digest.hexdigest()[:12]
+
+def _load_model(model, int8, device="cpu"):
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    loaded = SentenceTransformer(model, device=device)
+    if int8:
+        loaded = torch.ao.quantization.quantize_dynamic(loaded, {torch.nn.Linear}, dtype=torch.qint8)
+    return loaded
+
+# Set in each encoding process by _init_worker
+_worker_model = None
+
+
+def _init_worker(model, int8, threads):
+    global _worker_model
+    import torch
+
+    torch.set_num_threads(threads)  # Share the cores between the processes
+    _worker_model = _load_model(model, int8)
+
+def _encode_slice(texts, batch_size):
+    return _worker_model.encode(texts, batch_size=batch_size, convert_to_numpy=True, normalize_embeddings=True)
+
+
+class SentenceTransformerBackend:
+    """
+    Embed with a local sentence-transformers model.
+
+    Args:
+        model (str): Model name or local path
+        batch_size (int): Texts per forward pass
+        processes (int): Encoding processes; 0 or 1 encodes in this process
+        int8 (bool): Dynamically quantize Linear layers to int8 (CPU)
+        device (str): Torch device for in-process encoding
+    """
+
+    def __init__(self, model="all-MiniLM-L6-v2", batch_size=128, processes=0, int8=False, device="cpu"):
+        self.model_name = model
+        self.batch_size = batch_size
+        self.processes = processes
+        self.int8 = int8
+        self.model = _load_model(model, int8, device)
+        # A directory name says nothing about its contents, so local copies are identified by a hash of them
+        name = f"{os.path.basename(model.rstrip('/'))}@{model_fingerprint(model)}" if os.path.isdir(model) else model
+        self.model_id = f"{LOCAL_PREFIX}{name}{':int8' if int8 else ''}"
+        get_dimension = getattr(self.model, "get_embedding_dimension", None) or self.model.get_sentence_embedding_dimension
+        self.dim = get_dimension()
+        self._pool = None
+        self._counts = {"texts": 0, "characters": 0, "seconds": 0.0}
+
+    def embed(self, texts):
+        """Embed texts sorted by length, so batches pad little, and return them in input order."""
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        started = time.perf_counter()
+        # Characters are a good enough proxy for token count to group similar lengths
+        order = np.argsort([-len(text) for text in texts], kind="stable")
+        sorted_texts = [texts[index] for index in order]
+
+        if self.processes > 1:
+            if self._pool is None:
+                # Each process loads (and quantizes) its own copy instead of unpickling ours
+                threads = max(1, (os.cpu_count() or 1) // self.processes)
+                self._pool = ProcessPoolExecutor(self.processes, initializer=_init_worker,
+                                                 initargs=(self.model_name, self.int8, threads))
+            # A few batches per task: contiguous slices of the sorted list keep batches homogeneous
+            step = self.batch_size * 4
+            slices = [sorted_texts[start:start + step] for start in range(0, len(sorted_texts), step)]
+            encoded = np.concatenate(list(self._pool.map(_encode_slice, slices, [self.batch_size] * len(slices))))
+        else:
+            encoded = self.model.encode(sorted_texts, batch_size=self.batch_size, convert_to_numpy=True,
+                                        normalize_embeddings=True)
+
+        embeddings = np.empty((len(texts), self.dim), dtype=np.float32)
+        embeddings[order] = encoded
+        elapsed = time.perf_counter() - started
+        self._counts["texts"] += len(texts)
+        self._counts["characters"] += sum(len(text) for text in texts)
+        self._counts["seconds"] += elapsed
+        print(f"Embedded {len(texts)} chunks locally in {elapsed:.2f}s ({len(texts) / elapsed:.1f} chunks/s)")
+        return embeddings
+
+    def close(self):
+        """Stop the encoding processes."""
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def stats(self):
+        seconds = self._counts["seconds"] or float("nan")
+        return {**self._counts, "texts_per_sec": self._counts["texts"] / seconds}
+
+
+def embedding_backend_from_env():
+    """Create the backend selected by EMBED_BACKEND and its settings."""
+    backend = os.getenv("EMBED_BACKEND", "openai")
+    if backend == "openai":
+        return OpenAIEmbeddingBackend(os.getenv("EMBED_OPENAI_MODEL", "text-embedding-ada-002"))
+    if backend == "local":
+        return SentenceTransformerBackend(
+            os.getenv("EMBED_LOCAL_MODEL", "all-MiniLM-L6-v2"),
+            batch_size=int(os.getenv("EMBED_BATCH_SIZE", "128")),
+            processes=int(os.getenv("EMBED_PROCESSES", "0")),
+            int8=os.getenv("EMBED_INT8", "0") == "1",
+        )
+    raise ValueError(f"Unknown EMBED_BACKEND '{backend}', expected openai or local")
+
+def embedding_backend_for(model_id):
+    """
+    Recreate the backend that produced vectors recorded under model_id, e.g. to embed queries.
+
+    Hub models are looked up by name; a model directory must be given in
+    EMBED_LOCAL_MODEL and have the fingerprint recorded in model_id.
+    """
+    if not model_id.startswith(LOCAL_PREFIX):
+        return OpenAIEmbeddingBackend(model_id)
+    name = model_id[len(LOCAL_PREFIX):]
+    int8 = name.endswith(":int8")
+    name = name[:-len(":int8")] if int8 else name
+    name, _, fingerprint = name.partition("@")
+    if not fingerprint:
+        return SentenceTransformerBackend(name, int8=int8)
+    local_model = os.getenv("EMBED_LOCAL_MODEL", "")
+    if not os.path.isdir(local_model) or model_fingerprint(local_model) != fingerprint:
+        raise ValueError(f"{model_id} was embedded with a local model directory; set EMBED_LOCAL_MODEL to "
+                         f"a copy of it (fingerprint {fingerprint})")
+    return SentenceTransformerBackend(local_model, int8=int8)
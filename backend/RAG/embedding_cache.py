@@ -0,0 +1,124 @@
+"""
+Persistent embedding cache keyed by (model name, SHA-256 of the chunk text).
+
+Re-ingesting a document only embeds chunks whose text is new or changed;
+every other chunk's vector comes from the cache. Chunk ids are the content
+hash, so two runs can be compared with diff_chunks() to get the chunks that
+were added, removed or left unchanged, which the upload can apply
+incrementally instead of replacing the whole table.
+
+The cache is a SQLite file (vectors stored as float32 blobs), safe to share
+between runs and to delete at any time.
+"""
+import hashlib
+import sqlite3
+
+import numpy as np
+
+
+def content_hash(text):
+    """Stable chunk id: SHA-256 hex digest of the chunk text."""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def diff_chunks(previous_ids, current_ids):
+    """
+    Compare the chunk ids of two ingestion runs.
+
+    Args:
+        previous_ids (list[str]): Chunk ids of the last run (empty on the first run)
+        current_ids (list[str]): Chunk ids of this run
+
+    Returns:
+        dict: added, removed and unchanged id lists, each in document order
+    """
+    previous, current = set(previous_ids), set(current_ids)
+    return {
+        "added": [chunk_id for chunk_id in current_ids if chunk_id not in previous],
+        "removed": [chunk_id for chunk_id in previous_ids if chunk_id not in current],
+        "unchanged": [chunk_id for chunk_id in current_ids if chunk_id in previous],
+    }
+
+
+class EmbeddingCache:
+    """
+    SQLite store of embeddings by (model, content hash).
+
+    Args:
+        path (str): Database file, created if missing
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        with sqlite3.connect(path) as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "model TEXT NOT NULL, content_hash TEXT NOT NULL, dim INTEGER NOT NULL, vector BLOB NOT NULL, "
+                "created_at TEXT DEFAULT CURRENT_TIMESTAMP, PRIMARY KEY (model, content_hash))"
+            )
+
+    def get_many(self, model, hashes):
+        """
+        Look up cached embeddings.
+
+        Returns:
+            dict[str, np.ndarray]: float32 vectors for the hashes found
+        """
+        found = {}
+        with sqlite3.connect(self.path) as connection:
+            # Stay under SQLite's bound-parameter limit
+            for start in range(0, len(hashes), 500):
+                chunk = hashes[start:start + 500]
+                rows = connection.execute(
+                    f"SELECT content_hash, vector FROM embeddings WHERE model = ? AND content_hash IN ({','.join('?' * len(chunk))})",
+                    [model, *chunk],
+                )
+                for chunk_hash, vector in rows:
+                    found[chunk_hash] = np.frombuffer(vector, dtype=np.float32)
+        return found
+
+    def put_many(self, model, items):
+        """Store (content hash, vector) pairs, replacing existing entries."""
+        with sqlite3.connect(self.path) as connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, content_hash, dim, vector) VALUES (?, ?, ?, ?)",
+                [(model, chunk_hash, len(vector), np.asarray(vector, dtype=np.float32).tobytes()) for chunk_hash, vector in items],
+            )
+
+    def embed(self, model, texts, embed_fn):
+        """
+        Embed texts, calling embed_fn only for texts not in the cache.
+
+        Args:
+            model (str): Model name the vectors belong to
+            texts (list[str]): Chunk texts
+            embed_fn (callable): list[str] -> list of vectors, for the cache misses
+
+        Returns:
+            np.ndarray: float32 matrix with one row per text, in order
+        """
+        hashes = [content_hash(text) for text in texts]
+        cached = self.get_many(model, sorted(set(hashes)))
+
+        missing = {}
+        for chunk_hash, text in zip(hashes, texts):
+            if chunk_hash not in cached:
+                missing.setdefault(chunk_hash, text)
+        self.hits += len(texts) - sum(1 for chunk_hash in hashes if chunk_hash not in cached)
+        self.misses += len(missing)
+
+        if missing:
+            vectors = embed_fn(list(missing.values()))
+            fresh = list(zip(missing.keys(), vectors))
+            self.put_many(model, fresh)
+            cached.update((chunk_hash, np.asarray(vector, dtype=np.float32)) for chunk_hash, vector in fresh)
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.stack([cached[chunk_hash] for chunk_hash in hashes])
+
+    def stats(self):
+        """Cache hits and misses since this object was created, and the number of stored vectors."""
+        with sqlite3.connect(self.path) as connection:
+            entries = connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "entries": entries}
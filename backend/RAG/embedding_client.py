@@ -0,0 +1,310 @@
+"""
+Concurrent, rate-limit-aware client for the OpenAI embeddings API.
+
+- Texts are packed into requests by token budget (max_batch_tokens) rather
+  than a fixed item count, keeping the input order.
+- Several requests are in flight at once. Concurrency adapts AIMD-style: it
+  grows by about one per round of successful requests and halves on a 429 or
+  when the x-ratelimit-remaining-* headers show the budget running out.
+- 429s, 5xx errors, timeouts and dropped connections are retried with
+  jittered exponential backoff, honouring retry-after(-ms). A 429 also pauses
+  every worker until the server says the limit resets.
+- stats() reports tokens/sec and requests/sec.
+
+Point it at fake_embeddings_server.py (OPENAI_BASE_URL) to test it offline:
+
+    python embedding_client.py --texts 5000 --rpm 600
+"""
+import argparse
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+_encoding = None  # tiktoken encoding, or False when tiktoken is not installed
+
+
+def count_tokens(text):
+    """Estimate the tokens in a text (tiktoken when installed, else characters / 4)."""
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except ImportError:
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text))
+    return max(1, len(text) // 4)
+
+def pack_batches(texts, max_batch_tokens=8000, max_batch_items=2048):
+    """
+    Group consecutive texts into requests that stay within a token budget.
+
+    Returns:
+        list[tuple[int, list[str], int]]: (index of the first text, texts, estimated tokens)
+    """
+    batches = []
+    start, batch, tokens = 0, [], 0
+    for index, text in enumerate(texts):
+        text_tokens = count_tokens(text)
+        if batch and (tokens + text_tokens > max_batch_tokens or len(batch) == max_batch_items):
+            batches.append((start, batch, tokens))
+            start, batch, tokens = index, [], 0
+        batch.append(text)
+        tokens += text_tokens
+    if batch:
+        batches.append((start, batch, tokens))
+    return batches
+
+def parse_duration(value):
+    """Parse rate-limit reset durations such as '1s', '250ms' or '6m0s' into seconds."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    seconds = 0.0
+    for amount, unit in re.findall(r"([\d.]+)(ms|s|m|h)", value):
+        seconds += float(amount) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[unit]
+    return seconds
+
+
+class AdaptiveLimiter:
+    """
+    Concurrency limit that grows additively on success and shrinks multiplicatively on throttling.
+
+    Args:
+        initial (int): Starting number of requests in flight
+        minimum (int): Lower bound
+        maximum (int): Upper bound
+    """
+
+    def __init__(self, initial=4, minimum=1, maximum=16):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while True:
+                pause = self.paused_until - time.monotonic()
+                if pause > 0:
+                    self._condition.wait(pause)
+                elif self.in_flight >= int(self.limit):
+                    self._condition.wait()
+                else:
+                    self.in_flight += 1
+                    return
+
+    def release(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def on_success(self):
+        with self._condition:
+            # About +1 per limit's worth of successes
+            self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            self._condition.notify_all()
+
+    def on_throttle(self, pause=0.0):
+        with self._condition:
+            self.limit = max(self.minimum, self.limit / 2)
+            self.paused_until = max(self.paused_until, time.monotonic() + pause)
+
+    def cap(self, limit):
+        """Lower the limit to what the server's remaining budget allows."""
+        with self._condition:
+            self.limit = max(self.minimum, min(self.limit, limit))
+
+
+class EmbeddingClient:
+    """
+    Embed texts through an OpenAI-compatible /embeddings endpoint.
+
+    Args:
+        api_key (str): API key
+        model (str): Embedding model name
+        base_url (str): API base URL; point at fake_embeddings_server.py for tests
+        max_batch_tokens (int): Token budget per request
+        max_batch_items (int): Texts per request at most
+        concurrency (int): Initial requests in flight
+        max_concurrency (int): Upper bound for the adaptive concurrency
+        max_retries (int): Retries per request before giving up
+        backoff (float): First retry delay in seconds, doubled on every retry
+        max_backoff (float): Upper bound on the retry delay
+        timeout (float): Per-request timeout in seconds
+    """
+
+    def __init__(self, api_key, model="text-embedding-ada-002", base_url="https://api.openai.com/v1",
+                 max_batch_tokens=8000, max_batch_items=2048, concurrency=4, max_concurrency=16,
+                 max_retries=8, backoff=0.5, max_backoff=60.0, timeout=60.0):
+        self.model = model
+        self.url = f"{base_url.rstrip('/')}/embeddings"
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_items = max_batch_items
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.limiter = AdaptiveLimiter(concurrency, 1, max_concurrency)
+
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=max_concurrency)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({"Authorization": f"Bearer {api_key}"})
+
+        self._lock = threading.Lock()
+        self._counts = {"requests": 0, "retries": 0, "rate_limited": 0, "texts": 0, "tokens": 0, "seconds": 0.0}
+
+    def embed(self, texts, progress=True):
+        """
+        Embed texts, preserving their order.
+
+        Args:
+            texts (list[str]): Texts to embed
+            progress (bool): Print a line per completed request
+
+        Returns:
+            list[list[float]]: One embedding per text
+        """
+        batches = pack_batches(texts, self.max_batch_tokens, self.max_batch_items)
+        embeddings = [None] * len(texts)
+        started = time.perf_counter()
+        completed = 0
+
+        def run(batch):
+            nonlocal completed
+            start, items, _ = batch
+            for offset, embedding in enumerate(self._request(items)):
+                embeddings[start + offset] = embedding
+            with self._lock:
+                completed += 1
+                if progress:
+                    print(f"Processing batch {completed}/{len(batches)} (concurrency {int(self.limiter.limit)})")
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="embed") as executor:
+            for future in [executor.submit(run, batch) for batch in batches]:
+                future.result()
+
+        with self._lock:
+            self._counts["seconds"] += time.perf_counter() - started
+            self._counts["texts"] += len(texts)
+        return embeddings
+
+    def _request(self, items):
+        delay = self.backoff
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire()
+            try:
+                response = self.session.post(self.url, json={"model": self.model, "input": items}, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                response, error = None, e
+            finally:
+                self.limiter.release()
+            with self._lock:
+                self._counts["requests"] += 1
+
+            if response is not None and response.status_code == 200:
+                self._observe_headers(response.headers)
+                self.limiter.on_success()
+                body = response.json()
+                with self._lock:
+                    self._counts["tokens"] += body.get("usage", {}).get("total_tokens", 0)
+                return [item["embedding"] for item in sorted(body["data"], key=lambda item: item["index"])]
+
+            if response is not None and response.status_code not in RETRY_STATUSES:
+                raise Exception(f"Embedding request failed with status {response.status_code}: {response.text[:500]}")
+            if attempt == self.max_retries:
+                break
+
+            retry_after = self._retry_after(response.headers) if response is not None else None
+            if response is not None and response.status_code == 429:
+                with self._lock:
+                    self._counts["rate_limited"] += 1
+                self.limiter.on_throttle(retry_after or delay)
+            with self._lock:
+                self._counts["retries"] += 1
+            # Full jitter, but never earlier than the server asked for
+            time.sleep(max(retry_after or 0.0, random.uniform(0, delay)))
+            delay = min(delay * 2, self.max_backoff)
+
+        reason = f"status {response.status_code}" if response is not None else str(error)
+        raise Exception(f"Embedding request failed after {self.max_retries} retries: {reason}")
+
+    def _retry_after(self, headers):
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000.0
+        return parse_duration(headers.get("retry-after"))
+
+    def _observe_headers(self, headers):
+        """Shrink concurrency before hitting the limit when the remaining budget runs low."""
+        remaining_requests = headers.get("x-ratelimit-remaining-requests")
+        if remaining_requests is not None and int(remaining_requests) < self.limiter.limit:
+            self.limiter.cap(max(1, int(remaining_requests)))
+        remaining_tokens = headers.get("x-ratelimit-remaining-tokens")
+        if remaining_tokens is not None:
+            self.limiter.cap(max(1, int(remaining_tokens) // self.max_batch_tokens))
+
+    def stats(self):
+        """
+        Report request counts and throughput.
+
+        Returns:
+            dict: Counters plus tokens_per_sec, requests_per_sec and current concurrency
+        """
+        with self._lock:
+            counts = dict(self._counts)
+        seconds = counts["seconds"] or float("nan")
+        return {
+            **counts,
+            "tokens_per_sec": counts["tokens"] / seconds,
+            "requests_per_sec": counts["requests"] / seconds,
+            "concurrency": int(self.limiter.limit),
+        }
+
+
+def main():
+    from fake_embeddings_server import FakeEmbeddingsServer
+
+    parser = argparse.ArgumentParser(description="Benchmark the embedding client against the local fake server")
+    parser.add_argument("--texts", type=int, default=2000)
+    parser.add_argument("--chars", type=int, default=1000, help="Characters per text (about a chunk)")
+    parser.add_argument("--rpm", type=int, default=600)
+    parser.add_argument("--tpm", type=int, default=1_000_000)
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    parser.add_argument("--failure-rate", type=float, default=0.02)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--max-batch-tokens", type=int, default=8000)
+    args = parser.parse_args()
+
+    server = FakeEmbeddingsServer(0, 1536, args.rpm, args.tpm, args.latency_ms, args.failure_rate).start()
+    words = "skin lesion dermatitis acne rosacea eczema psoriasis melanoma treatment symptoms".split()
+    generator = random.Random(0)
+    texts = [" ".join(generator.choice(words) for _ in range(args.chars // 8)) for _ in range(args.texts)]
+
+    client = EmbeddingClient("fake", base_url=server.url, max_batch_tokens=args.max_batch_tokens, concurrency=args.concurrency)
+    embeddings = client.embed(texts, progress=False)
+    server.stop()
+
+    stats = client.stats()
+    print(f"Embedded {len(embeddings)} texts in {stats['seconds']:.2f}s: {stats['tokens_per_sec']:.0f} tokens/s, "
+          f"{stats['requests_per_sec']:.1f} requests/s ({stats['requests']} requests, {stats['retries']} retries, "
+          f"{stats['rate_limited']} rate limited, final concurrency {stats['concurrency']})")
+    print(f"Server saw {server.counts}")
+
+
+if __name__ == "__main__":
+    main()
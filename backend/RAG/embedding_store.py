@@ -0,0 +1,280 @@
+"""
+Compact on-disk store for chunk embeddings, replacing the embed.csv / embed_text.csv pair.
+
+A store is a directory holding:
+    manifest.json     model, dimension, dtype, row count and format version
+    vectors.bin       row-major float32 (or float16) matrix, memory-mapped on load
+    metadata.parquet  one row per vector: chunk_id, text, source, page range, offsets
+
+Vectors are written as they are produced and read back as a memory map, so
+neither side materializes them as Python lists, and float32 keeps every bit
+the embedding API returned (CSV round-trips through decimal text). A store is
+built in a temporary directory and renamed into place when complete, so
+readers never see a half-written one.
+
+Legacy CSV pairs only hold the chunk text, so converted stores get the text's
+content hash as chunk_id, --source as the source and empty page ranges and
+offsets.
+
+Usage:
+    python embedding_store.py info embed_store
+    python embedding_store.py convert embed.csv embed_text.csv embed_store [--dtype float16]
+    python embedding_store.py compare embed.csv embed_text.csv embed_store
+"""
+import argparse
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+FORMAT_VERSION = 1
+DTYPES = ("float32", "float16")
+
+
+class EmbeddingStoreWriter:
+    """
+    Build an embedding store by appending batches of vectors and their metadata rows.
+
+    Args:
+        directory (str): Store directory; replaced when close() completes
+        model (str): Embedding model the vectors come from
+        dtype (str): "float32" or "float16" on disk
+    """
+
+    def __init__(self, directory, model, dtype="float32"):
+        if dtype not in DTYPES:
+            raise ValueError(f"Unsupported dtype {dtype}; expected one of {DTYPES}")
+        self.directory = directory
+        self.model = model
+        self.dtype = dtype
+        self.dim = None
+        self.count = 0
+        self._tmp = directory.rstrip("/") + ".tmp"
+        self._old = directory.rstrip("/") + ".old"
+        if not os.path.exists(directory) and os.path.exists(self._old):
+            os.replace(self._old, directory)  # A previous close() stopped between its two renames
+        shutil.rmtree(self._tmp, ignore_errors=True)
+        os.makedirs(self._tmp)
+        self._vectors = open(os.path.join(self._tmp, "vectors.bin"), "wb")
+        self._metadata = None
+
+    def append(self, vectors, rows):
+        """
+        Append vectors and one metadata dict per vector.
+
+        Args:
+            vectors (np.ndarray | list): (n, dim) embeddings
+            rows (list[dict]): Metadata rows (chunk_id, text, source, ...) in the same order
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if len(vectors) != len(rows):
+            raise ValueError(f"Got {len(vectors)} vectors for {len(rows)} metadata rows")
+        if not rows:
+            return
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+        elif vectors.shape[1] != self.dim:
+            raise ValueError(f"Vector dimension {vectors.shape[1]} does not match the store's {self.dim}")
+        self._vectors.write(np.ascontiguousarray(vectors, dtype=self.dtype).tobytes())
+
+        table = pa.Table.from_pylist(rows)
+        if self._metadata is None:
+            self._metadata = pq.ParquetWriter(os.path.join(self._tmp, "metadata.parquet"), table.schema)
+        self._metadata.write_table(table.cast(self._metadata.schema))
+        self.count += len(rows)
+
+    def close(self, allow_empty=False):
+        """
+        Write the manifest and rename the finished store into place.
+
+        Args:
+            allow_empty (bool): Replace the store even when no vectors were appended;
+                otherwise the write is discarded and ValueError raised
+        """
+        if not self.count and not allow_empty:
+            self.abort()
+            raise ValueError(f"Refusing to replace {self.directory} with an empty store")
+        self._vectors.close()
+        if self._metadata is not None:
+            self._metadata.close()
+        else:
+            pq.write_table(pa.table({"chunk_id": pa.array([], pa.string())}), os.path.join(self._tmp, "metadata.parquet"))
+        with open(os.path.join(self._tmp, "manifest.json"), "w") as file:
+            json.dump({
+                "format_version": FORMAT_VERSION,
+                "model": self.model,
+                "dim": self.dim or 0,
+                "dtype": self.dtype,
+                "count": self.count,
+                "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            }, file, indent=2)
+        # Move the old store aside rather than deleting it first, so it is only ever
+        # missing between two renames and a crash there leaves it recoverable
+        shutil.rmtree(self._old, ignore_errors=True)
+        if os.path.exists(self.directory):
+            os.replace(self.directory, self._old)
+        os.replace(self._tmp, self.directory)
+        shutil.rmtree(self._old, ignore_errors=True)
+
+    def abort(self):
+        """Discard a partly written store, leaving the existing one untouched."""
+        self._vectors.close()
+        if self._metadata is not None:
+            self._metadata.close()
+        shutil.rmtree(self._tmp, ignore_errors=True)
+
+
+class EmbeddingStore:
+    """
+    Read-only view of an embedding store.
+
+    Args:
+        directory (str): Store directory written by EmbeddingStoreWriter
+
+    Attributes:
+        vectors (np.ndarray): (count, dim) memory map in the stored dtype
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, "manifest.json")) as file:
+            self.manifest = json.load(file)
+        if self.manifest["format_version"] != FORMAT_VERSION:
+            raise ValueError(f"Unsupported embedding store version {self.manifest['format_version']} in {directory}")
+        self.model = self.manifest["model"]
+        self.dim = self.manifest["dim"]
+        self.count = self.manifest["count"]
+        if self.count:
+            self.vectors = np.memmap(os.path.join(directory, "vectors.bin"), dtype=self.manifest["dtype"],
+                                     mode="r", shape=(self.count, self.dim))
+        else:
+            self.vectors = np.zeros((0, self.dim), dtype=self.manifest["dtype"])
+        self._metadata_path = os.path.join(directory, "metadata.parquet")
+
+    def __len__(self):
+        return self.count
+
+    @staticmethod
+    def exists(directory):
+        return os.path.exists(os.path.join(directory, "manifest.json"))
+
+    def metadata(self, columns=None):
+        """Metadata as a pyarrow Table, optionally only some columns."""
+        return pq.read_table(self._metadata_path, columns=columns)
+
+    def chunk_ids(self):
+        return self.metadata(["chunk_id"]).column("chunk_id").to_pylist()
+
+    def iter_batches(self, batch_size=1000, columns=None):
+        """
+        Stream the store in order.
+
+        Yields:
+            tuple[np.ndarray, list[dict]]: float32 vectors and metadata rows of one batch
+        """
+        start = 0
+        for batch in pq.ParquetFile(self._metadata_path).iter_batches(batch_size=batch_size, columns=columns):
+            rows = batch.to_pylist()
+            yield np.asarray(self.vectors[start:start + len(rows)], dtype=np.float32), rows
+            start += len(rows)
+
+
+def directory_size(directory):
+    return sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+
+def legacy_chunk(text, source):
+    """Metadata row for a chunk of a legacy CSV, which recorded neither pages nor offsets."""
+    from embedding_cache import content_hash
+
+    return {"chunk_id": content_hash(text), "text": text, "source": source,
+            "page_start": None, "page_end": None, "start_offset": None, "end_offset": None}
+
+def convert_csv(embed_csv, text_csv, directory, model="text-embedding-ada-002", dtype="float32", batch_size=1000,
+                source=None):
+    """
+    Convert a generate_embeddings.py CSV pair into a store, streaming both files.
+
+    Rows get the same chunk_id (content hash) as generate_embeddings.py, and repeated
+    chunks are kept once, so converted stores upload and search like generated ones.
+
+    Args:
+        source (str | None): Source recorded for every chunk; defaults to the text CSV's file name
+    """
+    import pandas as pd
+
+    source = source or os.path.basename(text_csv)
+    writer = EmbeddingStoreWriter(directory, model, dtype)
+    seen = set()
+    try:
+        texts = pd.read_csv(text_csv, chunksize=batch_size, keep_default_na=False)
+        for vectors, rows in zip(pd.read_csv(embed_csv, chunksize=batch_size, dtype=np.float32), texts):
+            chunks = [legacy_chunk(str(text), source) for text in rows["text"]]
+            keep = []
+            for index, chunk in enumerate(chunks):
+                if chunk["chunk_id"] not in seen:
+                    seen.add(chunk["chunk_id"])
+                    keep.append(index)
+            writer.append(vectors.to_numpy()[keep], [chunks[index] for index in keep])
+    except Exception:
+        writer.abort()
+        raise
+    writer.close()
+
+def compare(embed_csv, text_csv, directory):
+    """Print on-disk size and full-load time of the CSV pair against the store."""
+    import pandas as pd
+
+    started = time.perf_counter()
+    csv_vectors = pd.read_csv(embed_csv).to_numpy(dtype=np.float32)
+    csv_texts = pd.read_csv(text_csv)
+    csv_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    store = EmbeddingStore(directory)
+    store_vectors = np.asarray(store.vectors, dtype=np.float32)  # Force the pages in, like the CSV load
+    store_texts = store.metadata()
+    store_seconds = time.perf_counter() - started
+
+    csv_size = os.path.getsize(embed_csv) + os.path.getsize(text_csv)
+    store_size = directory_size(directory)
+    print(f"{'':8} {'size MB':>10} {'load s':>10}")
+    print(f"{'csv':8} {csv_size / 1e6:10.2f} {csv_seconds:10.3f}")
+    print(f"{'store':8} {store_size / 1e6:10.2f} {store_seconds:10.3f}  ({store.manifest['dtype']})")
+    print(f"Store is {csv_size / store_size:.1f}x smaller and loads {csv_seconds / store_seconds:.1f}x faster; "
+          f"max abs difference {np.abs(csv_vectors - store_vectors).max():.2e} over {len(csv_texts)}/{store_texts.num_rows} rows")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect, convert and benchmark embedding stores")
+    commands = parser.add_subparsers(dest="command", required=True)
+    info = commands.add_parser("info", help="Print a store's manifest")
+    info.add_argument("store")
+    convert = commands.add_parser("convert", help="Convert embed.csv and embed_text.csv into a store")
+    convert.add_argument("embed_csv")
+    convert.add_argument("text_csv")
+    convert.add_argument("store")
+    convert.add_argument("--dtype", choices=DTYPES, default="float32")
+    convert.add_argument("--model", default="text-embedding-ada-002")
+    convert.add_argument("--source", help="Source document of the chunks (default: the text CSV's file name)")
+    comparison = commands.add_parser("compare", help="Compare size and load time with the CSV files")
+    comparison.add_argument("embed_csv")
+    comparison.add_argument("text_csv")
+    comparison.add_argument("store")
+    args = parser.parse_args()
+
+    if args.command == "info":
+        store = EmbeddingStore(args.store)
+        print(json.dumps({**store.manifest, "size_bytes": directory_size(args.store)}, indent=2))
+    elif args.command == "convert":
+        convert_csv(args.embed_csv, args.text_csv, args.store, args.model, args.dtype, source=args.source)
+        print(f"Wrote {EmbeddingStore(args.store).count} embeddings to {args.store}")
+    else:
+        compare(args.embed_csv, args.text_csv, args.store)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""
+Local stand-in for the OpenAI embeddings endpoint, for tests and benchmarks.
+
+Serves POST /v1/embeddings with the same request and response shape as
+OpenAI, returning deterministic unit vectors (seeded by the text), and
+enforces requests-per-minute and tokens-per-minute limits like the real API:
+over the limit it answers 429 with retry-after headers, and every response
+carries x-ratelimit-* headers. Optional latency and random 500 errors
+exercise client retries.
+
+Usage:
+    python fake_embeddings_server.py --port 8089 --rpm 3000 --tpm 1000000
+    OPENAI=fake OPENAI_BASE_URL=http://127.0.0.1:8089/v1 python generate_embeddings.py
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+
+class TokenBucket:
+    """Refills at limit per minute and holds at most a tenth of a minute's budget."""
+
+    def __init__(self, per_minute):
+        self.rate = per_minute / 60.0
+        self.capacity = per_minute / 6.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def seconds_until(self, amount):
+        return max(0.0, (amount - self.level) / self.rate)
+
+
+def fake_embedding(text, dim):
+    """Deterministic unit vector for a text."""
+    seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little')
+    vector = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+class FakeEmbeddingsServer:
+    """
+    Threaded HTTP server imitating the OpenAI embeddings API.
+
+    Args:
+        port (int): Port to listen on; 0 picks a free one
+        dim (int): Embedding dimension (1536 like text-embedding-ada-002)
+        requests_per_minute (int): Request rate limit
+        tokens_per_minute (int): Token rate limit (tokens estimated as characters / 4)
+        latency_ms (float): Added processing time per request
+        failure_rate (float): Fraction of requests answered with a 500
+    """
+
+    def __init__(self, port=0, dim=1536, requests_per_minute=3000, tokens_per_minute=1_000_000,
+                 latency_ms=20.0, failure_rate=0.0):
+        self.dim = dim
+        self.latency = latency_ms / 1000.0
+        self.failure_rate = failure_rate
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.lock = threading.Lock()
+        self.counts = {"requests": 0, "rate_limited": 0, "failed": 0}
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                server.handle(self)
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        """Base URL to pass to the client, e.g. http://127.0.0.1:8089/v1."""
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def handle(self, handler):
+        if handler.path.rstrip('/') != "/v1/embeddings":
+            self.respond(handler, 404, {"error": {"message": "Not found"}})
+            return
+        body = json.loads(handler.rfile.read(int(handler.headers.get("Content-Length", 0))))
+        texts = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        tokens = sum(max(1, len(text) // 4) for text in texts)
+
+        with self.lock:
+            self.counts["requests"] += 1
+            self.requests.refill()
+            self.tokens.refill()
+            wait = max(self.requests.seconds_until(1), self.tokens.seconds_until(tokens))
+            if wait == 0:
+                self.requests.level -= 1
+                self.tokens.level -= tokens
+            else:
+                self.counts["rate_limited"] += 1
+            headers = {
+                "x-ratelimit-limit-requests": str(int(self.requests.rate * 60)),
+                "x-ratelimit-remaining-requests": str(int(self.requests.level)),
+                "x-ratelimit-limit-tokens": str(int(self.tokens.rate * 60)),
+                "x-ratelimit-remaining-tokens": str(int(self.tokens.level)),
+                "x-ratelimit-reset-requests": f"{self.requests.seconds_until(self.requests.capacity):.3f}s",
+            }
+        if wait > 0:
+            headers["retry-after-ms"] = str(int(wait * 1000) + 1)
+            headers["retry-after"] = str(int(wait) + 1)
+            self.respond(handler, 429, {"error": {"message": "Rate limit reached", "type": "requests"}}, headers)
+            return
+
+        time.sleep(self.latency)
+        if random.random() < self.failure_rate:
+            with self.lock:
+                self.counts["failed"] += 1
+            self.respond(handler, 500, {"error": {"message": "Internal server error"}}, headers)
+            return
+
+        data = [{"object": "embedding", "index": index, "embedding": fake_embedding(text, self.dim).tolist()}
+                for index, text in enumerate(texts)]
+        self.respond(handler, 200, {
+            "object": "list",
+            "data": data,
+            "model": body.get("model"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        }, headers)
+
+    def respond(self, handler, status, payload, headers=None):
+        encoded = json.dumps(payload).encode('utf-8')
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(encoded)))
+        for name, value in (headers or {}).items():
+            handler.send_header(name, value)
+        handler.end_headers()
+        handler.wfile.write(encoded)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local fake OpenAI embeddings server")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--rpm", type=int, default=3000, help="Requests per minute")
+    parser.add_argument("--tpm", type=int, default=1_000_000, help="Tokens per minute")
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = FakeEmbeddingsServer(args.port, args.dim, args.rpm, args.tpm, args.latency_ms, args.failure_rate)
+    print(f"Fake embeddings API listening on {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(f"Served {server.counts}")
+
+
+if __name__ == "__main__":
+    main()
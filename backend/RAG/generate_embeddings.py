@@ -1,127 +1,90 @@
+import argparse
+import json
 import os
 import requests
-import openai
-import pandas as pd
-import PyPDF2
-import torch
-from sentence_transformers import SentenceTransformer
 from dotenv import load_dotenv
 
+from embedding_cache import EmbeddingCache, content_hash, diff_chunks
+from embedding_backends import embedding_backend_from_env
+from embedding_store import EmbeddingStore, EmbeddingStoreWriter
+from pdf_ingest import IngestStats, ingest
+
 # Load environment variables
 load_dotenv()
+# Default input: a single PDF or a directory of PDFs
 pdf_path="/Users/vs/Downloads/What is Acne.pdf"
-def extract_text_from_pdf(pdf_path):
-    """Extract text from a PDF file"""
-    text = ""
-    with open(pdf_path, 'rb') as file:
-        pdf_reader = PyPDF2.PdfReader(file)
-        for page_num in range(len(pdf_reader.pages)):
-            page = pdf_reader.pages[page_num]
-            text += page.extract_text()
-    return text
-
-def split_text_into_chunks(text, chunk_size=1000, overlap=200):
-    """Split text into overlapping chunks of approximately chunk_size characters"""
-    print(f"Starting to split text of length {len(text)} into chunks with size={chunk_size}, overlap={overlap}")
-    chunks = []
-    start = 0
-
-    while start < len(text):
-        # Find a good break point near chunk_size
-        end = min(start + chunk_size, len(text))
-
-        # Only look for natural break points if we're not at the end of the text
-        if end < len(text):
-            # Try to find a period, question mark, exclamation mark, or newline to break at
-            for char in ['. ', '? ', '! ', '\n']:
-                pos = text.rfind(char, start, end)
-                if pos != -1:
-                    end = pos + 2  # Include the period and space
-                    break
-
-        # Ensure we're getting a substantial chunk
-        if end <= start:
-            end = min(start + chunk_size, len(text))
-
-        chunk_text = text[start:end].strip()
-
-        # Only add non-empty chunks
-        if chunk_text:
-            chunks.append(chunk_text)
-
-        # Move the start position for the next chunk, ensuring we don't move backwards
-        start = max(start + chunk_size - overlap, end - overlap)
-
-        # If we can't advance, force advancement to avoid infinite loop
-        if start >= end:
-            start = end
-
-    print(f"Finished splitting text into {len(chunks)} chunks")
-    return chunks
-
-def generate_embeddings_using_openai(texts):
-    """Generate embeddings using OpenAI's text-embedding-ada-002 model"""
-    # Get OpenAI API key from environment variable
-    openai_api_key = os.getenv("OPENAI")
-    if not openai_api_key:
-        raise ValueError("OPENAI environment variable not set")
-
-    # Initialize the OpenAI client
-    client = openai.OpenAI(api_key=openai_api_key)
-
-    # Initialize a list to store all embeddings
-    all_embeddings = []
-
-    # Process chunks in batches to avoid hitting rate limits
-    batch_size = 20
-    total_batches = (len(texts) - 1) // batch_size + 1
-
-    for i in range(0, len(texts), batch_size):
-        batch = texts[i:i+batch_size]
-        print(f"Processing batch {i//batch_size + 1}/{total_batches}")
-
-        # Call OpenAI API to get embeddings for the batch (new API format)
-        response = client.embeddings.create(
-            model="text-embedding-ada-002",
-            input=batch
-        )
-
-        # Extract embeddings from response (new response format)
-        batch_embeddings = [data_item.embedding for data_item in response.data]
-        all_embeddings.extend(batch_embeddings)
-
-    return all_embeddings
 
 def main():
+    parser = argparse.ArgumentParser(description="Chunk and embed a PDF or a directory of PDFs into the embedding store")
+    parser.add_argument("pdf_path", nargs="?", default=pdf_path, help="PDF file or directory of PDFs")
+    parser.add_argument("--allow-empty", action="store_true",
+                        help="Replace the store even if the run yields no chunks or removes every existing chunk")
+    args = parser.parse_args()
+
     # Configuration
-    output_path = "/Users/vs/Coding/DermAI/backend/RAG/embed.csv"
+    store_path = "/Users/vs/Coding/DermAI/backend/RAG/embed_store"
+    diff_output_path = os.path.join(os.path.dirname(store_path), "embed_diff.json")
+    cache_path = os.getenv("EMBED_CACHE_PATH", os.path.join(os.path.dirname(store_path), "embedding_cache.sqlite"))
+    # OpenAI by default; EMBED_BACKEND=local embeds offline with sentence-transformers
+    backend = embedding_backend_from_env()
+    model = backend.model_id
+    group_size = 2000  # Chunks embedded and written at a time
     # use_api = input("Use Hugging Face API? (y/n): ").lower().startswith('y')
 
-    print(f"Extracting text from {pdf_path}...")
-    text = extract_text_from_pdf(pdf_path)
-    print(text)
-    print(f"Extracted {len(text)} characters")
-
-    print("Splitting text into chunks...")
-    chunks = split_text_into_chunks(text)
-    print(f"Split into {len(chunks)} chunks")
-
-    print("Generating embeddings...")
-    embeddings = generate_embeddings_using_openai(chunks)
-
-    # Save embeddings
-    df_embeddings = pd.DataFrame(embeddings)
-
-    # Also save the text chunks for reference
-    df_text = pd.DataFrame({"text": chunks})
-
-    # Save both to CSV
-    df_embeddings.to_csv(output_path, index=False)
-    text_output_path = output_path.replace('.csv', '_text.csv')
-    df_text.to_csv(text_output_path, index=False)
-
-    print(f"Embeddings saved to {output_path}")
-    print(f"Text chunks saved to {text_output_path}")
+    previous_ids = EmbeddingStore(store_path).chunk_ids() if EmbeddingStore.exists(store_path) else []
+    cache = EmbeddingCache(cache_path)
+    writer = EmbeddingStoreWriter(store_path, model, os.getenv("EMBED_STORE_DTYPE", "float32"))
+    stats = IngestStats()
+    chunk_ids = []
+    seen = set()
+    group = []
+
+    def write_group():
+        embeddings = cache.embed(model, [chunk["text"] for chunk in group], backend.embed)
+        writer.append(embeddings, group)
+        group.clear()
+
+    print(f"Extracting, chunking and embedding {args.pdf_path}...")
+    try:
+        for chunk in ingest(args.pdf_path, stats=stats):
+            # Chunks are identified by their content hash; identical chunks are kept once
+            chunk_id = content_hash(chunk["text"])
+            if chunk_id in seen:
+                continue
+            seen.add(chunk_id)
+            chunk_ids.append(chunk_id)
+            group.append({"chunk_id": chunk_id, **chunk})
+            if len(group) == group_size:
+                write_group()
+        if group:
+            write_group()
+        # Swapping in a store without any of the old chunks would make --incremental uploads delete them all
+        if not chunk_ids and not args.allow_empty:
+            raise ValueError(f"No text chunks extracted from {args.pdf_path}; keeping the existing store "
+                             f"(pass --allow-empty to replace it anyway)")
+        diff = diff_chunks(previous_ids, chunk_ids)
+        if previous_ids and not diff["unchanged"] and not args.allow_empty:
+            raise ValueError(f"{args.pdf_path} shares no chunks with the existing store, so all {len(previous_ids)} "
+                             f"would be removed; keeping it (pass --allow-empty to replace it anyway)")
+    except BaseException:
+        writer.abort()
+        raise
+    finally:
+        if hasattr(backend, "close"):
+            backend.close()
+    writer.close(allow_empty=args.allow_empty)
+    print(f"Ingested {stats.report()}")
+    print(f"Embedding model: {model} ({writer.dim} dimensions)")
+
+    cache_stats = cache.stats()
+    print(f"Embedded {cache_stats['misses']} new or changed chunks, reused {cache_stats['hits']} from {cache_path}")
+
+    print(f"Chunks added: {len(diff['added'])}, removed: {len(diff['removed'])}, unchanged: {len(diff['unchanged'])}")
+    with open(diff_output_path, 'w') as file:
+        json.dump(diff, file, indent=2)
+
+    print(f"Embeddings and chunks saved to {store_path}")
+    print(f"Chunk diff saved to {diff_output_path}")
 
 if __name__ == "__main__":
     main()
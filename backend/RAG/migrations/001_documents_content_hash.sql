@@ -0,0 +1,22 @@
+-- Stable key for idempotent uploads from backend/RAG/upload_embeddings.py.
+-- Rows inserted by the web app keep a NULL content_hash, which the unique index allows.
+--
+-- The documents table is created if missing, so the same script prepares a
+-- local Postgres + pgvector stand-in for the Supabase database, with the same
+-- columns as dermai/database.types.ts (the source is kept in file_metadata).
+
+create extension if not exists vector;
+
+create table if not exists documents (
+    id bigserial primary key,
+    title text,
+    body text,
+    embedding vector(1536),
+    file_metadata jsonb
+);
+
+alter table documents add column if not exists content_hash text;
+
+-- Plain (not partial) unique index so that ON CONFLICT (content_hash) and
+-- PostgREST upserts with on_conflict=content_hash can use it
+create unique index if not exists documents_content_hash_key on documents (content_hash);
@@ -0,0 +1,235 @@
+"""
+Parallel, streaming ingestion of a directory of PDFs into overlapping text chunks.
+
+- Page text is extracted in a process pool, a few pages per task, so PyPDF2
+  parsing uses every core. At most a bounded number of tasks are in flight
+  and their pages are consumed in document order.
+- chunk_pages() is a generator: it keeps only the text the next chunk still
+  needs, so memory stays flat whatever the size of the corpus.
+- Chunks split the same way as before (about chunk_size characters, broken
+  at a sentence end or newline, with overlap), and carry their source file,
+  page range and character offsets within the document.
+
+Usage:
+    python pdf_ingest.py "/Users/vs/Downloads/DermAI PDFs" --output chunks.jsonl --workers 8
+"""
+import argparse
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import PyPDF2
+
+BREAK_POINTS = ['. ', '? ', '! ', '\n']
+
+# Reader of the last PDF opened in this worker process
+_reader_path = None
+_reader = None
+
+
+def _open(path):
+    global _reader_path, _reader
+    if path != _reader_path:
+        _reader = PyPDF2.PdfReader(path)
+        _reader_path = path
+    return _reader
+
+def _page_count(path):
+    return len(_open(path).pages)
+
+def _extract_pages(path, first, last):
+    """Extract the text of pages [first, last) of a PDF in a worker process."""
+    reader = _open(path)
+    return [(page_number, reader.pages[page_number].extract_text() or "") for page_number in range(first, last)]
+
+def pdf_files(path):
+    """The PDF itself, or every PDF (.pdf in any case) under a directory in name order."""
+    if os.path.isfile(path):
+        return [path]
+    if not os.path.isdir(path):
+        raise FileNotFoundError(f"No PDF file or directory at {path}")
+    files = sorted(os.path.join(directory, name) for directory, _, names in os.walk(path)
+                   for name in names if name.lower().endswith(".pdf"))
+    if not files:
+        raise ValueError(f"No PDF files found under {path}")
+    return files
+
+def chunk_pages(source, pages, chunk_size=1000, overlap=200):
+    """
+    Split a document's pages into overlapping chunks of approximately chunk_size characters.
+
+    Pages are joined without a separator, as PyPDF2 text always was, so a
+    single document splits exactly like the whole-string version.
+
+    Args:
+        source (str): Source file recorded on each chunk
+        pages (iterable[tuple[int, str]]): (0-based page number, text) in order
+        chunk_size (int): Target chunk length in characters
+        overlap (int): Characters shared by consecutive chunks
+
+    Yields:
+        dict: text, source, page_start, page_end (1-based, inclusive),
+        start_offset and end_offset (characters within the document)
+    """
+    buffer = ""
+    buffer_offset = 0  # Document offset of buffer[0]
+    page_starts = deque()  # (document offset, page number) of pages still in the buffer
+    start = 0
+    total = 0
+    pages = iter(pages)
+    exhausted = False
+
+    def page_at(offset):
+        page_number = page_starts[0][1]
+        for page_offset, number in page_starts:
+            if page_offset > offset:
+                break
+            page_number = number
+        return page_number + 1
+
+    while True:
+        # Read pages until the next chunk is fully buffered
+        while not exhausted and total <= start + chunk_size:
+            try:
+                page_number, page_text = next(pages)
+            except StopIteration:
+                exhausted = True
+                break
+            page_starts.append((total, page_number))
+            buffer += page_text
+            total += len(page_text)
+        if start >= total:
+            return
+
+        end = min(start + chunk_size, total)
+
+        # Only look for natural break points if we're not at the end of the text
+        if end < total:
+            for char in BREAK_POINTS:
+                pos = buffer.rfind(char, start - buffer_offset, end - buffer_offset)
+                if pos != -1:
+                    end = pos + buffer_offset + 2  # Include the period and space
+                    break
+
+        # Ensure we're getting a substantial chunk
+        if end <= start:
+            end = min(start + chunk_size, total)
+
+        raw = buffer[start - buffer_offset:end - buffer_offset]
+        chunk_text = raw.strip()
+        if chunk_text:
+            chunk_start = start + len(raw) - len(raw.lstrip())
+            chunk_end = chunk_start + len(chunk_text)
+            yield {
+                "text": chunk_text,
+                "source": source,
+                "page_start": page_at(chunk_start),
+                "page_end": page_at(chunk_end - 1),
+                "start_offset": chunk_start,
+                "end_offset": chunk_end,
+            }
+
+        # Move the start position for the next chunk, ensuring we don't move backwards
+        start = max(start + chunk_size - overlap, end - overlap)
+        if start >= end:
+            start = end
+
+        # Drop text and pages the next chunk no longer needs
+        if start > buffer_offset:
+            buffer = buffer[start - buffer_offset:]
+            buffer_offset = start
+        while len(page_starts) > 1 and page_starts[1][0] <= start:
+            page_starts.popleft()
+
+
+class IngestStats:
+    """Pages, chunks and characters processed, for throughput reporting."""
+
+    def __init__(self):
+        self.files = 0
+        self.pages = 0
+        self.chunks = 0
+        self.characters = 0
+        self.started = time.perf_counter()
+
+    def report(self):
+        elapsed = time.perf_counter() - self.started
+        return (f"{self.files} files, {self.pages} pages, {self.chunks} chunks in {elapsed:.2f}s: "
+                f"{self.pages / elapsed:.1f} pages/s, {self.chunks / elapsed:.1f} chunks/s")
+
+
+def ingest(path, workers=None, pages_per_task=8, chunk_size=1000, overlap=200, stats=None):
+    """
+    Stream chunks from a PDF or a directory of PDFs.
+
+    Args:
+        path (str): PDF file or directory searched recursively for PDFs
+        workers (int | None): Extraction processes (default: all cores)
+        pages_per_task (int): Pages extracted per pool task
+        chunk_size (int): Target chunk length in characters
+        overlap (int): Characters shared by consecutive chunks
+        stats (IngestStats | None): Updated as chunks are produced
+
+    Yields:
+        dict: Chunks as produced by chunk_pages(), documents in name order
+    """
+    stats = stats or IngestStats()
+    files = pdf_files(path)
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(workers) as pool:
+        counts = list(pool.map(_page_count, files))
+        tasks = iter([(file, first, min(first + pages_per_task, count))
+                      for file, count in zip(files, counts) for first in range(0, count, pages_per_task)])
+        window = deque()
+
+        def fill():
+            # Keep every worker busy without extracting far ahead of the chunker
+            while len(window) < workers * 2:
+                task = next(tasks, None)
+                if task is None:
+                    return
+                window.append((task[0], pool.submit(_extract_pages, *task)))
+
+        def document_pages(file):
+            while window and window[0][0] == file:
+                _, future = window.popleft()
+                fill()
+                for page_number, page_text in future.result():
+                    stats.pages += 1
+                    stats.characters += len(page_text)
+                    yield page_number, page_text
+
+        fill()
+        for file in files:
+            stats.files += 1
+            for chunk in chunk_pages(file, document_pages(file), chunk_size, overlap):
+                stats.chunks += 1
+                yield chunk
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract and chunk a directory of PDFs")
+    parser.add_argument("path", help="PDF file or directory of PDFs")
+    parser.add_argument("--output", help="JSON-lines file for the chunks (default: only report throughput)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--pages-per-task", type=int, default=8)
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--overlap", type=int, default=200)
+    args = parser.parse_args()
+
+    stats = IngestStats()
+    chunks = ingest(args.path, args.workers, args.pages_per_task, args.chunk_size, args.overlap, stats)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            for chunk in chunks:
+                file.write(json.dumps(chunk) + "\n")
+    else:
+        for _ in chunks:
+            pass
+    print(f"Ingested {stats.report()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,67 +1,368 @@
+"""
+Upload the embedding store to the documents table, idempotently and in parallel.
+
+- Rows are upserted on content_hash (the chunk id), so re-running the upload
+  updates rows in place instead of duplicating them. Apply
+  migrations/001_documents_content_hash.sql once first.
+- Batches are sized by serialized payload (--max-batch-bytes) rather than
+  row count, and --concurrency of them are in flight at once.
+- A failed batch is retried with jittered exponential backoff. Batches that
+  still fail make the upload exit with an error instead of being skipped.
+- Every uploaded batch is recorded in a progress log next to the store, so an
+  interrupted upload resumes where it stopped: rerun the same command.
+- --incremental applies embed_diff.json: only added chunks are uploaded and
+  removed chunks are deleted.
+
+Sinks:
+    supabase   Supabase documents table (SUPABASE_URL, SUPABASE_KEY)
+    postgres   Postgres with pgvector through psycopg (--dsn or DATABASE_URL)
+    sqlite     Local SQLite stand-in table (--sqlite-path), for development and tests
+
+Usage:
+    python upload_embeddings.py
+    python upload_embeddings.py --incremental --concurrency 8
+    python upload_embeddings.py --sink sqlite --sqlite-path documents.sqlite
+"""
+import argparse
+import json
 import os
-import pandas as pd
-import numpy as np
-from supabase import create_client
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+
 from dotenv import load_dotenv
 
+from embedding_store import EmbeddingStore
+
 # Load environment variables
 load_dotenv()
 
-def upload_embeddings_to_supabase():
-    # Get Supabase credentials from environment variables
-    supabase_url = os.getenv("SUPABASE_URL")
-    supabase_key = os.getenv("SUPABASE_KEY")
+WEB_APP_MODEL = "text-embedding-ada-002"  # dermai/lib/ai/embedding.ts embeds queries with this model
+
+
+class SupabaseDocumentsSink:
+    """Upsert into the Supabase documents table through supabase-py."""
+
+    def __init__(self):
+        from supabase import create_client
+
+        supabase_url = os.getenv("SUPABASE_URL")
+        supabase_key = os.getenv("SUPABASE_KEY")
+        if not supabase_url or not supabase_key:
+            raise ValueError("SUPABASE_URL and SUPABASE_KEY must be set in environment variables")
+        self.client = create_client(supabase_url, supabase_key)
+
+    def upsert(self, rows):
+        self.client.table("documents").upsert(rows, on_conflict="content_hash").execute()
+
+    def delete(self, content_hashes):
+        self.client.table("documents").delete().in_("content_hash", content_hashes).execute()
+
+
+class PostgresDocumentsSink:
+    """
+    Upsert into a Postgres documents table with pgvector, one connection per thread.
+
+    Args:
+        dsn (str): libpq connection string
+    """
+
+    def __init__(self, dsn):
+        import psycopg
+
+        self.psycopg = psycopg
+        self.dsn = dsn
+        self._local = threading.local()
+
+    def _connection(self):
+        if getattr(self._local, "connection", None) is None or self._local.connection.closed:
+            self._local.connection = self.psycopg.connect(self.dsn, autocommit=True)
+        return self._local.connection
+
+    def upsert(self, rows):
+        connection = self._connection()
+        try:
+            with connection.cursor() as cursor:
+                cursor.executemany(
+                    "INSERT INTO documents (content_hash, title, body, embedding, file_metadata) "
+                    "VALUES (%s, %s, %s, %s::vector, %s::jsonb) "
+                    "ON CONFLICT (content_hash) DO UPDATE SET title = EXCLUDED.title, body = EXCLUDED.body, "
+                    "embedding = EXCLUDED.embedding, file_metadata = EXCLUDED.file_metadata",
+                    [(row["content_hash"], row["title"], row["body"], row["embedding"], json.dumps(row["file_metadata"]))
+                     for row in rows],
+                )
+        except self.psycopg.OperationalError:
+            connection.close()  # Reconnect on the retry
+            raise
+
+    def delete(self, content_hashes):
+        with self._connection().cursor() as cursor:
+            cursor.execute("DELETE FROM documents WHERE content_hash = ANY(%s)", (content_hashes,))
+
+
+class SqliteDocumentsSink:
+    """
+    Local stand-in for the documents table in a SQLite file.
 
-    if not supabase_url or not supabase_key:
-        raise ValueError("SUPABASE_URL and SUPABASE_KEY must be set in environment variables")
+    Args:
+        path (str): Database file, created if missing
+    """
 
-    # Create Supabase client
-    supabase = create_client(supabase_url, supabase_key)
+    def __init__(self, path):
+        self.path = path
+        with sqlite3.connect(path) as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS documents (id INTEGER PRIMARY KEY AUTOINCREMENT, title TEXT, body TEXT, "
+                "embedding TEXT, file_metadata TEXT, content_hash TEXT UNIQUE)"
+            )
 
-    # Load embeddings and text chunks
-    embed_file_path = "/Users/vs/Coding/DermAI/backend/RAG/embed.csv"
-    text_file_path = "/Users/vs/Coding/DermAI/backend/RAG/embed_text.csv"
+    def upsert(self, rows):
+        with sqlite3.connect(self.path, timeout=30) as connection:
+            connection.executemany(
+                "INSERT INTO documents (content_hash, title, body, embedding, file_metadata) "
+                "VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (content_hash) DO UPDATE SET title = excluded.title, body = excluded.body, "
+                "embedding = excluded.embedding, file_metadata = excluded.file_metadata",
+                [(row["content_hash"], row["title"], row["body"], row["embedding"], json.dumps(row["file_metadata"]))
+                 for row in rows],
+            )
 
-    df_embeddings = pd.read_csv(embed_file_path)
-    df_text = pd.read_csv(text_file_path)
+    def delete(self, content_hashes):
+        with sqlite3.connect(self.path, timeout=30) as connection:
+            connection.execute(
+                f"DELETE FROM documents WHERE content_hash IN ({','.join('?' * len(content_hashes))})", content_hashes
+            )
 
-    print(f"Loaded {len(df_embeddings)} embeddings and {len(df_text)} text chunks")
+    def count(self):
+        """Number of rows in the table."""
+        with sqlite3.connect(self.path) as connection:
+            return connection.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
 
-    # Check that we have the same number of embeddings as text chunks
-    if len(df_embeddings) != len(df_text):
-        raise ValueError(f"Number of embeddings ({len(df_embeddings)}) doesn't match number of text chunks ({len(df_text)})")
 
-    # Convert embeddings to list format
-    embeddings = df_embeddings.values.tolist()
-    text_chunks = df_text['text'].tolist()
+def format_vector(embedding):
+    """pgvector text form; 9 significant digits round-trip float32 exactly."""
+    return "[" + ",".join(map("{:.9g}".format, embedding.tolist())) + "]"
 
-    # Prepare data for insertion
-    data_to_insert = []
-    for i, (embedding, text) in enumerate(zip(embeddings, text_chunks)):
-        data_to_insert.append({
-            "title": f"Resume Chunk {i+1}",  # Using chunk number as title
-            "body": text,                    # The text content goes in the body field
-            "embedding": embedding           # The embedding vector
-        })
+def document_row(embedding, chunk):
+    """documents row for one chunk of the store; like the web app, the source lives in file_metadata."""
+    return {
+        "content_hash": chunk["chunk_id"],
+        "title": os.path.basename(chunk["source"]),
+        "body": chunk["text"].replace("\x00", ""),
+        "embedding": format_vector(embedding),
+        "file_metadata": {
+            "source": os.path.basename(chunk["source"]),
+            "page_start": chunk["page_start"],
+            "page_end": chunk["page_end"],
+            "start_offset": chunk["start_offset"],
+            "end_offset": chunk["end_offset"],
+        },
+    }
 
-    print(f"Prepared {len(data_to_insert)} items for insertion")
+def byte_batches(rows, max_batch_bytes, max_batch_rows):
+    """
+    Group rows into batches whose JSON payload stays under max_batch_bytes.
 
-    # Insert data into Supabase in batches
-    batch_size = 100
-    for i in range(0, len(data_to_insert), batch_size):
-        batch = data_to_insert[i:i+batch_size]
-        print(f"Uploading batch {i//batch_size + 1}/{(len(data_to_insert)-1)//batch_size + 1}")
+    Yields:
+        tuple[list[dict], int]: Rows and their payload size in bytes
+    """
+    batch, size = [], 0
+    for row in rows:
+        row_size = len(json.dumps(row))
+        if batch and (size + row_size > max_batch_bytes or len(batch) == max_batch_rows):
+            yield batch, size
+            batch, size = [], 0
+        batch.append(row)
+        size += row_size
+    if batch:
+        yield batch, size
 
+
+class ProgressLog:
+    """
+    Append-only record of uploaded content hashes, tied to one build of the store.
+
+    Args:
+        path (str): JSON-lines log file
+        store_id (str): Identifies the store build; a log for another build is discarded
+    """
+
+    def __init__(self, path, store_id, restart=False):
+        self.path = path
+        self.done = set()
+        self._lock = threading.Lock()
+        if not restart and os.path.exists(path):
+            with open(path, encoding="utf-8") as file:
+                lines = [json.loads(line) for line in file if line.strip()]
+            if lines and lines[0].get("store_id") == store_id:
+                for line in lines[1:]:
+                    self.done.update(line["content_hashes"])
+            else:
+                restart = True
+        if restart or not os.path.exists(path):
+            with open(path, "w", encoding="utf-8") as file:
+                file.write(json.dumps({"store_id": store_id}) + "\n")
+
+    def record(self, content_hashes):
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as file:
+                file.write(json.dumps({"content_hashes": content_hashes}) + "\n")
+                file.flush()
+                os.fsync(file.fileno())
+            self.done.update(content_hashes)
+
+
+class Uploader:
+    """
+    Upsert batches with bounded concurrency and retries.
+
+    Args:
+        sink: Object with upsert(rows) and delete(content_hashes), raising on failure
+        progress (ProgressLog): Where finished batches are recorded
+        concurrency (int): Batches in flight
+        max_retries (int): Retries of a failed batch
+        backoff (float): First retry delay in seconds, doubled on every retry
+        max_backoff (float): Upper bound on the retry delay
+    """
+
+    def __init__(self, sink, progress, concurrency=4, max_retries=5, backoff=0.5, max_backoff=30.0):
+        self.sink = sink
+        self.progress = progress
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._lock = threading.Lock()
+        self.counts = {"rows": 0, "batches": 0, "bytes": 0, "retries": 0, "failed_rows": 0, "failed_batches": 0}
+
+    def _count(self, **amounts):
+        with self._lock:
+            for name, amount in amounts.items():
+                self.counts[name] += amount
+
+    def _with_retries(self, operation, *args):
+        delay = self.backoff
+        for attempt in range(self.max_retries + 1):
+            try:
+                return operation(*args)
+            except Exception as e:
+                if attempt == self.max_retries:
+                    raise
+                print(f"Batch failed ({str(e)}), retrying")
+                self._count(retries=1)
+                # Full jitter keeps concurrent batches from retrying in lockstep
+                time.sleep(random.uniform(0, delay))
+                delay = min(delay * 2, self.max_backoff)
+
+    def _upload_batch(self, rows, size):
         try:
-            response = supabase.table("documents").insert(batch).execute()
-            print(f"Successfully uploaded batch")
+            self._with_retries(self.sink.upsert, rows)
         except Exception as e:
-            print(f"Error uploading batch: {str(e)}")
+            print(f"Error uploading batch of {len(rows)} rows after {self.max_retries} retries: {str(e)}")
+            self._count(failed_rows=len(rows), failed_batches=1)
+            return
+        self.progress.record([row["content_hash"] for row in rows])
+        self._count(rows=len(rows), batches=1, bytes=size)
+
+    def upload(self, batches):
+        """
+        Upload (rows, size) batches, keeping at most `concurrency` in flight.
+
+        Sink failures are counted after retries; any other error (e.g. writing the
+        progress log) is re-raised.
+        """
+        with ThreadPoolExecutor(self.concurrency, thread_name_prefix="upload") as executor:
+            in_flight = set()
+            for rows, size in batches:
+                if len(in_flight) >= self.concurrency:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+                in_flight.add(executor.submit(self._upload_batch, rows, size))
+            for future in as_completed(in_flight):
+                future.result()
+
+    def delete(self, content_hashes, batch_size=100):
+        """Delete rows by content_hash; small batches keep Supabase's in.(...) filter URL short."""
+        for start in range(0, len(content_hashes), batch_size):
+            self._with_retries(self.sink.delete, content_hashes[start:start + batch_size])
+
+
+def create_sink(args):
+    if args.sink == "sqlite":
+        return SqliteDocumentsSink(args.sqlite_path)
+    if args.sink == "postgres":
+        if not args.dsn:
+            raise ValueError("--dsn or DATABASE_URL must be set for the postgres sink")
+        return PostgresDocumentsSink(args.dsn)
+    return SupabaseDocumentsSink()
+
+def upload_embeddings(args):
+    store = EmbeddingStore(args.store)
+    print(f"Loaded {len(store)} embeddings ({store.manifest['dtype']}, dim {store.dim}) from {args.store}")
+
+    if store.model != WEB_APP_MODEL and args.sink != "sqlite" and not args.allow_any_model:
+        raise ValueError(f"{args.store} holds {store.model} embeddings, but the web app searches documents with "
+                         f"{WEB_APP_MODEL} query embeddings; pass --allow-any-model to upload anyway")
+
+    sink = create_sink(args)
+    progress_path = args.progress_log or os.path.join(os.path.dirname(os.path.abspath(args.store)), "upload_progress.jsonl")
+    store_id = f"{store.manifest['created_at']}:{store.count}"
+    progress = ProgressLog(progress_path, store_id, restart=args.restart)
+    uploader = Uploader(sink, progress, args.concurrency, args.max_retries)
+
+    wanted = None
+    removed = []
+    if args.incremental:
+        with open(args.diff) as file:
+            diff = json.load(file)
+        wanted = set(diff["added"])
+        removed = diff["removed"]
+        print(f"Applying {args.diff}: {len(diff['added'])} added, {len(removed)} removed")
+    if progress.done:
+        print(f"Resuming: {len(progress.done)} rows already uploaded according to {progress_path}")
+
+    def pending_rows():
+        for embeddings, chunks in store.iter_batches(1000):
+            for embedding, chunk in zip(embeddings, chunks):
+                if chunk["chunk_id"] in progress.done or (wanted is not None and chunk["chunk_id"] not in wanted):
+                    continue
+                yield document_row(embedding, chunk)
+
+    started = time.perf_counter()
+    uploader.upload(byte_batches(pending_rows(), args.max_batch_bytes, args.max_batch_rows))
+    if removed:
+        uploader.delete(removed)
+    elapsed = time.perf_counter() - started
 
+    counts = uploader.counts
+    print(f"Uploaded {counts['rows']} rows in {counts['batches']} batches ({counts['bytes'] / 1e6:.1f} MB, "
+          f"{counts['retries']} retries) in {elapsed:.1f}s: {counts['rows'] / elapsed:.0f} rows/s")
+    if removed:
+        print(f"Deleted {len(removed)} removed chunks")
+    if counts["failed_batches"]:
+        raise Exception(f"Failed to upload {counts['failed_rows']} rows in {counts['failed_batches']} batches; "
+                        f"rerun to resume from {progress_path}")
     print("Upload complete!")
 
 def main():
-    upload_embeddings_to_supabase()
+    parser = argparse.ArgumentParser(description="Upsert the embedding store into the documents table")
+    parser.add_argument("--store", default="/Users/vs/Coding/DermAI/backend/RAG/embed_store")
+    parser.add_argument("--sink", choices=("supabase", "postgres", "sqlite"), default="supabase")
+    parser.add_argument("--dsn", default=os.getenv("DATABASE_URL"), help="Postgres connection string")
+    parser.add_argument("--sqlite-path", default="documents.sqlite")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--max-batch-bytes", type=int, default=2_000_000)
+    parser.add_argument("--max-batch-rows", type=int, default=500)
+    parser.add_argument("--max-retries", type=int, default=5)
+    parser.add_argument("--progress-log", help="Default: upload_progress.jsonl next to the store")
+    parser.add_argument("--restart", action="store_true", help="Ignore the progress log and upload everything")
+    parser.add_argument("--incremental", action="store_true", help="Only apply the chunk diff of the last generation run")
+    parser.add_argument("--diff", default="/Users/vs/Coding/DermAI/backend/RAG/embed_diff.json")
+    parser.add_argument("--allow-any-model", action="store_true", help="Upload embeddings not made by the web app's model")
+    upload_embeddings(parser.parse_args())
 
 if __name__ == "__main__":
     main()
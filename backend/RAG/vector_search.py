@@ -0,0 +1,432 @@
+"""
+In-process vector search over the chunk embeddings, for RAG retrieval without a database round trip.
+
+An index is built from the embedding store written by generate_embeddings.py
+and lives in its own directory, every array memory-mapped and grown in place:
+    manifest.json         model, dim, count, capacity and IVF settings
+    vectors.bin           (capacity, dim) float32 unit vectors
+    metadata.jsonl        one JSON line per row: chunk_id, text, source, pages
+    offsets.bin           (capacity + 1,) uint64 byte offsets of the metadata lines
+    centroids.npy, assignments.bin   IVF coarse quantizer, once trained
+
+Search:
+    exact   cosine top-k over all rows, one matrix product per block of
+            rows for a whole batch of queries
+    IVF     only the nprobe lists whose centroids are nearest the query are
+            scanned; nprobe is the recall/latency knob (nlist scans everything)
+
+add() appends rows and assigns them to their IVF list right away, so inserts
+are searchable in both modes without retraining; retrain once the data has
+drifted far from the centroids.
+
+Usage:
+    python vector_search.py build embed_store chunk_index --nlist 256
+    python vector_search.py query chunk_index "How is acne treated?" --k 5
+    python vector_search.py bench chunk_index --queries 500 --k 10 --nprobe 1 4 16 64
+    python vector_search.py bench /tmp/synthetic_index --synthetic 200000
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from embedding_store import EmbeddingStore
+
+BLOCK_ROWS = 65536  # Rows scored per matrix product, bounding temporary memory
+
+
+def _unit_rows(vectors, dim):
+    vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, dim)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+def _top_k(scores, k):
+    """Indices of the k highest scores in each row, best first."""
+    k = min(k, scores.shape[1])
+    if k == 0:
+        return np.empty((len(scores), 0), dtype=np.int64)
+    candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, candidates, axis=1), axis=1)
+    return np.take_along_axis(candidates, order, axis=1)
+
+def _replace_directory(built, directory):
+    """Rename a freshly built index over directory, moving the old one aside until the new one is in place."""
+    old = directory.rstrip("/") + ".old"
+    shutil.rmtree(old, ignore_errors=True)
+    if os.path.exists(directory):
+        os.replace(directory, old)
+    os.replace(built, directory)
+    shutil.rmtree(old, ignore_errors=True)
+
+
+class VectorIndex:
+    """
+    Persistent cosine-similarity index with exact and IVF search.
+
+    Args:
+        directory (str): Index directory, created if missing
+        dim (int | None): Vector dimension, required when creating an index
+        model (str | None): Embedding model the vectors come from, recorded in the manifest
+        initial_capacity (int): Rows allocated when creating an index
+    """
+
+    def __init__(self, directory, dim=None, model=None, initial_capacity=1024):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+
+        manifest_path = os.path.join(directory, "manifest.json")
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as file:
+                manifest = json.load(file)
+            self.dim = manifest["dim"]
+            self.model = manifest["model"]
+            self.count = manifest["count"]
+            self.capacity = manifest["capacity"]
+        elif dim is None:
+            raise ValueError(f"No index in {directory}; pass dim to create one")
+        else:
+            self.dim = dim
+            self.model = model
+            self.count = 0
+            self.capacity = initial_capacity
+
+        self._open_arrays()
+        metadata_path = os.path.join(directory, "metadata.jsonl")
+        # Drop metadata lines written by an append that did not reach the manifest
+        with open(metadata_path, "a+b") as file:
+            file.truncate(int(self.offsets[self.count]) if self.count else 0)
+        self._metadata = open(metadata_path, "a+b")
+        self._load_ivf()
+        self._write_manifest()
+
+    def _open_arrays(self):
+        def open_array(name, dtype, shape):
+            path = os.path.join(self.directory, name)
+            mode = "r+" if os.path.exists(path) else "w+"
+            return np.memmap(path, dtype=dtype, mode=mode, shape=shape)
+
+        self.vectors = open_array("vectors.bin", np.float32, (self.capacity, self.dim))
+        self.offsets = open_array("offsets.bin", np.uint64, (self.capacity + 1,))
+        self.assignments = open_array("assignments.bin", np.int32, (self.capacity,))
+
+    def _load_ivf(self):
+        self.centroids = None
+        path = os.path.join(self.directory, "centroids.npy")
+        if os.path.exists(path):
+            self.centroids = np.load(path)
+        self._lists = None
+
+    def _write_manifest(self):
+        manifest = {
+            "model": self.model,
+            "dim": self.dim,
+            "count": self.count,
+            "capacity": self.capacity,
+            "nlist": None if self.centroids is None else len(self.centroids),
+        }
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as file:
+            json.dump(manifest, file)
+        os.replace(tmp_path, os.path.join(self.directory, "manifest.json"))
+
+    def _grow(self, needed):
+        capacity = self.capacity
+        while capacity < needed:
+            capacity *= 2
+        for array in (self.vectors, self.offsets, self.assignments):
+            array.flush()
+        for name, itemsize, rows in (("vectors.bin", 4 * self.dim, capacity), ("offsets.bin", 8, capacity + 1),
+                                     ("assignments.bin", 4, capacity)):
+            with open(os.path.join(self.directory, name), "r+b") as file:
+                file.truncate(itemsize * rows)
+        self.capacity = capacity
+        self._open_arrays()
+
+    def add(self, vectors, metadata):
+        """
+        Append vectors with one metadata dict each, assigning them to IVF lists if trained.
+
+        Args:
+            vectors (array-like): (n, dim) embeddings; normalized on insert
+            metadata (list[dict]): chunk_id, text, source, ... per vector
+
+        Returns:
+            range: Row numbers of the new vectors
+        """
+        rows = _unit_rows(vectors, self.dim)
+        if len(rows) != len(metadata):
+            raise ValueError(f"Got {len(rows)} vectors for {len(metadata)} metadata rows")
+        with self._lock:
+            start = self.count
+            end = start + len(rows)
+            if end > self.capacity:
+                self._grow(end)
+            self.vectors[start:end] = rows
+            if self.centroids is not None:
+                self.assignments[start:end] = np.argmax(rows @ self.centroids.T, axis=1)
+
+            position = int(self.offsets[start]) if start else 0
+            self._metadata.seek(0, os.SEEK_END)
+            for row, item in enumerate(metadata, start):
+                line = (json.dumps(item) + "\n").encode("utf-8")
+                self._metadata.write(line)
+                self.offsets[row] = position
+                position += len(line)
+            self.offsets[end] = position
+            self._metadata.flush()
+
+            self.count = end
+            self._lists = None
+            self._write_manifest()
+        return range(start, end)
+
+    def flush(self):
+        """Write the memory-mapped arrays back to disk."""
+        with self._lock:
+            for array in (self.vectors, self.offsets, self.assignments):
+                array.flush()
+
+    def close(self):
+        """Flush the arrays and close the metadata file."""
+        self.flush()
+        self._metadata.close()
+
+    def metadata(self, row):
+        """Metadata dict stored for a row."""
+        if not 0 <= row < self.count:
+            raise IndexError(f"Row {row} is not in the index ({self.count} rows)")
+        start, end = int(self.offsets[row]), int(self.offsets[row + 1])
+        with open(os.path.join(self.directory, "metadata.jsonl"), "rb") as file:
+            file.seek(start)
+            return json.loads(file.read(end - start))
+
+    def search(self, queries, k=10, nprobe=None):
+        """
+        Find the rows most similar to one or more query vectors.
+
+        Args:
+            queries (array-like): (dim,) or (n, dim) query embeddings
+            k (int): Results per query
+            nprobe (int | None): IVF lists scanned per query; None searches exactly
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: (n, k) rows and cosine similarities, best first
+        """
+        queries = _unit_rows(queries, self.dim)
+        count = self.count
+        if nprobe is None:
+            return self._exact(queries, k, count)
+        if self.centroids is None:
+            raise ValueError("IVF search needs a trained quantizer; run train_ivf() first")
+
+        order, offsets = self._inverted_lists(count)
+        probes = _top_k(queries @ self.centroids.T, nprobe)
+        result_rows = np.full((len(queries), k), -1, dtype=np.int64)
+        result_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        for index, query in enumerate(queries):
+            candidates = np.sort(np.concatenate([order[offsets[probe]:offsets[probe + 1]] for probe in probes[index]]))
+            scores = (np.asarray(self.vectors[candidates]) @ query)[None, :]
+            best = _top_k(scores, k)[0]
+            result_rows[index, :len(best)] = candidates[best]
+            result_scores[index, :len(best)] = scores[0, best]
+        return result_rows, result_scores
+
+    def _exact(self, queries, k, count):
+        best_rows = np.empty((len(queries), 0), dtype=np.int64)
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        for block in range(0, count, BLOCK_ROWS):
+            end = min(block + BLOCK_ROWS, count)
+            scores = queries @ np.asarray(self.vectors[block:end]).T
+            top = _top_k(scores, k)
+            # Merge this block's best with the best so far
+            best_rows = np.concatenate([best_rows, top + block], axis=1)
+            best_scores = np.concatenate([best_scores, np.take_along_axis(scores, top, axis=1)], axis=1)
+            keep = _top_k(best_scores, k)
+            best_rows = np.take_along_axis(best_rows, keep, axis=1)
+            best_scores = np.take_along_axis(best_scores, keep, axis=1)
+        return best_rows, best_scores
+
+    def _inverted_lists(self, count):
+        """Rows grouped by IVF list, rebuilt after inserts."""
+        with self._lock:
+            if self._lists is None or self._lists[2] != count:
+                assignments = np.asarray(self.assignments[:count])
+                order = np.argsort(assignments, kind="stable")
+                offsets = np.concatenate(([0], np.cumsum(np.bincount(assignments, minlength=len(self.centroids)))))
+                self._lists = (order, offsets, count)
+            return self._lists[0], self._lists[1]
+
+    def train_ivf(self, nlist=None, iterations=10, sample=100_000, seed=0):
+        """
+        Train the IVF coarse quantizer with spherical k-means and assign every row.
+
+        Args:
+            nlist (int | None): Number of lists; defaults to 4 * sqrt(count)
+            iterations (int): k-means iterations
+            sample (int): Rows k-means is trained on
+            seed (int): Random seed for sampling and initialization
+        """
+        count = self.count
+        nlist = nlist or max(1, int(4 * np.sqrt(count)))
+        if count < nlist:
+            raise ValueError(f"Need at least {nlist} vectors to train {nlist} IVF lists, have {count}")
+
+        generator = np.random.default_rng(seed)
+        rows = np.sort(generator.choice(count, size=min(sample, count), replace=False))
+        training = np.asarray(self.vectors[rows])
+        centroids = training[generator.choice(len(training), size=nlist, replace=False)].copy()
+        for _ in range(iterations):
+            nearest = np.argmax(training @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, nearest, training)
+            empty = np.bincount(nearest, minlength=nlist) == 0
+            sums[empty] = training[generator.choice(len(training), size=int(empty.sum()))]
+            centroids = _unit_rows(sums, self.dim)
+
+        with self._lock:
+            for block in range(0, count, BLOCK_ROWS):
+                end = min(block + BLOCK_ROWS, count)
+                self.assignments[block:end] = np.argmax(np.asarray(self.vectors[block:end]) @ centroids.T, axis=1)
+            self.assignments.flush()
+            np.save(os.path.join(self.directory, "centroids.npy"), centroids)
+            self._load_ivf()
+            self._write_manifest()
+
+    @classmethod
+    def from_store(cls, store_path, directory, batch_size=10_000, nlist=None):
+        """
+        Build an index from an embedding store, streaming it in batches.
+
+        The index is built in a temporary directory and then replaces any index in
+        directory, so rebuilding never appends to or keeps rows of an older store.
+
+        Args:
+            nlist (int | None): Also train IVF with this many lists before swapping in
+        """
+        store = EmbeddingStore(store_path)
+        building = directory.rstrip("/") + ".tmp"
+        shutil.rmtree(building, ignore_errors=True)
+        index = cls(building, dim=store.dim, model=store.model, initial_capacity=max(1024, store.count))
+        try:
+            for vectors, rows in store.iter_batches(batch_size):
+                index.add(vectors, rows)
+            if nlist:
+                index.train_ivf(nlist)
+            index.close()
+        except BaseException:
+            index.close()
+            shutil.rmtree(building, ignore_errors=True)
+            raise
+        _replace_directory(building, directory)
+        return cls(directory)
+
+
+def benchmark(index, queries=500, k=10, nprobes=(1, 4, 16, 64), noise=0.05, seed=0):
+    """
+    Print queries/sec of exact search and of IVF at each nprobe, with IVF recall@k against exact.
+
+    Queries are stored vectors plus Gaussian noise, so they behave like real
+    questions that land near, not on, the indexed chunks.
+    """
+    generator = np.random.default_rng(seed)
+    rows = generator.choice(index.count, size=min(queries, index.count), replace=False)
+    query_vectors = np.asarray(index.vectors[np.sort(rows)])
+    query_vectors = query_vectors + generator.standard_normal(query_vectors.shape).astype(np.float32) * noise / np.sqrt(index.dim)
+
+    started = time.perf_counter()
+    exact = [index.search(query, k)[0][0] for query in query_vectors]
+    exact_qps = len(query_vectors) / (time.perf_counter() - started)
+    print(f"{index.count} vectors, dim {index.dim}, k={k}, {len(query_vectors)} queries")
+    print(f"{'mode':12} {'queries/s':>10} {f'recall@{k}':>10}")
+    print(f"{'exact':12} {exact_qps:10.1f} {1.0:10.3f}")
+    if index.centroids is None:
+        print("No IVF quantizer trained; run `vector_search.py train` to compare approximate search")
+        return
+    for nprobe in nprobes:
+        started = time.perf_counter()
+        approximate = [index.search(query, k, nprobe=nprobe)[0][0] for query in query_vectors]
+        qps = len(query_vectors) / (time.perf_counter() - started)
+        recall = np.mean([len(set(a) & set(e)) / len(e) for a, e in zip(approximate, exact)])
+        print(f"{f'ivf nprobe={nprobe}':12} {qps:10.1f} {recall:10.3f}")
+
+def synthetic_index(directory, count, dim=1536, clusters=1000, seed=0):
+    """Index of clustered random unit vectors, for benchmarking at corpus sizes we do not have yet."""
+    generator = np.random.default_rng(seed)
+    centers = _unit_rows(generator.standard_normal((clusters, dim)), dim)
+    building = directory.rstrip("/") + ".tmp"
+    shutil.rmtree(building, ignore_errors=True)
+    index = VectorIndex(building, dim=dim, model="synthetic", initial_capacity=count)
+    for start in range(0, count, 10_000):
+        size = min(10_000, count - start)
+        vectors = centers[generator.integers(clusters, size=size)] + generator.standard_normal((size, dim)).astype(np.float32) * 0.6 / np.sqrt(dim)
+        index.add(vectors, [{"chunk_id": str(row)} for row in range(start, start + size)])
+    index.close()
+    _replace_directory(building, directory)
+    return VectorIndex(directory)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build, train, query and benchmark the local chunk index")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="Build an index from an embedding store")
+    build.add_argument("store")
+    build.add_argument("index")
+    build.add_argument("--nlist", type=int, help="Also train IVF with this many lists")
+    train = commands.add_parser("train", help="Train the IVF quantizer")
+    train.add_argument("index")
+    train.add_argument("--nlist", type=int)
+    query = commands.add_parser("query", help="Embed a question and print the closest chunks")
+    query.add_argument("index")
+    query.add_argument("text")
+    query.add_argument("--k", type=int, default=5)
+    query.add_argument("--nprobe", type=int)
+    bench = commands.add_parser("bench", help="Report queries/sec and IVF recall@k against exact search")
+    bench.add_argument("index")
+    bench.add_argument("--synthetic", type=int, help="First build a synthetic index with this many vectors")
+    bench.add_argument("--queries", type=int, default=500)
+    bench.add_argument("--k", type=int, default=10)
+    bench.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 16, 64])
+    args = parser.parse_args()
+
+    if args.command == "build":
+        started = time.perf_counter()
+        index = VectorIndex.from_store(args.store, args.index, nlist=args.nlist)
+        print(f"Indexed {index.count} vectors in {time.perf_counter() - started:.1f}s into {args.index}")
+    elif args.command == "train":
+        index = VectorIndex(args.index)
+        index.train_ivf(args.nlist)
+        print(f"Trained {len(index.centroids)} IVF lists over {index.count} vectors")
+    elif args.command == "query":
+        from dotenv import load_dotenv
+
+        from embedding_backends import embedding_backend_for
+
+        load_dotenv()
+        index = VectorIndex(args.index)
+        # Queries must be embedded by the same model as the indexed chunks
+        backend = embedding_backend_for(index.model)
+        rows, scores = index.search(backend.embed([args.text])[0], args.k, args.nprobe)
+        for row, score in zip(rows[0], scores[0]):
+            if row < 0:
+                continue  # IVF pads with -1 when the probed lists hold fewer than k rows
+            item = index.metadata(row)
+            print(f"{score:.3f}  {os.path.basename(item['source'])} p.{item['page_start']}-{item['page_end']}: "
+                  f"{item['text'][:120]!r}")
+    else:
+        if args.synthetic:
+            started = time.perf_counter()
+            index = synthetic_index(args.index, args.synthetic)
+            index.train_ivf()
+            print(f"Built and trained a synthetic index in {time.perf_counter() - started:.1f}s")
+        index = VectorIndex(args.index)
+        benchmark(index, args.queries, args.k, args.nprobe)
+
+
+if __name__ == "__main__":
+    main()
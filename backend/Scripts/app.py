@@ -1,14 +1,14 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 import requests
-import torch
-import torchvision.transforms as transforms
-from PIL import Image
-from io import BytesIO
 from supabase import create_client, Client
-from torch import nn
 from dotenv import load_dotenv
 import os
 from flask_cors import CORS
+import classifier
+import time
+from metrics import CONTENT_TYPE
+from result_writer import result_writer_from_env
+from storage import storage_from_env
 
 
 # Load environment variables
@@ -34,8 +34,71 @@ Example usage:
          -d '{"image_id": "example-image-123.jpg"}'
 
 Response format:
-    Success: {"image_id": "example-image-123.jpg", "predicted_class": 5}
+    Success: {"image_id": "example-image-123.jpg", "predicted_class": "Eczema Photos",
+              "top_k": [{"label": "Eczema Photos", "probability": 0.91}, ...], "tier": "full"}
     Error: {"error": "error message"}
+
+The model runtime lives in classifier.py (shared with async_app.py):
+
+Concurrent requests are grouped into a single forward pass by a background
+batching scheduler. Tune it with the BATCH_MAX_SIZE (default 8) and
+BATCH_MAX_WAIT_MS (default 5) environment variables, and watch its queue
+depth and batch-size histogram on GET /stats.
+
+Predictions are cached by the SHA-256 of the image bytes plus a fingerprint of
+the model weights. PREDICTION_CACHE_SIZE (default 1024) bounds the in-memory
+tier; set PREDICTION_CACHE_DIR to also persist entries on disk across restarts,
+bounded by PREDICTION_CACHE_DISK_ENTRIES (default 100000) files.
+
+Images are decoded and normalized on a thread pool of PREPROCESS_WORKERS
+threads. PREPROCESS_DRAFT=0 disables JPEG reduced-scale decoding for exact
+parity with the torchvision pipeline.
+
+INFERENCE_BACKEND selects eager (default), torchscript or onnx. The exported
+backends need the artifacts from export_model.py and are checked against the
+eager logits at startup.
+
+INFERENCE_PRECISION selects a CPU precision mode for the eager backend: fp32
+(default), dynamic_int8, static_int8 (calibrated on CALIBRATION_DIR),
+channels_last or bf16. Run evaluate_precision.py to see each mode's latency,
+memory and agreement with fp32 before enabling it.
+
+CASCADE_ENABLED=1 classifies each image at CASCADE_LOW_SIZE (default 256) first
+and only re-runs it at 512x512 when the softmax margin between the top two
+classes is below CASCADE_MARGIN (default 0.5); "tier" in the response says
+which resolution answered. Run evaluate_cascade.py to pick the margin. TOP_K
+(default 3) sets how many classes the response lists.
+
+FEATURE_INDEX_DIR keeps the 256-dim penultimate features of every classified
+image in a memory-mapped index (see feature_index.py). GET /similar?image_id=
+lists the most similar earlier cases, and DUPLICATE_MAX_DISTANCE=4 answers
+near-duplicate uploads from the index without running the model.
+
+Startup never touches torch.hub: the architecture is built locally (model.py)
+and the weights are memory-mapped. WARMUP_ITERATIONS (default 3) forward
+passes run in the background after loading; GET /ready returns 503 until they
+finish and 200 afterwards. Time to ready and time to first prediction are logged.
+
+Image downloads go through a pooled keep-alive HTTP session and, when
+BLOB_CACHE_DIR is set, a size-bounded on-disk cache (BLOB_CACHE_MAX_MB).
+POST /prefetch with {"image_id": ...} right after an upload warms that cache.
+Hit rate and download latency are reported on GET /stats.
+
+GET /metrics serves Prometheus histograms of every classify stage (download,
+decode, preprocess, queue_wait, forward, postprocess) plus process RSS and
+PyTorch thread counts. PROFILE_EVERY_N=N saves a torch.profiler trace for one
+request in N to PROFILE_DIR.
+
+Every prediction is recorded in the image_results table by a write-behind
+queue (see result_writer.py): inserts are batched by RESULTS_BATCH_SIZE and
+RESULTS_FLUSH_MS, retried with backoff and journaled to RESULTS_JOURNAL_DIR
+while the database is unreachable. RESULTS_DB_PATH writes to a local SQLite
+stand-in table instead; RESULTS_WRITE_BEHIND=0 turns recording off.
+
+For production, serve with the pre-fork configuration instead of app.run:
+    gunicorn -c gunicorn.conf.py app:app
+It loads the model once and forks workers that share the weight pages; see
+gunicorn.conf.py for worker, thread and CPU pinning settings.
 """
 
 # Flask App Initialization
@@ -53,47 +116,13 @@ if not SUPABASE_URL or not SUPABASE_KEY:
 
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY);
 
-# Load the pre-trained DenseNet121 model and modify for our classification task
-model = torch.hub.load('pytorch/vision:v0.10.0', 'densenet121', pretrained=False)
-num_features = model.classifier.in_features
-model.classifier = nn.Sequential(
-    nn.Linear(num_features, 512),
-    nn.ReLU(),
-    nn.Dropout(0.4),
-    nn.Linear(512, 256),
-    nn.ReLU(),
-    nn.Dropout(0.3),
-    nn.Linear(256, 23)  # Final layer with 23 output classes
-)
-model.load_state_dict(torch.load('../Models/model_0.pth', map_location=torch.device('cpu')))
-model.eval()
-
-device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-model.to(device)
-
-def preprocess_image(image_bytes):
-    """
-    Preprocess the input image for the model.
+# Classification Results: written to image_results in batches behind the response (see result_writer.py)
+result_writer = result_writer_from_env(supabase)
+if result_writer is not None and os.getenv("PREFORK_SERVING") != "1":
+    result_writer.start()  # Replay results journaled while the database was unreachable (post_fork does this per worker)
 
-    Args:
-        image_bytes (bytes): Raw image data in bytes
-
-    Returns:
-        torch.Tensor: Preprocessed image tensor ready for model input
-
-    Process:
-    1. Resize image to 512x512 pixels
-    2. Convert to tensor
-    3. Normalize using ImageNet statistics
-    4. Add batch dimension
-    """
-    transform = transforms.Compose([
-        transforms.Resize((512, 512)),  # Resize to DenseNet121 input size
-        transforms.ToTensor(),
-        transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])  # ImageNet normalization
-    ])
-    image = Image.open(BytesIO(image_bytes)).convert("RGB")
-    return transform(image).unsqueeze(0)
+# Image Storage: pooled keep-alive Supabase client, optional on-disk blob cache (see storage.py)
+storage = storage_from_env()
 
 def fetch_image_from_supabase(image_id):
     """
@@ -105,40 +134,8 @@ def fetch_image_from_supabase(image_id):
     Returns:
         bytes: Raw image data
     """
-    try:
-        res = supabase.storage.from_('images').download(image_id)  # 'images' is the storage bucket
-    except Exception as e:
-        raise Exception(f"Failed to download image from Supabase: {str(e)}")
-    # for testing use temp img
-    # res = open("./UploadImages/07PerioralDermEye.jpg", "rb").read()
-    return res
-
-# Define class labels
-class_labels = [
-    "Acne and Rosacea Photos",
-    "Actinic Keratosis Basal Cell Carcinoma and other Malignant Lesions",
-    "Atopic Dermatitis Photos",
-    "Bullous Disease Photos",
-    "Cellulitis Impetigo and other Bacterial Infections",
-    "Eczema Photos",
-    "Exanthems and Drug Eruptions",
-    "Hair Loss Photos Alopecia and other Hair Diseases",
-    "Herpes HPV and other STDs Photos",
-    "Light Diseases and Disorders of Pigmentation",
-    "Lupus and other Connective Tissue Diseases",
-    "Melanoma Skin Cancer Nevi and Moles",
-    "Nail Fungus and other Nail Disease",
-    "Poison Ivy Photos and other Contact Dermatitis",
-    "Psoriasis Pictures Lichen Planus and Related Diseases",
-    "Scabies Lyme Disease and other Infestations and Bites",
-    "Seborrheic Keratoses and other Benign Tumors",
-    "Systemic Disease",
-    "Tinea Ringworm Candidiasis and other Fungal Infections",
-    "Urticaria Hives",
-    "Vascular Tumors",
-    "Vasculitis Photos",
-    "Warts Molluscum and other Viral Infections"
-]
+    # for testing, set LOCAL_STORAGE_DIR to read images from a local directory instead
+    return storage.download(image_id)
 
 @app.route('/classify', methods=['POST'])
 def classify_image():
@@ -153,31 +150,82 @@ def classify_image():
 
     try:
         # Fetch Image from Supabase
+        started = time.perf_counter()
         image_bytes = fetch_image_from_supabase(image_id)
-        print(image_bytes)
-        image_tensor = preprocess_image(image_bytes)
-        print(image_tensor)
-
-        # Run Classification
-        with torch.no_grad():
-            outputs = model(image_tensor)
-            predicted_class_index = outputs.argmax(1).item()
-            predicted_label = class_labels[predicted_class_index]  # Get actual class name
-            print(predicted_label)
-
-        # Save Classification Result in Supabase DB
-        # try:
-        #     supabase.table("image_results").insert({"image_id": image_id, "class": predicted_label}).execute()
-        # except Exception as e:
-        #     print(f"Failed to save classification result to database: {str(e)}")
-        #     # Continue processing even if database save fails
-
-        return jsonify({"image_id": image_id, "predicted_class": predicted_label}), 200  # Return class name instead of index
+        classifier.stage_seconds.observe(time.perf_counter() - started, "download")
+
+        # Reuse an earlier prediction for identical bytes, or share one in flight
+        result = classifier.classify_bytes(image_bytes, image_id)
+
+        # Save Classification Result in Supabase DB (batched in the background; never delays the response)
+        if result_writer is not None:
+            result_writer.submit({"image_id": image_id, "class": result["predicted_class"]})
+
+        return jsonify({"image_id": image_id, **result}), 200  # Return class name instead of index
 
     except Exception as e:
         print(e)
         return jsonify({"error": str(e)}), 500
 
+@app.route('/prefetch', methods=['POST'])
+def prefetch_image():
+    """
+    Endpoint the frontend can call as soon as an upload finishes, so the image
+    is already in the blob cache when /classify asks for it.
+    """
+    data = request.get_json()
+    image_id = data.get("image_id")
+
+    if not image_id:
+        return jsonify({"error": "No image_id provided"}), 400
+
+    storage.prefetch(image_id)
+    return jsonify({"image_id": image_id, "prefetching": True}), 202
+
+@app.route('/similar', methods=['GET'])
+def similar_images():
+    """
+    Endpoint listing previously classified images most similar to ?image_id= (at most ?k=, default 10).
+    """
+    image_id = request.args.get("image_id")
+    if not image_id:
+        return jsonify({"error": "No image_id provided"}), 400
+
+    try:
+        matches = classifier.similar_images(image_id, k=int(request.args.get("k", "10")))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if matches is None:
+        return jsonify({"error": f"{image_id} has not been indexed"}), 404
+    return jsonify({"image_id": image_id, "similar": matches}), 200
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    Endpoint exposing per-stage latency histograms, RSS and thread counts in Prometheus text format.
+    """
+    return Response(classifier.metrics.render(), mimetype=CONTENT_TYPE)
+
+@app.route('/ready', methods=['GET'])
+def readiness():
+    """
+    Readiness probe: 200 once the model is loaded and warmed up, 503 before.
+    """
+    if not classifier.ready.is_set():
+        return jsonify({"ready": False}), 503
+    return jsonify({"ready": True}), 200
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    """
+    Endpoint reporting batching, prediction cache, preprocessing, storage and result writer statistics.
+    """
+    return jsonify({
+        **classifier.stats(),
+        "storage": storage.stats(),
+        "results": result_writer.stats() if result_writer is not None else None,
+    }), 200
+
 # Run Flask App
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,315 @@
+"""
+Asyncio front end for the image classifier.
+
+Serves the same POST /classify, POST /prefetch, GET /similar, GET /metrics, GET /ready
+and GET /stats API as app.py, but
+on an aiohttp event loop, so a slow storage download only parks a coroutine
+instead of a whole worker thread:
+
+    - Downloads run concurrently on a dedicated I/O pool (DOWNLOAD_CONCURRENCY
+      threads, default 32), separate from the CPU work.
+    - Preprocessing and inference run on the bounded preprocessing pool and
+      batching scheduler from classifier.py.
+    - At most ADMISSION_LIMIT requests (default 64) are admitted at once;
+      beyond that /classify answers 503 with a Retry-After header
+      (RETRY_AFTER_S, default 1) instead of queueing without bound.
+    - Every request has a deadline: REQUEST_TIMEOUT_MS (default 30000), or
+      lower if the caller sends an X-Request-Timeout-Ms header. When it
+      expires, or the client disconnects, the request's queued preprocessing
+      and inference are cancelled, and on a deadline it answers 504.
+      Disconnects only cancel handlers when the app runs with aiohttp's
+      handler_cancellation=True, as `python async_app.py` does. A download
+      already running on the I/O pool cannot be interrupted: it finishes in
+      its thread (filling the blob cache) and the result is dropped.
+    - Concurrent requests for the same image share one computation, which is
+      cancelled only when every caller waiting on it has gone.
+
+Results are recorded through the same write-behind queue as app.py: in the
+Supabase image_results table when SUPABASE_URL and SUPABASE_KEY are set, or in
+a local stand-in table when RESULTS_DB_PATH is set (see result_writer.py).
+
+Storage comes from storage.storage_from_env() (pooled Supabase session,
+optional blob cache; POST /prefetch warms it). Set LOCAL_STORAGE_DIR (and
+optionally LOCAL_STORAGE_LATENCY_MS) to serve images from a local directory
+instead of Supabase, e.g. for load tests:
+
+    LOCAL_STORAGE_DIR=./UploadImages LOCAL_STORAGE_LATENCY_MS=200 python async_app.py
+    curl -X POST http://localhost:5001/classify -H "Content-Type: application/json" \\
+         -d '{"image_id": "07PerioralDermEye.jpg"}'
+"""
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+from dotenv import load_dotenv
+
+import classifier
+from metrics import CONTENT_TYPE
+from prediction_cache import prediction_key
+from result_writer import result_writer_from_env
+from storage import storage_from_env
+
+# Load environment variables
+load_dotenv()
+
+DEADLINE_HEADER = "X-Request-Timeout-Ms"
+
+
+class Coalescer:
+    """
+    Run one task per key and share its result between all concurrent waiters.
+
+    The task is cancelled only when the last waiter stops waiting, so one
+    caller timing out does not fail the others.
+    """
+
+    def __init__(self):
+        self._entries = {}  # key -> [task, number of waiters]
+
+    async def run(self, key, factory):
+        """
+        Await the shared task for key, starting it with factory() if needed.
+
+        Args:
+            key (str): Identity of the computation
+            factory (callable): Returns the coroutine to run when no task exists
+
+        Returns:
+            The task's result
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = [asyncio.ensure_future(factory()), 0]
+            self._entries[key] = entry
+
+            def forget(_):
+                if self._entries.get(key) is entry:
+                    del self._entries[key]
+
+            entry[0].add_done_callback(forget)
+
+        entry[1] += 1
+        try:
+            return await asyncio.shield(entry[0])
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0 and not entry[0].done():
+                entry[0].cancel()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class AsyncClassifierServer:
+    """
+    aiohttp handlers with bounded admission and per-request deadlines.
+
+    Args:
+        storage (storage.CachedStorage): Blocking download(image_id) -> bytes,
+            plus prefetch() and stats()
+        admission_limit (int): Maximum requests admitted at the same time
+        download_concurrency (int): Threads available for storage downloads
+        request_timeout_ms (float): Default and maximum per-request deadline
+        retry_after_s (int): Retry-After value sent with 503 responses
+        result_writer (result_writer.WriteBehindQueue | None): Records every prediction
+    """
+
+    def __init__(self, storage, admission_limit=64, download_concurrency=32, request_timeout_ms=30000, retry_after_s=1,
+                 result_writer=None):
+        self.storage = storage
+        self.result_writer = result_writer
+        self.admission_limit = admission_limit
+        self.request_timeout_ms = request_timeout_ms
+        self.retry_after_s = retry_after_s
+
+        self._downloads = ThreadPoolExecutor(max_workers=download_concurrency, thread_name_prefix="download")
+        self._coalescer = Coalescer()
+        self._admitted = 0
+        self._counts = {"completed": 0, "rejected": 0, "timed_out": 0, "cancelled": 0, "failed": 0}
+
+    def request_timeout(self, request):
+        """Deadline for a request in seconds: the caller's header, capped at the server default."""
+        timeout_ms = self.request_timeout_ms
+        try:
+            timeout_ms = min(timeout_ms, float(request.headers.get(DEADLINE_HEADER, timeout_ms)))
+        except ValueError:
+            pass
+        return max(timeout_ms, 0.0) / 1000.0
+
+    async def classify(self, request):
+        """
+        Endpoint to classify an image from storage, with admission control and a deadline.
+        """
+        if self._admitted >= self.admission_limit:
+            self._counts["rejected"] += 1
+            return web.json_response(
+                {"error": "Server is at capacity, retry later"},
+                status=503,
+                headers={"Retry-After": str(self.retry_after_s)},
+            )
+
+        try:
+            data = await request.json()
+        except ValueError:
+            data = None
+        image_id = data.get("image_id") if isinstance(data, dict) else None
+        if not image_id:
+            return web.json_response({"error": "No image_id provided"}, status=400)
+
+        self._admitted += 1
+        try:
+            result = await asyncio.wait_for(self._classify_image(image_id), self.request_timeout(request))
+        except asyncio.TimeoutError:
+            self._counts["timed_out"] += 1
+            return web.json_response({"error": "Request deadline exceeded"}, status=504)
+        except asyncio.CancelledError:
+            # The client went away (handler_cancellation=True); wait_for has already
+            # cancelled the queued work, though a running download finishes in its thread
+            self._counts["cancelled"] += 1
+            raise
+        except Exception as e:
+            print(e)
+            self._counts["failed"] += 1
+            return web.json_response({"error": str(e)}, status=500)
+        finally:
+            self._admitted -= 1
+
+        self._counts["completed"] += 1
+        classifier.record_prediction_served()
+        if self.result_writer is not None:
+            self.result_writer.submit({"image_id": image_id, "class": result["predicted_class"]})
+        return web.json_response({"image_id": image_id, **result})
+
+    async def _classify_image(self, image_id):
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        image_bytes = await loop.run_in_executor(self._downloads, self.storage.download, image_id)
+        classifier.stage_seconds.observe(time.perf_counter() - started, "download")
+        key = prediction_key(image_bytes, classifier.model_fingerprint)
+        result = await self._coalescer.run(key, lambda: self._predict(key, image_bytes, image_id))
+        if classifier.feature_index is not None:
+            # Cached or shared predictions skip inference; index this id from the stored row
+            await loop.run_in_executor(None, classifier.index_cached_prediction, image_bytes, image_id)
+        return result
+
+    async def _predict(self, key, image_bytes, image_id):
+        loop = asyncio.get_running_loop()
+        cache = classifier.prediction_cache
+
+        # The disk tier may block, so look up and store off the event loop
+        result = await loop.run_in_executor(None, cache.get, key)
+        if result is None:
+            result = await asyncio.wrap_future(classifier.submit_prediction(image_bytes, image_id))
+            await loop.run_in_executor(None, cache.put, key, result)
+        return result
+
+    async def prefetch(self, request):
+        """
+        Endpoint to start downloading an image into the blob cache right after upload.
+        """
+        try:
+            data = await request.json()
+        except ValueError:
+            data = None
+        image_id = data.get("image_id") if isinstance(data, dict) else None
+        if not image_id:
+            return web.json_response({"error": "No image_id provided"}, status=400)
+
+        self.storage.prefetch(image_id)
+        return web.json_response({"image_id": image_id, "prefetching": True}, status=202)
+
+    async def similar(self, request):
+        """
+        Endpoint listing previously classified images most similar to ?image_id= (at most ?k=, default 10).
+        """
+        image_id = request.query.get("image_id")
+        if not image_id:
+            return web.json_response({"error": "No image_id provided"}, status=400)
+
+        loop = asyncio.get_running_loop()
+        try:
+            matches = await loop.run_in_executor(None, classifier.similar_images, image_id, int(request.query.get("k", "10")))
+        except ValueError as e:
+            return web.json_response({"error": str(e)}, status=400)
+        if matches is None:
+            return web.json_response({"error": f"{image_id} has not been indexed"}, status=404)
+        return web.json_response({"image_id": image_id, "similar": matches})
+
+    async def metrics(self, request):
+        """
+        Endpoint exposing per-stage latency histograms, RSS and thread counts in Prometheus text format.
+        """
+        return web.Response(body=classifier.metrics.render().encode("utf-8"), headers={"Content-Type": CONTENT_TYPE})
+
+    async def ready(self, request):
+        """
+        Readiness probe: 200 once the model is loaded and warmed up, 503 before.
+        """
+        if not classifier.ready.is_set():
+            return web.json_response({"ready": False}, status=503)
+        return web.json_response({"ready": True})
+
+    async def stats(self, request):
+        """
+        Endpoint reporting admission, storage and result writer statistics alongside the classifier statistics.
+        """
+        return web.json_response({
+            **classifier.stats(),
+            "storage": self.storage.stats(),
+            "results": self.result_writer.stats() if self.result_writer is not None else None,
+            "admission": {
+                **self._counts,
+                "admitted": self._admitted,
+                "admission_limit": self.admission_limit,
+                "coalesced_in_flight": len(self._coalescer),
+            },
+        })
+
+
+def supabase_client_from_env():
+    """Supabase client from SUPABASE_URL and SUPABASE_KEY, or None when they are not set (e.g. local storage tests)."""
+    supabase_url = os.getenv("SUPABASE_URL")
+    supabase_key = os.getenv("SUPABASE_KEY")
+    if not supabase_url or not supabase_key:
+        return None
+    from supabase import create_client
+
+    return create_client(supabase_url, supabase_key)
+
+def create_app(storage=None):
+    """
+    Build the aiohttp application.
+
+    Args:
+        storage (storage.CachedStorage | None): Defaults to storage_from_env()
+
+    Returns:
+        aiohttp.web.Application
+    """
+    result_writer = result_writer_from_env(supabase_client_from_env())
+    if result_writer is not None:
+        result_writer.start()  # Replay results journaled while the database was unreachable
+    server = AsyncClassifierServer(
+        storage if storage is not None else storage_from_env(),
+        admission_limit=int(os.getenv("ADMISSION_LIMIT", "64")),
+        download_concurrency=int(os.getenv("DOWNLOAD_CONCURRENCY", "32")),
+        request_timeout_ms=float(os.getenv("REQUEST_TIMEOUT_MS", "30000")),
+        retry_after_s=int(os.getenv("RETRY_AFTER_S", "1")),
+        result_writer=result_writer,
+    )
+    app = web.Application()
+    app.router.add_post('/classify', server.classify)
+    app.router.add_post('/prefetch', server.prefetch)
+    app.router.add_get('/similar', server.similar)
+    app.router.add_get('/metrics', server.metrics)
+    app.router.add_get('/ready', server.ready)
+    app.router.add_get('/stats', server.stats)
+    return app
+
+
+# Run aiohttp App
+if __name__ == '__main__':
+    # Cancel handlers of disconnected clients, which aiohttp does not do by default
+    web.run_app(create_app(), port=int(os.getenv("PORT", "5001")), handler_cancellation=True)
@@ -0,0 +1,156 @@
+"""
+Pluggable inference backends for the classifier.
+
+Every backend is a callable that takes a float32 batch of shape (N, 3, H, W)
+and returns the (N, 23) logits as a CPU torch.Tensor, so the batching
+scheduler does not care which one is running:
+
+    eager        PyTorch nn.Module, as trained
+    torchscript  Frozen TorchScript module (model_0.ts), produced by export_model.py
+    onnx         ONNX Runtime CPU session over model_0.onnx, produced by export_model.py
+
+check_equivalence compares any backend's logits with the eager model so a
+faster backend is only used once it is known to agree with it.
+"""
+import os
+
+import torch
+
+from model import INPUT_SIZE, load_model
+
+BACKENDS = ("eager", "torchscript", "onnx")
+
+
+def artifact_paths(weights_path):
+    """
+    Locate the exported artifacts that sit next to a weights file.
+
+    Args:
+        weights_path (str): Path to the state dict, e.g. ../Models/model_0.pth
+
+    Returns:
+        dict: backend name -> artifact path for "torchscript" and "onnx"
+    """
+    stem, _ = os.path.splitext(weights_path)
+    return {"torchscript": f"{stem}.ts", "onnx": f"{stem}.onnx"}
+
+
+class EagerBackend:
+    """Run the nn.Module directly."""
+
+    name = "eager"
+
+    def __init__(self, model, device=torch.device('cpu')):
+        self.model = model
+        self.device = device
+
+    def __call__(self, batch):
+        with torch.no_grad():
+            return self.model(batch.to(self.device)).cpu()
+
+
+class TorchScriptBackend:
+    """Run a frozen TorchScript module saved by export_model.py."""
+
+    name = "torchscript"
+
+    def __init__(self, path, device=torch.device('cpu')):
+        self.device = device
+        self.module = torch.jit.load(path, map_location=device)
+        self.module.eval()
+
+    def __call__(self, batch):
+        with torch.no_grad():
+            return self.module(batch.to(self.device)).cpu()
+
+
+class OnnxRuntimeBackend:
+    """
+    Run the ONNX export on the ONNX Runtime CPU execution provider.
+
+    Args:
+        path (str): Path to the .onnx file
+        num_threads (int | None): Intra-op threads; None lets ONNX Runtime decide
+    """
+
+    name = "onnx"
+
+    def __init__(self, path, num_threads=None):
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise ImportError("The onnx backend requires onnxruntime (pip install onnxruntime)") from e
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(path, sess_options=options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, batch):
+        inputs = batch.detach().cpu().contiguous().numpy()
+        (logits,) = self.session.run(None, {self.input_name: inputs})
+        return torch.from_numpy(logits)
+
+
+def load_backend(name, weights_path, device=torch.device('cpu'), model=None):
+    """
+    Create an inference backend by name.
+
+    Args:
+        name (str): One of BACKENDS
+        weights_path (str): Path to the state dict; exported artifacts are
+            looked up next to it
+        device (torch.device): Device for the PyTorch backends (ONNX Runtime
+            always runs on CPU)
+        model (nn.Module | None): Already-loaded eager model to reuse
+
+    Returns:
+        callable: Backend mapping a batch tensor to logits
+    """
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown inference backend '{name}', expected one of {', '.join(BACKENDS)}")
+
+    if name == "eager":
+        return EagerBackend(model if model is not None else load_model(weights_path, device), device)
+
+    path = artifact_paths(weights_path)[name]
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"{path} not found; run export_model.py to create the {name} artifact")
+    if name == "torchscript":
+        return TorchScriptBackend(path, device)
+    return OnnxRuntimeBackend(path)
+
+
+def check_equivalence(backend, reference_model, inputs=None, atol=1e-3, rtol=1e-3):
+    """
+    Compare a backend's logits with the eager model on the same inputs.
+
+    Args:
+        backend (callable): Backend under test
+        reference_model (nn.Module): Eager model in eval mode
+        inputs (torch.Tensor | None): Batch to compare on; defaults to a
+            seeded random batch of two 512x512 images
+        atol (float): Absolute tolerance on the logits
+        rtol (float): Relative tolerance on the logits
+
+    Returns:
+        dict: max_abs_diff, top1_agreement (fraction of rows with the same
+        argmax) and equivalent (True when all logits are within tolerance)
+    """
+    if inputs is None:
+        generator = torch.Generator().manual_seed(0)
+        inputs = torch.randn(2, 3, INPUT_SIZE, INPUT_SIZE, generator=generator)
+
+    device = next(reference_model.parameters()).device
+    with torch.no_grad():
+        expected = reference_model(inputs.to(device)).float().cpu()
+    actual = backend(inputs).float()
+
+    return {
+        "backend": getattr(backend, "name", type(backend).__name__),
+        "max_abs_diff": (actual - expected).abs().max().item(),
+        "top1_agreement": (actual.argmax(1) == expected.argmax(1)).float().mean().item(),
+        "equivalent": torch.allclose(actual, expected, atol=atol, rtol=rtol),
+    }
@@ -0,0 +1,156 @@
+"""
+Dynamic micro-batching for model inference.
+
+Requests hand their preprocessed image tensor to a BatchScheduler and get a
+Future back. A single background thread drains the queue, groups up to
+`max_batch_size` tensors (or whatever has arrived within `max_wait_ms` of the
+first one), runs one forward pass over the stacked batch and resolves each
+caller's Future with its own result.
+
+Tuning:
+    max_batch_size=1 disables batching (every request is its own forward pass).
+    Larger max_wait_ms trades per-request latency for bigger, more efficient
+    batches under load. Use stats() to watch queue depth and the batch-size
+    histogram while adjusting both.
+"""
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+
+import torch
+
+
+class BatchScheduler:
+    """
+    Collects single-image tensors from concurrent callers into batches.
+
+    Args:
+        infer_fn (callable): Takes a batch tensor of shape (N, C, H, W) and
+            returns a sequence of N per-image results, in order
+        max_batch_size (int): Maximum number of images per forward pass
+        max_wait_ms (float): Longest time to hold the first queued image while
+            waiting for the batch to fill
+        on_queue_wait (callable | None): Called with the seconds each image
+            spent queued before its batch started, e.g. to feed a histogram
+    """
+
+    def __init__(self, infer_fn, max_batch_size=8, max_wait_ms=5.0, on_queue_wait=None):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        if max_wait_ms < 0:
+            raise ValueError("max_wait_ms must not be negative")
+
+        self.infer_fn = infer_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.on_queue_wait = on_queue_wait
+
+        self._queue = queue.Queue()
+        self._thread = None
+        self._stopping = threading.Event()
+
+        self._stats_lock = threading.Lock()
+        self._batch_sizes = Counter()
+        self._batches = 0
+        self._items = 0
+
+    def start(self):
+        """Start the background batching thread (no-op if already running)."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="batch-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Stop the batching thread after the batch in progress completes."""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def submit(self, image_tensor):
+        """
+        Queue one preprocessed image for inference.
+
+        Args:
+            image_tensor (torch.Tensor): Tensor of shape (1, C, H, W) as
+                returned by preprocess_image
+
+        Returns:
+            concurrent.futures.Future: Resolves to this image's entry from the
+            infer_fn result
+        """
+        future = Future()
+        self._queue.put((image_tensor, future, time.perf_counter()))
+        return future
+
+    def stats(self):
+        """
+        Report queue depth and batch-size distribution.
+
+        Returns:
+            dict: queue_depth, batches, items, mean_batch_size and a
+            batch_size_histogram mapping batch size -> number of batches
+        """
+        with self._stats_lock:
+            return {
+                "queue_depth": self._queue.qsize(),
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000.0,
+                "batches": self._batches,
+                "items": self._items,
+                "mean_batch_size": self._items / self._batches if self._batches else 0.0,
+                "batch_size_histogram": {str(size): count for size, count in sorted(self._batch_sizes.items())},
+            }
+
+    def _collect_batch(self):
+        """Block for the first item, then gather more until full or the wait expires."""
+        try:
+            first = self._queue.get(timeout=0.1)
+        except queue.Empty:
+            return []
+
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    # Still take anything that is already waiting
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stopping.is_set():
+            batch = self._collect_batch()
+
+            # Drop requests whose caller has already given up
+            batch = [item for item in batch if item[1].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            if self.on_queue_wait is not None:
+                started = time.perf_counter()
+                for _, _, queued_at in batch:
+                    self.on_queue_wait(started - queued_at)
+
+            with self._stats_lock:
+                self._batches += 1
+                self._items += len(batch)
+                self._batch_sizes[len(batch)] += 1
+
+            try:
+                results = self.infer_fn(torch.cat([tensor for tensor, _, _ in batch]))
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+
+            for (_, future, _), result in zip(batch, results):
+                future.set_result(result)
@@ -0,0 +1,284 @@
+"""
+Reproducible inference benchmark for the skin-condition classifier.
+
+Measures, for every inference backend (eager, torchscript, onnx) and CPU
+precision mode the service supports:
+    - decode and preprocess time per image (mean/p50/p95/p99)
+    - forward-pass latency per batch (p50/p95/p99) after warmup
+    - throughput in images/sec at several batch sizes and thread counts
+
+Runs fully offline on synthetic phone-sized JPEGs or a local image folder.
+Results are written as JSON; --compare flags throughput or tail-latency
+regressions against a saved baseline and exits non-zero if any are found.
+
+Usage:
+    python benchmark.py --synthetic 16 --output baseline.json
+    python benchmark.py --images UploadImages --batch-sizes 1 8 --threads 1 4 --output run.json --compare baseline.json
+    python benchmark.py --backends eager --precisions fp32 dynamic_int8 bf16 --synthetic 8
+    python benchmark.py --compare baseline.json --results run.json   # compare two saved runs
+
+The exported backends need the artifacts from export_model.py; backends
+whose artifacts are missing are skipped with a message. By default every
+precision mode is measured on the eager backend and fp32 on the exported
+ones; --backends and --precisions narrow the matrix. static_int8 is calibrated on the benchmark
+images themselves.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import sys
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+
+from backends import BACKENDS, OnnxRuntimeBackend, artifact_paths, load_backend
+from model import INPUT_SIZE, load_model
+from precision import PRECISIONS, apply_precision
+from preprocessing import Preprocessor, list_images
+
+
+def percentiles(values):
+    """Mean and p50/p95/p99 of a list of seconds, in milliseconds."""
+    samples = np.asarray(values) * 1000.0
+    return {
+        "mean_ms": float(samples.mean()),
+        "p50_ms": float(np.percentile(samples, 50)),
+        "p95_ms": float(np.percentile(samples, 95)),
+        "p99_ms": float(np.percentile(samples, 99)),
+    }
+
+def synthetic_images(count, width=4032, height=3024, seed=0):
+    """
+    Generate phone-camera-sized JPEGs so the benchmark needs no data or network.
+
+    Args:
+        count (int): Number of images
+        width (int): Image width in pixels (default matches a 12 MP photo)
+        height (int): Image height in pixels
+        seed (int): Random seed, so every run decodes the same bytes
+
+    Returns:
+        list[bytes]: JPEG-encoded images
+    """
+    generator = np.random.default_rng(seed)
+    images = []
+    for _ in range(count):
+        # Smooth noise compresses like a photo rather than like static
+        small = generator.integers(0, 256, size=(height // 32, width // 32, 3), dtype=np.uint8)
+        image = Image.fromarray(small).resize((width, height), Image.BILINEAR)
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=90)
+        images.append(buffer.getvalue())
+    return images
+
+def load_folder_images(folder, limit=None):
+    """Read up to limit image files from a folder as raw bytes."""
+    images = []
+    for path in list_images(folder)[:limit]:
+        with open(path, 'rb') as file:
+            images.append(file.read())
+    return images
+
+def benchmark_preprocessing(images, repeat, draft):
+    """
+    Time decode and preprocess stages over every image.
+
+    Returns:
+        tuple[list[torch.Tensor], dict]: Preprocessed tensors and stage -> percentiles
+    """
+    preprocessor = Preprocessor(size=INPUT_SIZE, num_workers=1, draft=draft)
+    decode, preprocess = [], []
+    tensors = []
+    for _ in range(repeat):
+        tensors = []
+        for image_bytes in images:
+            tensor, timings = preprocessor.preprocess_timed(image_bytes)
+            decode.append(timings["decode"])
+            preprocess.append(timings["resize"] + timings["normalize"])
+            tensors.append(tensor)
+    preprocessor.shutdown()
+    return tensors, {"decode": percentiles(decode), "preprocess": percentiles(preprocess)}
+
+def build_runner(backend_name, precision, weights, tensors, threads):
+    """
+    Create the callable to benchmark, or None if the combination is unavailable.
+
+    Returns:
+        callable | None: Maps a batch tensor to logits
+    """
+    if backend_name != "eager":
+        if precision != "fp32":
+            return None
+        if not os.path.exists(artifact_paths(weights)[backend_name]):
+            print(f"Skipping {backend_name}: run export_model.py first")
+            return None
+        if backend_name == "onnx":
+            return OnnxRuntimeBackend(artifact_paths(weights)["onnx"], num_threads=threads)
+        return load_backend(backend_name, weights)
+
+    model = load_model(weights)
+    calibration = None
+    if precision == "static_int8":
+        calibration = [torch.cat(tensors[start:start + 8]) for start in range(0, len(tensors), 8)]
+    return load_backend("eager", weights, model=apply_precision(model, precision, calibration))
+
+def benchmark_forward(runner, tensors, batch_size, warmup, iterations):
+    """
+    Time forward passes over batches built from the preprocessed tensors.
+
+    Returns:
+        dict: Latency percentiles per batch and images_per_sec
+    """
+    batches = [
+        torch.cat([tensors[(start + offset) % len(tensors)] for offset in range(batch_size)])
+        for start in range(0, max(len(tensors), batch_size), batch_size)
+    ]
+    with torch.no_grad():
+        for index in range(warmup):
+            runner(batches[index % len(batches)])
+
+        latencies = []
+        started = time.perf_counter()
+        for index in range(iterations):
+            batch_started = time.perf_counter()
+            runner(batches[index % len(batches)])
+            latencies.append(time.perf_counter() - batch_started)
+        elapsed = time.perf_counter() - started
+
+    return {**percentiles(latencies), "images_per_sec": batch_size * iterations / elapsed}
+
+def compare_results(results, baseline, tolerance):
+    """
+    Flag configurations that got slower than the baseline.
+
+    A configuration regresses when its throughput drops, or its p95 latency
+    grows, by more than tolerance (a fraction, e.g. 0.1 for 10%).
+
+    Returns:
+        list[str]: One message per regression
+    """
+    regressions = []
+    baseline_runs = {run["key"]: run for run in baseline["forward"]}
+    for run in results["forward"]:
+        reference = baseline_runs.get(run["key"])
+        if reference is None:
+            continue
+        if run["images_per_sec"] < reference["images_per_sec"] * (1 - tolerance):
+            regressions.append(f"{run['key']}: throughput {run['images_per_sec']:.1f} img/s "
+                               f"vs baseline {reference['images_per_sec']:.1f} img/s")
+        if run["p95_ms"] > reference["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{run['key']}: p95 {run['p95_ms']:.1f} ms vs baseline {reference['p95_ms']:.1f} ms")
+
+    for stage, stats in results["preprocessing"].items():
+        reference = baseline.get("preprocessing", {}).get(stage)
+        if reference and stats["p95_ms"] > reference["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{stage}: p95 {stats['p95_ms']:.1f} ms vs baseline {reference['p95_ms']:.1f} ms")
+    return regressions
+
+def run_benchmark(args):
+    if args.images:
+        images = load_folder_images(args.images, args.limit)
+        source = args.images
+    else:
+        images = synthetic_images(args.synthetic)
+        source = f"synthetic:{args.synthetic}"
+    if not images:
+        raise ValueError(f"No images found in {args.images}")
+
+    print(f"Preprocessing {len(images)} images from {source}...")
+    tensors, preprocessing = benchmark_preprocessing(images, args.preprocess_repeat, draft=not args.no_draft)
+    for stage, stats in preprocessing.items():
+        print(f"  {stage:<11} mean {stats['mean_ms']:.2f} ms, p50 {stats['p50_ms']:.2f}, "
+              f"p95 {stats['p95_ms']:.2f}, p99 {stats['p99_ms']:.2f}")
+
+    forward = []
+    for backend_name in args.backends:
+        # Precision modes wrap the eager model; exported backends only run fp32
+        precisions = args.precisions if backend_name == "eager" else [p for p in args.precisions if p == "fp32"]
+        for precision in precisions:
+            for threads in args.threads:
+                torch.set_num_threads(threads)
+                runner = build_runner(backend_name, precision, args.weights, tensors, threads)
+                if runner is None:
+                    break
+                for batch_size in args.batch_sizes:
+                    key = f"{backend_name}/{precision}/threads={threads}/batch={batch_size}"
+                    stats = benchmark_forward(runner, tensors, batch_size, args.warmup, args.iterations)
+                    forward.append({
+                        "key": key,
+                        "backend": backend_name,
+                        "precision": precision,
+                        "threads": threads,
+                        "batch_size": batch_size,
+                        **stats,
+                    })
+                    print(f"  {key:<45} {stats['images_per_sec']:>8.1f} img/s   p50 {stats['p50_ms']:.1f} ms, "
+                          f"p95 {stats['p95_ms']:.1f} ms, p99 {stats['p99_ms']:.1f} ms")
+
+    return {
+        "environment": {
+            "torch": torch.__version__,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+        },
+        "source": source,
+        "images": len(images),
+        "warmup": args.warmup,
+        "iterations": args.iterations,
+        "preprocessing": preprocessing,
+        "forward": forward,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark preprocessing and inference across backends and precisions")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--images", help="Local image folder to benchmark on")
+    source.add_argument("--synthetic", type=int, default=8, help="Number of synthetic 12 MP JPEGs (default 8)")
+    source.add_argument("--results", help="Skip benchmarking and compare this saved result file with --compare")
+    parser.add_argument("--limit", type=int, help="Use at most this many folder images")
+    parser.add_argument("--weights", default="../Models/model_0.pth")
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=BACKENDS)
+    parser.add_argument("--precisions", nargs="+", default=list(PRECISIONS), choices=PRECISIONS,
+                        help="Precision modes to measure on the eager backend (default: all)")
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 4, 8])
+    parser.add_argument("--threads", nargs="+", type=int, default=[torch.get_num_threads()])
+    parser.add_argument("--warmup", type=int, default=3, help="Untimed forward passes per configuration")
+    parser.add_argument("--iterations", type=int, default=20, help="Timed forward passes per configuration")
+    parser.add_argument("--preprocess-repeat", type=int, default=3, help="Timed passes over the images for preprocessing")
+    parser.add_argument("--no-draft", action="store_true", help="Disable JPEG draft-mode decoding")
+    parser.add_argument("--output", help="Write results to this JSON file")
+    parser.add_argument("--compare", help="Baseline JSON to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Allowed slowdown before flagging (default 0.10)")
+    args = parser.parse_args()
+
+    if args.results:
+        if not args.compare:
+            parser.error("--results needs --compare")
+        with open(args.results) as file:
+            results = json.load(file)
+    else:
+        results = run_benchmark(args)
+        if args.output:
+            with open(args.output, 'w') as file:
+                json.dump(results, file, indent=2)
+            print(f"Results saved to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        regressions = compare_results(results, baseline, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} regressions against {args.compare}:")
+            for message in regressions:
+                print(f"  {message}")
+            sys.exit(1)
+        print(f"No regressions against {args.compare} (tolerance {args.tolerance:.0%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+"""
+Re-classify a whole image collection offline, e.g. the images bucket after a model update.
+
+Pipeline:
+    1. List the image ids in a local directory (--input-dir) or under a
+       storage prefix (--prefix, using storage_from_env(): Supabase, or
+       LOCAL_STORAGE_DIR as a stand-in).
+    2. Download, decode and resize images in parallel worker processes
+       (--workers), so JPEG decoding is not limited to one core by the GIL.
+    3. Normalize and stack them into batches (--batch-size) for one forward
+       pass each, through the same model, backend and precision setup as the API.
+    4. Stream one row per image (image_id, predicted_class, top_k as JSON,
+       download/decode/forward milliseconds, error) into numbered CSV or
+       Parquet part files in the output directory.
+
+Each part file is written atomically (also when the run is interrupted with
+Ctrl-C), and the ids already in the output directory are skipped on start-up,
+so an interrupted run picks up where it stopped: rerun the same command.
+Images that failed are retried on resume.
+The output directory records the model fingerprint, backend and precision and
+refuses to mix results from different weights or inference configurations.
+
+Usage:
+    python bulk_classify.py --input-dir UploadImages --output ../Data/results
+    python bulk_classify.py --prefix 2024/ --output ../Data/results --format parquet --workers 8 --batch-size 16
+"""
+import argparse
+import csv
+import glob
+import json
+import os
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import torch
+
+from backends import BACKENDS, load_backend
+from cascade import summarize
+from model import INPUT_SIZE, load_model
+from precision import PRECISIONS, apply_precision, calibration_batches
+from prediction_cache import file_fingerprint
+from preprocessing import IMAGE_EXTENSIONS, Preprocessor
+from storage import LocalStorage, storage_from_env
+
+# Settings that change the predictions; a resumed run must match all of them
+RESUME_KEYS = ("model_fingerprint", "backend", "precision")
+COLUMNS = ("image_id", "predicted_class", "top_k", "download_ms", "decode_ms", "forward_ms", "error")
+
+# Set in each worker process by _init_worker
+_storage = None
+_preprocessor = None
+
+
+def _init_worker(input_dir, size, draft):
+    global _storage, _preprocessor
+    torch.set_num_threads(1)  # Workers only decode; leave the cores to each other
+    _storage = LocalStorage(input_dir) if input_dir else storage_from_env()
+    _preprocessor = Preprocessor(size=size, num_workers=1, draft=draft)
+
+def _load_image(image_id):
+    """
+    Download, decode and resize one image in a worker process.
+
+    Returns:
+        tuple: (image_id, uint8 HWC pixels or None, download seconds, decode seconds, error or None)
+    """
+    started = time.perf_counter()
+    try:
+        image_bytes = _storage.download(image_id)
+        downloaded = time.perf_counter()
+        pixels = _preprocessor.resize(_preprocessor.decode(image_bytes))
+        # Hand back uint8 pixels; they pickle at a quarter of the size of the float tensor
+        return image_id, np.asarray(pixels), downloaded - started, time.perf_counter() - downloaded, None
+    except Exception as e:
+        return image_id, None, time.perf_counter() - started, 0.0, str(e)
+
+
+class PartWriter:
+    """
+    Write result rows to numbered part files, each one created atomically.
+
+    Args:
+        directory (str): Output directory
+        file_format (str): "csv" or "parquet"
+        rows_per_part (int): Rows buffered before a part file is written
+    """
+
+    def __init__(self, directory, file_format="csv", rows_per_part=1000):
+        self.directory = directory
+        self.file_format = file_format
+        self.rows_per_part = rows_per_part
+        self._rows = []
+        self._next_part = len(part_files(directory, file_format))
+
+    def write(self, row):
+        self._rows.append(row)
+        if len(self._rows) >= self.rows_per_part:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered rows as the next part file."""
+        if not self._rows:
+            return
+        path = os.path.join(self.directory, f"part-{self._next_part:05d}.{self.file_format}")
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        os.close(fd)
+        if self.file_format == "parquet":
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            pq.write_table(pa.Table.from_pylist(self._rows), tmp_path)
+        else:
+            with open(tmp_path, "w", newline="", encoding="utf-8") as file:
+                writer = csv.DictWriter(file, fieldnames=COLUMNS)
+                writer.writeheader()
+                writer.writerows(self._rows)
+        os.replace(tmp_path, path)
+        self._next_part += 1
+        self._rows = []
+
+
+def part_files(directory, file_format):
+    """Existing part files in an output directory, in order."""
+    return sorted(glob.glob(os.path.join(directory, f"part-*.{file_format}")))
+
+def completed_ids(directory, file_format):
+    """
+    Ids already classified without error in an output directory.
+
+    Returns:
+        set[str]: Image ids to skip when resuming
+    """
+    done = set()
+    for path in part_files(directory, file_format):
+        if file_format == "parquet":
+            import pyarrow.parquet as pq
+            rows = pq.read_table(path, columns=["image_id", "error"]).to_pylist()
+        else:
+            with open(path, newline="", encoding="utf-8") as file:
+                rows = list(csv.DictReader(file))
+        done.update(row["image_id"] for row in rows if not row["error"])
+    return done
+
+def check_manifest(directory, manifest):
+    """Record the run configuration, or verify that a resumed run matches it."""
+    path = os.path.join(directory, "manifest.json")
+    if os.path.exists(path):
+        with open(path) as file:
+            existing = json.load(file)
+        changed = [key for key in RESUME_KEYS if existing.get(key) != manifest[key]]
+        if changed:
+            described = ", ".join(f"{key} {existing.get(key)} != {manifest[key]}" for key in changed)
+            raise ValueError(f"{directory} holds results from a different configuration ({described}); "
+                             f"use a new --output directory")
+        return
+    with open(path, "w") as file:
+        json.dump(manifest, file, indent=2)
+
+def build_backend(args):
+    """Create the inference backend the same way the API does (eager precision modes on CPU only)."""
+    model = load_model(args.weights)
+    if args.precision != "fp32":
+        calibration = calibration_batches(args.calibration) if args.precision == "static_int8" else None
+        model = apply_precision(model, args.precision, calibration)
+    return load_backend(args.backend, args.weights, model=model if args.backend == "eager" else None)
+
+def main():
+    parser = argparse.ArgumentParser(description="Classify every image in a folder or storage prefix")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--input-dir", help="Local image directory")
+    source.add_argument("--prefix", help="Storage prefix to classify (Supabase, or LOCAL_STORAGE_DIR)")
+    parser.add_argument("--output", required=True, help="Output directory for part files")
+    parser.add_argument("--format", choices=("csv", "parquet"), default="csv")
+    parser.add_argument("--rows-per-part", type=int, default=1000, help="Rows per part file, i.e. checkpoint interval")
+    parser.add_argument("--weights", default="../Models/model_0.pth")
+    parser.add_argument("--backend", choices=BACKENDS, default=os.getenv("INFERENCE_BACKEND", "eager"))
+    parser.add_argument("--precision", choices=PRECISIONS, default=os.getenv("INFERENCE_PRECISION", "fp32"))
+    parser.add_argument("--calibration", default=os.getenv("CALIBRATION_DIR", "../Models/calibration"))
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) // 2), help="Decode processes")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--no-draft", action="store_true", help="Disable JPEG draft-mode decoding")
+    parser.add_argument("--limit", type=int, help="Classify at most this many images")
+    args = parser.parse_args()
+
+    os.makedirs(args.output, exist_ok=True)
+    check_manifest(args.output, {
+        "model_fingerprint": file_fingerprint(args.weights),
+        "backend": args.backend,
+        "precision": args.precision,
+        "source": args.input_dir or f"prefix:{args.prefix}",
+    })
+
+    storage = LocalStorage(args.input_dir) if args.input_dir else storage_from_env()
+    image_ids = [image_id for image_id in storage.list(args.prefix or "") if image_id.lower().endswith(IMAGE_EXTENSIONS)]
+    done = completed_ids(args.output, args.format)
+    todo = [image_id for image_id in image_ids if image_id not in done][:args.limit]
+    print(f"{len(image_ids)} images found, {len(done)} already classified, {len(todo)} to go")
+    if not todo:
+        return
+
+    backend = build_backend(args)
+    normalizer = Preprocessor(size=INPUT_SIZE, num_workers=1)
+    writer = PartWriter(args.output, args.format, args.rows_per_part)
+    started = time.perf_counter()
+    last_report = started
+    classified = 0
+
+    def run_batch(batch):
+        forward_started = time.perf_counter()
+        probabilities = backend(torch.cat([normalizer.normalize(pixels) for _, pixels, _, _ in batch])).float().softmax(1)
+        forward_ms = (time.perf_counter() - forward_started) * 1000.0 / len(batch)
+        for (image_id, _, download_s, decode_s), row in zip(batch, probabilities):
+            summary = summarize(row, "full", args.top_k)
+            writer.write({
+                "image_id": image_id,
+                "predicted_class": summary["predicted_class"],
+                "top_k": json.dumps(summary["top_k"]),
+                "download_ms": download_s * 1000.0,
+                "decode_ms": decode_s * 1000.0,
+                "forward_ms": forward_ms,
+                "error": "",
+            })
+
+    pending = iter(todo)
+    window = deque()
+    pool = ProcessPoolExecutor(args.workers, initializer=_init_worker, initargs=(args.input_dir, INPUT_SIZE, not args.no_draft))
+    try:
+        # Keep a bounded number of decoded images in flight so memory stays flat
+        for image_id in pending:
+            window.append(pool.submit(_load_image, image_id))
+            if len(window) >= args.batch_size * 2 + args.workers:
+                break
+
+        batch = []
+        while window:
+            image_id, pixels, download_s, decode_s, error = window.popleft().result()
+            next_id = next(pending, None)
+            if next_id is not None:
+                window.append(pool.submit(_load_image, next_id))
+
+            if error is not None:
+                print(f"Failed to load {image_id}: {error}")
+                writer.write({"image_id": image_id, "predicted_class": "", "top_k": "", "download_ms": download_s * 1000.0,
+                              "decode_ms": 0.0, "forward_ms": 0.0, "error": error})
+            else:
+                batch.append((image_id, pixels, download_s, decode_s))
+
+            if batch and (len(batch) == args.batch_size or not window):
+                run_batch(batch)
+                classified += len(batch)
+                batch = []
+                if time.perf_counter() - last_report >= 10.0:
+                    last_report = time.perf_counter()
+                    print(f"{classified}/{len(todo)} classified ({classified / (last_report - started):.1f} images/s)")
+    finally:
+        # Keep everything classified so far, so a resumed run does not redo it
+        writer.flush()
+        pool.shutdown(cancel_futures=True)
+    elapsed = time.perf_counter() - started
+    print(f"Classified {classified} images in {elapsed:.1f}s ({classified / elapsed:.1f} images/s); results in {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Confidence-gated multi-resolution cascade.
+
+DenseNet121 ends in adaptive average pooling, so the same weights accept any
+input resolution, and its cost grows with the pixel count: a 256x256 pass is
+about a quarter of a 512x512 one. The cascade first classifies a downsampled
+copy of the image and only re-runs it at full resolution when the low tier is
+unsure, i.e. when the softmax margin (top-1 minus top-2 probability) is below
+a threshold.
+
+The low-resolution input is downsampled from the already preprocessed 512x512
+tensor rather than decoded again, so an escalated image is decoded only once.
+Normalization is linear, so downsampling after normalizing gives the same
+tensor as normalizing after downsampling.
+
+Use evaluate_cascade.py to pick the threshold for a target agreement with
+full-resolution predictions.
+"""
+import torch.nn.functional as F
+
+from model import INPUT_SIZE, class_labels
+
+TIERS = ("low", "full")
+
+
+def downsample(batch, size):
+    """
+    Resize a preprocessed batch to the low-resolution tier.
+
+    Args:
+        batch (torch.Tensor): Normalized images of shape (N, 3, H, W)
+        size (int): Square output resolution
+
+    Returns:
+        torch.Tensor: Batch of shape (N, 3, size, size)
+    """
+    if batch.shape[-1] == size and batch.shape[-2] == size:
+        return batch
+    return F.interpolate(batch, size=(size, size), mode="bilinear", align_corners=False, antialias=True)
+
+def softmax_margin(probabilities):
+    """
+    Gap between the two most likely classes, per image.
+
+    Args:
+        probabilities (torch.Tensor): Softmax outputs of shape (N, classes) or (classes,)
+
+    Returns:
+        torch.Tensor: Margins in [0, 1], shape (N,) or scalar
+    """
+    top2 = probabilities.topk(2, dim=-1).values
+    return top2[..., 0] - top2[..., 1]
+
+def relative_cost(size, full_size=INPUT_SIZE):
+    """Compute cost of a forward pass at size x size relative to full resolution."""
+    return (size / full_size) ** 2
+
+def summarize(probabilities, tier, k=3):
+    """
+    Build the response fields for one image.
+
+    Args:
+        probabilities (torch.Tensor): Softmax outputs of shape (classes,)
+        tier (str): Tier that produced them, one of TIERS
+        k (int): Number of most likely classes to report
+
+    Returns:
+        dict: predicted_class, top_k [{label, probability}] and tier
+    """
+    values, indices = probabilities.topk(min(k, len(class_labels)))
+    top_k = [
+        {"label": class_labels[index], "probability": round(value, 6)}
+        for value, index in zip(values.tolist(), indices.tolist())
+    ]
+    return {"predicted_class": top_k[0]["label"], "top_k": top_k, "tier": tier}
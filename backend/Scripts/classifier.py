@@ -0,0 +1,478 @@
+"""
+Inference runtime shared by the HTTP front ends (app.py, async_app.py).
+
+Loads the model once per process and wires together the preprocessing pool,
+the batching scheduler and the prediction cache. Nothing here knows about
+HTTP or Supabase: callers hand in raw image bytes.
+
+Configuration (environment variables):
+    BATCH_MAX_SIZE / BATCH_MAX_WAIT_MS      Micro-batching limits (default 8 / 5 ms)
+    PREDICTION_CACHE_SIZE                   In-memory prediction cache entries (default 1024)
+    PREDICTION_CACHE_DIR                    Optional on-disk prediction cache tier
+    PREDICTION_CACHE_DISK_ENTRIES           Files kept in the on-disk tier, least recently
+                                            used evicted first (default 100000)
+    PREPROCESS_WORKERS / PREPROCESS_DRAFT   Preprocessing pool size / JPEG draft decode
+    INFERENCE_BACKEND                       eager (default), torchscript or onnx
+    INFERENCE_PRECISION                     fp32 (default), dynamic_int8, static_int8,
+                                            channels_last or bf16 (eager on CPU only)
+    CALIBRATION_DIR                         Calibration images for static_int8
+    CASCADE_ENABLED                         Set to 1 to answer confident images at low resolution
+    CASCADE_LOW_SIZE / CASCADE_MARGIN       Low tier resolution / softmax margin needed to stop
+                                            there (default 256 / 0.5; eager or torchscript only)
+    TOP_K                                   Most likely classes returned per image (default 3)
+    FEATURE_INDEX_DIR                       Store penultimate features of every classified image
+                                            for similar-case lookup (eager backend, one process)
+    FEATURE_INDEX_DTYPE                     float32 (default) or int8 feature storage
+    FEATURE_INDEX_APPROXIMATE_MIN           Index size from which IVF search is used (default 200000)
+    DUPLICATE_MAX_DISTANCE                  Answer images within this many perceptual hash bits
+                                            of an indexed one without inference (default -1, off)
+    WARMUP_ITERATIONS                       Forward passes before reporting ready (default 3)
+    PREFORK_SERVING                         Set to 1 by gunicorn.conf.py to defer
+                                            background threads until after fork
+    PROFILE_EVERY_N / PROFILE_DIR           Profile one request in N with torch.profiler
+                                            and save Chrome traces (default off / ./profiles)
+
+Per-stage latency histograms (download, decode, preprocess, queue_wait,
+forward, forward_low, postprocess), process RSS and thread counts are exposed through
+`metrics` for the front ends' GET /metrics endpoint.
+"""
+import time
+startup_started = time.perf_counter()  # Measured before the heavy imports below
+
+import atexit
+import hashlib
+import os
+import threading
+from collections import Counter
+from concurrent.futures import CancelledError, Future, InvalidStateError
+import torch
+from dotenv import load_dotenv
+from backends import check_equivalence, load_backend
+from batching import BatchScheduler
+from cascade import downsample, softmax_margin, summarize
+from feature_index import FeatureCapture, FeatureIndex, perceptual_hash
+from metrics import MetricsRegistry, ProfilerSampler, process_rss_bytes
+from model import load_model
+from precision import apply_precision, calibration_batches
+from preprocessing import Preprocessor
+from prediction_cache import PredictionCache, file_fingerprint, prediction_key
+
+
+# Load environment variables
+load_dotenv()
+
+# Load the fine-tuned DenseNet121 model (architecture and class labels live in model.py)
+MODEL_PATH = '../Models/model_0.pth'
+device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+model = load_model(MODEL_PATH, device)
+print(f"Model loaded {time.perf_counter() - startup_started:.2f}s after startup")
+
+# CPU Precision Mode: fp32, dynamic_int8, static_int8, channels_last or bf16 (see evaluate_precision.py)
+INFERENCE_PRECISION = os.getenv("INFERENCE_PRECISION", "fp32")
+
+# Inference Backend: eager PyTorch, TorchScript or ONNX Runtime (see export_model.py)
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "eager")
+if INFERENCE_PRECISION != "fp32":
+    if INFERENCE_BACKEND != "eager" or device.type != "cpu":
+        raise ValueError("INFERENCE_PRECISION other than fp32 is only supported with the eager backend on CPU")
+    calibration = None
+    if INFERENCE_PRECISION == "static_int8":
+        calibration = calibration_batches(os.getenv("CALIBRATION_DIR", "../Models/calibration"))
+    model = apply_precision(model, INFERENCE_PRECISION, calibration)
+backend = load_backend(INFERENCE_BACKEND, MODEL_PATH, device, model=model)
+if INFERENCE_BACKEND != "eager":
+    # Refuse to serve from a backend that disagrees with the eager logits
+    equivalence = check_equivalence(backend, model)
+    print(f"Backend equivalence check: {equivalence}")
+    if not equivalence["equivalent"]:
+        raise ValueError(f"{INFERENCE_BACKEND} backend logits differ from eager (max abs diff {equivalence['max_abs_diff']:.2e})")
+    model = None  # Only the exported backend is needed from here on
+
+# Resolution Cascade: answer confident images at low resolution, escalate the rest (see cascade.py)
+CASCADE_ENABLED = os.getenv("CASCADE_ENABLED", "0") == "1"
+CASCADE_LOW_SIZE = int(os.getenv("CASCADE_LOW_SIZE", "256"))
+CASCADE_MARGIN = float(os.getenv("CASCADE_MARGIN", "0.5"))
+TOP_K = int(os.getenv("TOP_K", "3"))
+if CASCADE_ENABLED and INFERENCE_BACKEND == "onnx":
+    raise ValueError("CASCADE_ENABLED needs the eager or torchscript backend; the ONNX export has a fixed 512x512 input")
+
+# Feature Index: penultimate activations of every classified image, for similar-case lookup (see feature_index.py)
+FEATURE_INDEX_DIR = os.getenv("FEATURE_INDEX_DIR")
+DUPLICATE_MAX_DISTANCE = int(os.getenv("DUPLICATE_MAX_DISTANCE", "-1"))
+feature_index = None
+feature_capture = None
+if FEATURE_INDEX_DIR:
+    if INFERENCE_BACKEND != "eager":
+        raise ValueError("FEATURE_INDEX_DIR needs the eager backend; exported backends do not expose the penultimate layer")
+    if INFERENCE_PRECISION == "static_int8":
+        raise ValueError("FEATURE_INDEX_DIR does not support INFERENCE_PRECISION=static_int8; FX conversion fuses away "
+                         "the penultimate layer, so use fp32, dynamic_int8, channels_last or bf16")
+    if os.getenv("PREFORK_SERVING") == "1" and int(os.getenv("WEB_CONCURRENCY", "1")) > 1:
+        raise ValueError("FEATURE_INDEX_DIR needs a single serving process; set WEB_CONCURRENCY=1")
+    feature_capture = FeatureCapture(model)
+    feature_index = FeatureIndex(
+        FEATURE_INDEX_DIR,
+        dtype=os.getenv("FEATURE_INDEX_DTYPE", "float32"),
+        approximate_min=int(os.getenv("FEATURE_INDEX_APPROXIMATE_MIN", "200000")),
+    )
+    atexit.register(feature_index.flush)  # Write the lagging manifest on shutdown
+    print(f"Feature index: {feature_index.stats()}")
+
+# Metrics: per-stage latency histograms plus process gauges, rendered on GET /metrics
+metrics = MetricsRegistry()
+stage_seconds = metrics.histogram(
+    "dermai_stage_seconds",
+    "Time spent in each classify_image stage (forward is per batch, the rest per image)",
+    label_name="stage",
+)
+batch_size = metrics.histogram("dermai_batch_size", "Images per forward pass", buckets=(1, 2, 4, 8, 16, 32, 64))
+profiler = ProfilerSampler(every_n=int(os.getenv("PROFILE_EVERY_N", "0")), output_dir=os.getenv("PROFILE_DIR", "profiles"))
+
+# Preprocessing Engine (decode/resize/normalize on a sized thread pool)
+preprocessor = Preprocessor(
+    size=512,  # DenseNet121 input size
+    num_workers=int(os.getenv("PREPROCESS_WORKERS", str(min(4, os.cpu_count() or 1)))),
+    draft=os.getenv("PREPROCESS_DRAFT", "1") == "1",
+)
+
+def preprocess_image(image_bytes):
+    """
+    Preprocess the input image for the model.
+
+    Args:
+        image_bytes (bytes): Raw image data in bytes
+
+    Returns:
+        torch.Tensor: Preprocessed image tensor ready for model input
+
+    Process:
+    1. Decode (JPEGs at reduced scale close to 512px) and resize to 512x512 pixels
+    2. Convert to a float tensor and normalize using ImageNet statistics in one pass
+    3. Add batch dimension
+
+    The work runs on the preprocessing thread pool; see preprocessing.py.
+    """
+    return preprocessor.submit(image_bytes).result()
+
+def run_batch(batch, stage="forward"):
+    """
+    Run one forward pass over a batch of preprocessed images.
+
+    Args:
+        batch (torch.Tensor): Image tensors of shape (N, 3, H, W)
+        stage (str): Histogram label the forward time is recorded under
+
+    Returns:
+        list[tuple[torch.Tensor, torch.Tensor | None]]: Softmax probabilities over
+        class_labels and penultimate features (None without a feature index)
+        for each image in the batch
+    """
+    started = time.perf_counter()
+    with profiler.maybe_profile(requests=len(batch)):
+        outputs = backend(batch)
+    forwarded = time.perf_counter()
+    probabilities = list(outputs.float().softmax(1))
+    features = feature_capture.pop() if feature_capture is not None else None
+    features = list(features) if features is not None else [None] * len(batch)
+
+    stage_seconds.observe(forwarded - started, stage)
+    stage_seconds.observe((time.perf_counter() - forwarded) / len(batch), "postprocess")
+    batch_size.observe(len(batch))
+    return list(zip(probabilities, features))
+
+# Batching Scheduler shared by all request threads
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "8"))
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", "5"))
+
+scheduler = BatchScheduler(
+    run_batch,
+    max_batch_size=BATCH_MAX_SIZE,
+    max_wait_ms=BATCH_MAX_WAIT_MS,
+    on_queue_wait=lambda seconds: stage_seconds.observe(seconds, "queue_wait"),
+)
+
+# Low-resolution tier of the cascade; batches must share one resolution, so it has its own scheduler
+low_scheduler = BatchScheduler(
+    lambda batch: run_batch(batch, "forward_low"),
+    max_batch_size=BATCH_MAX_SIZE,
+    max_wait_ms=BATCH_MAX_WAIT_MS,
+    on_queue_wait=lambda seconds: stage_seconds.observe(seconds, "queue_wait"),
+)
+cascade_lock = threading.Lock()
+cascade_answers = Counter({"low": 0, "full": 0, "duplicate": 0})
+cascade_escalations = 0
+
+metrics.gauge(
+    "dermai_batch_queue_depth",
+    "Images waiting for a forward pass",
+    lambda: scheduler.stats()["queue_depth"] + low_scheduler.stats()["queue_depth"],
+)
+metrics.gauge("dermai_cascade_answers", "Predictions answered by each cascade tier", lambda: dict(cascade_answers), label_name="tier")
+metrics.gauge("process_resident_memory_bytes", "Resident memory size in bytes", process_rss_bytes)
+metrics.gauge(
+    "dermai_torch_threads",
+    "PyTorch thread pool sizes",
+    lambda: {"intra_op": torch.get_num_threads(), "inter_op": torch.get_num_interop_threads()},
+    label_name="kind",
+)
+
+# Prediction Cache keyed by image content and model weights
+model_fingerprint = f"{file_fingerprint(MODEL_PATH)}:{INFERENCE_BACKEND}:{INFERENCE_PRECISION}:top{TOP_K}"
+if CASCADE_ENABLED:
+    model_fingerprint += f":cascade{CASCADE_LOW_SIZE}@{CASCADE_MARGIN}"
+prediction_cache = PredictionCache(
+    max_entries=int(os.getenv("PREDICTION_CACHE_SIZE", "1024")),
+    cache_dir=os.getenv("PREDICTION_CACHE_DIR") or None,
+    disk_max_entries=int(os.getenv("PREDICTION_CACHE_DISK_ENTRIES", "100000")),
+)
+
+# Warmup: run a few forward passes so the first real request is not served cold
+WARMUP_ITERATIONS = int(os.getenv("WARMUP_ITERATIONS", "3"))
+ready = threading.Event()
+first_prediction = threading.Event()
+
+def warm_up():
+    """Run WARMUP_ITERATIONS forward passes through the backend, then mark the service ready."""
+    started = time.perf_counter()
+    examples = [torch.zeros(1, 3, 512, 512)]
+    if CASCADE_ENABLED:
+        examples.append(torch.zeros(1, 3, CASCADE_LOW_SIZE, CASCADE_LOW_SIZE))
+    for _ in range(WARMUP_ITERATIONS):
+        for example in examples:
+            backend(example)
+    ready.set()
+    print(f"Warmup of {WARMUP_ITERATIONS} forward passes took {time.perf_counter() - started:.2f}s; "
+          f"ready {time.perf_counter() - startup_started:.2f}s after startup")
+
+def start_background_workers():
+    """
+    Start the batching scheduler and the background warmup.
+
+    Threads do not survive fork(), so under the pre-fork server (gunicorn.conf.py,
+    PREFORK_SERVING=1) this is called in each worker after forking instead of
+    at import time in the master.
+    """
+    scheduler.start()
+    if CASCADE_ENABLED:
+        low_scheduler.start()
+    threading.Thread(target=warm_up, name="warmup", daemon=True).start()
+
+if os.getenv("PREFORK_SERVING") != "1":
+    start_background_workers()
+
+def submit_prediction(image_bytes, image_id=None):
+    """
+    Start classifying raw image bytes without blocking the caller.
+
+    Preprocessing runs on the preprocessing pool and inference on the batching
+    scheduler. With CASCADE_ENABLED the image is first classified at
+    CASCADE_LOW_SIZE and only re-run at 512x512 when the softmax margin is
+    below CASCADE_MARGIN. With a feature index, an image whose perceptual hash
+    is within DUPLICATE_MAX_DISTANCE bits of an indexed image is answered from
+    the stored probabilities without inference, and every other image's
+    features are appended to the index. Cancelling the returned future withdraws the image from
+    whichever of the two it is still queued in, so work a caller has given up
+    on is not done.
+
+    Args:
+        image_bytes (bytes): Raw image data
+        image_id (str | None): Id stored in the feature index; defaults to the
+            SHA-256 of the bytes
+
+    Returns:
+        concurrent.futures.Future: Resolves to {"predicted_class": label,
+        "top_k": [{"label", "probability"}, ...], "tier": "low", "full" or
+        "duplicate"}, plus "duplicate_of" for duplicates
+    """
+    result = Future()
+
+    def settle(outcome):
+        try:
+            if outcome.exception() is not None:
+                result.set_exception(outcome.exception())
+                return True
+        except CancelledError:
+            result.cancel()
+            return True
+        except InvalidStateError:
+            return True  # The caller cancelled result in the meantime
+        return False
+
+    def answer(summary, tier):
+        with cascade_lock:
+            cascade_answers[tier] += 1
+        try:
+            result.set_result(summary)
+        except InvalidStateError:
+            pass
+
+    def infer(target, image_tensor, tier, full_tensor=None, image_hash=None):
+        inference = target.submit(image_tensor)
+        result.add_done_callback(lambda _: inference.cancel() if result.cancelled() else None)
+        inference.add_done_callback(lambda done: on_inferred(done, tier, full_tensor, image_hash))
+
+    def on_inferred(inference, tier, full_tensor, image_hash):
+        global cascade_escalations
+        if settle(inference):
+            return
+        probabilities, features = inference.result()
+        if tier == "low" and softmax_margin(probabilities).item() < CASCADE_MARGIN:
+            if result.cancelled():
+                return
+            with cascade_lock:
+                cascade_escalations += 1
+            infer(scheduler, full_tensor, "full", image_hash=image_hash)
+            return
+        # Index before answering, so the image is in the index once its prediction resolves
+        if feature_index is not None and features is not None:
+            feature_index.add(
+                image_id or hashlib.sha256(image_bytes).hexdigest(),
+                features.numpy(),
+                probabilities.numpy(),
+                image_hash,
+                content_key(image_bytes),
+            )
+        answer(summarize(probabilities, tier, TOP_K), tier)
+
+    def on_preprocessed(preprocessing):
+        if result.cancelled() or settle(preprocessing):
+            return
+        image_tensor, timings = preprocessing.result()
+        stage_seconds.observe(timings["decode"], "decode")
+        stage_seconds.observe(timings["resize"] + timings["normalize"], "preprocess")
+
+        image_hash = None
+        if feature_index is not None:
+            image_hash = perceptual_hash(image_tensor)
+            duplicate = feature_index.find_duplicate(image_hash, DUPLICATE_MAX_DISTANCE) if DUPLICATE_MAX_DISTANCE >= 0 else None
+            if duplicate is not None:
+                entry = feature_index.entry(duplicate[0])
+                summary = summarize(torch.from_numpy(entry["probabilities"]), "duplicate", TOP_K)
+                answer({**summary, "duplicate_of": entry["image_id"]}, "duplicate")
+                return
+
+        # Run Classification (batched with other in-flight requests)
+        if CASCADE_ENABLED:
+            infer(low_scheduler, downsample(image_tensor, CASCADE_LOW_SIZE), "low", image_tensor, image_hash)
+        else:
+            infer(scheduler, image_tensor, "full", image_hash=image_hash)
+
+    preprocessing = preprocessor.submit_timed(image_bytes)
+    result.add_done_callback(lambda _: preprocessing.cancel() if result.cancelled() else None)
+    preprocessing.add_done_callback(on_preprocessed)
+    return result
+
+def predict(image_bytes, image_id=None):
+    """
+    Classify raw image bytes through the preprocessing pool and batching scheduler.
+
+    Args:
+        image_bytes (bytes): Raw image data
+        image_id (str | None): Id stored in the feature index
+
+    Returns:
+        dict: predicted_class, top_k and tier (see submit_prediction)
+    """
+    return submit_prediction(image_bytes, image_id).result()
+
+def record_prediction_served():
+    """Log the time from startup to the first prediction this process serves."""
+    if not first_prediction.is_set():
+        first_prediction.set()
+        print(f"Time to first prediction: {time.perf_counter() - startup_started:.2f}s after startup")
+
+def content_key(image_bytes):
+    """64-bit key of the exact image bytes, for finding their row in the feature index."""
+    return int.from_bytes(hashlib.sha256(image_bytes).digest()[:8], "big")
+
+def index_cached_prediction(image_bytes, image_id):
+    """
+    Add image_id to the feature index for a prediction served from the cache.
+
+    Identical bytes uploaded under a new id skip inference, so their features
+    are copied from the row stored for those bytes instead.
+    """
+    if feature_index is None or not image_id or feature_index.row_of(image_id) is not None:
+        return
+    row = feature_index.row_of_content(content_key(image_bytes))
+    if row is not None:
+        feature_index.add_copy(image_id, row)
+
+def classify_bytes(image_bytes, image_id=None):
+    """
+    Classify raw image bytes, reusing cached or in-flight predictions.
+
+    Args:
+        image_bytes (bytes): Raw image data
+        image_id (str | None): Id stored in the feature index
+
+    Returns:
+        dict: predicted_class, top_k and tier (see submit_prediction)
+    """
+    # Reuse an earlier prediction for identical bytes, or share one in flight
+    key = prediction_key(image_bytes, model_fingerprint)
+    result = prediction_cache.get_or_compute(key, lambda: predict(image_bytes, image_id))
+    index_cached_prediction(image_bytes, image_id)
+    record_prediction_served()
+    return result
+
+def cascade_stats():
+    """
+    Report how often each cascade tier answered.
+
+    Returns:
+        dict: enabled, low_size, margin, answers per tier, escalations,
+        escalation_rate and the low tier's batching stats
+    """
+    with cascade_lock:
+        answers = dict(cascade_answers)
+        escalations = cascade_escalations
+    total = sum(answers.values())
+    return {
+        "enabled": CASCADE_ENABLED,
+        "low_size": CASCADE_LOW_SIZE,
+        "margin": CASCADE_MARGIN,
+        "answers": answers,
+        "escalations": escalations,
+        "escalation_rate": escalations / total if total else 0.0,
+        "low_batching": low_scheduler.stats(),
+    }
+
+def similar_images(image_id, k=10):
+    """
+    Find the indexed images whose features are closest to an indexed image.
+
+    Args:
+        image_id (str): Id the image was classified under
+        k (int): Number of results
+
+    Returns:
+        list[dict] | None: [{"image_id", "predicted_class", "similarity"}],
+        most similar first, or None if image_id is not in the index
+    """
+    if feature_index is None:
+        raise ValueError("The feature index is disabled; set FEATURE_INDEX_DIR")
+    row = feature_index.row_of(image_id)
+    if row is None:
+        return None
+    matches = []
+    for match, similarity in feature_index.search(feature_index.vector(row), k + 1):
+        if match != row and len(matches) < k:
+            entry = feature_index.entry(match)
+            matches.append({"image_id": entry["image_id"], "predicted_class": entry["predicted_class"], "similarity": similarity})
+    return matches
+
+def stats():
+    """
+    Collect batching, cascade, prediction cache, preprocessing and feature index statistics.
+
+    Returns:
+        dict: Section name -> statistics
+    """
+    return {
+        "batching": scheduler.stats(),
+        "cascade": cascade_stats(),
+        "prediction_cache": prediction_cache.stats(),
+        "preprocessing": preprocessor.stats(),
+        "feature_index": feature_index.stats() if feature_index is not None else None,
+    }
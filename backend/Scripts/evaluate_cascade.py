@@ -0,0 +1,101 @@
+"""
+Choose the resolution cascade settings before enabling CASCADE_ENABLED.
+
+Every image in a held-out folder is classified once at full resolution and
+once at each candidate low resolution. Each (low size, margin) pair is then
+scored without further forward passes:
+    - escalation rate: share of images whose low-tier softmax margin is below
+      the threshold and therefore re-run at 512x512
+    - compute saved versus always running at 512x512, both estimated from
+      pixel counts and measured from the forward-pass times
+    - top-1 agreement of the cascade's answers with full-resolution predictions
+
+Usage:
+    python evaluate_cascade.py --images ../Data/heldout
+    python evaluate_cascade.py --images ../Data/heldout --low-sizes 224 256 --margins 0.2 0.4 0.6 --json cascade.json
+"""
+import argparse
+import json
+import time
+
+import torch
+
+from cascade import downsample, relative_cost, softmax_margin
+from model import INPUT_SIZE, load_model
+from preprocessing import Preprocessor, list_images
+
+
+def classify(model, image_tensor):
+    """Softmax probabilities for one image and the seconds the forward pass took."""
+    start = time.perf_counter()
+    outputs = model(image_tensor)
+    elapsed = time.perf_counter() - start
+    return outputs.float().softmax(1)[0], elapsed
+
+def score(low_probabilities, full_top1, margin, cost, measured_cost):
+    """Escalation rate, compute saved and agreement with full resolution for one margin."""
+    escalated = softmax_margin(low_probabilities) < margin
+    answers = torch.where(escalated, full_top1, low_probabilities.argmax(1))
+    escalation_rate = escalated.float().mean().item()
+    return {
+        "margin": margin,
+        "escalation_rate": escalation_rate,
+        "compute_saved": 1.0 - (cost + escalation_rate),
+        "measured_saved": 1.0 - (measured_cost + escalation_rate),
+        "agreement": (answers == full_top1).float().mean().item(),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate the confidence-gated resolution cascade")
+    parser.add_argument("--images", required=True, help="Held-out image folder")
+    parser.add_argument("--weights", default="../Models/model_0.pth")
+    parser.add_argument("--low-sizes", nargs="+", type=int, default=[256])
+    parser.add_argument("--margins", nargs="+", type=float, default=[0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8])
+    parser.add_argument("--limit", type=int, help="Evaluate at most this many images")
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    paths = list_images(args.images)[:args.limit]
+    if not paths:
+        parser.error(f"No images found in {args.images}")
+
+    preprocessor = Preprocessor(size=INPUT_SIZE, num_workers=1)
+    inputs = []
+    for path in paths:
+        with open(path, 'rb') as file:
+            inputs.append(preprocessor.preprocess(file.read()))
+    preprocessor.shutdown()
+
+    model = load_model(args.weights)
+    results = []
+    with torch.no_grad():
+        for _ in range(args.warmup):
+            model(inputs[0])
+        full = [classify(model, image_tensor) for image_tensor in inputs]
+        full_top1 = torch.stack([probabilities for probabilities, _ in full]).argmax(1)
+        full_seconds = sum(seconds for _, seconds in full)
+
+        print(f"Evaluating {len(inputs)} images; full resolution {full_seconds / len(inputs) * 1000.0:.1f} ms per image")
+        print(f"{'low size':>9}{'margin':>8}{'escalated':>11}{'saved (px)':>12}{'saved (ms)':>12}{'agreement':>11}")
+        for size in args.low_sizes:
+            for _ in range(args.warmup):
+                model(downsample(inputs[0], size))
+            low = [classify(model, downsample(image_tensor, size)) for image_tensor in inputs]
+            low_probabilities = torch.stack([probabilities for probabilities, _ in low])
+            measured_cost = sum(seconds for _, seconds in low) / full_seconds
+
+            for margin in args.margins:
+                result = {"low_size": size, **score(low_probabilities, full_top1, margin, relative_cost(size), measured_cost)}
+                results.append(result)
+                print(f"{size:>9}{margin:>8.2f}{result['escalation_rate']:>11.1%}{result['compute_saved']:>12.1%}"
+                      f"{result['measured_saved']:>12.1%}{result['agreement']:>11.2%}")
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump({"images": len(inputs), "results": results}, file, indent=2)
+        print(f"Results saved to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
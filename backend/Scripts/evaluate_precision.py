@@ -0,0 +1,116 @@
+"""
+Measure the cost of each CPU precision mode before enabling it.
+
+For every mode in precision.PRECISIONS this reports, on a held-out image folder:
+    - latency per image (mean and p95 over single-image forward passes)
+    - memory footprint (serialized weights size and RSS growth while building/running it)
+    - top-1 agreement with fp32 across the 23 class labels
+
+Usage:
+    python evaluate_precision.py --images ../Data/heldout --calibration ../Data/calibration
+    python evaluate_precision.py --images ../Data/heldout --modes fp32 dynamic_int8 bf16 --json precision.json
+"""
+import argparse
+import io
+import json
+import time
+
+import torch
+
+from metrics import process_rss_bytes
+from model import load_model
+from precision import PRECISIONS, apply_precision, calibration_batches
+from preprocessing import Preprocessor, list_images
+
+
+def current_rss_mb():
+    """Resident set size of this process in MB."""
+    return process_rss_bytes() / (1024 * 1024)
+
+def serialized_size_mb(model):
+    """Size of the model's state dict when saved, which also covers packed int8 weights."""
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell() / (1024 * 1024)
+
+def percentile(values, q):
+    """Nearest-rank percentile of a list of numbers."""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100.0 * (len(ordered) - 1))))]
+
+def evaluate_mode(mode, model, inputs, reference_top1, args):
+    """Build one precision mode and measure its latency, memory and fp32 agreement."""
+    rss_before = current_rss_mb()
+    calibration = None
+    if mode == "static_int8":
+        calibration = calibration_batches(args.calibration, limit=args.calibration_limit)
+    candidate = apply_precision(model, mode, calibration)
+
+    latencies = []
+    top1 = []
+    with torch.no_grad():
+        for _ in range(args.warmup):
+            candidate(inputs[0])
+        for image_tensor in inputs:
+            start = time.perf_counter()
+            outputs = candidate(image_tensor)
+            latencies.append((time.perf_counter() - start) * 1000.0)
+            top1.append(outputs.argmax(1).item())
+
+    agreement = sum(a == b for a, b in zip(top1, reference_top1)) / len(top1)
+    return {
+        "mode": mode,
+        "mean_ms": sum(latencies) / len(latencies),
+        "p95_ms": percentile(latencies, 95),
+        "weights_mb": serialized_size_mb(candidate),
+        "rss_growth_mb": current_rss_mb() - rss_before,
+        "top1_agreement": agreement,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare CPU precision modes against fp32")
+    parser.add_argument("--images", required=True, help="Held-out image folder")
+    parser.add_argument("--weights", default="../Models/model_0.pth")
+    parser.add_argument("--modes", nargs="+", default=list(PRECISIONS), choices=PRECISIONS)
+    parser.add_argument("--calibration", help="Calibration image folder (needed for static_int8)")
+    parser.add_argument("--calibration-limit", type=int, default=64)
+    parser.add_argument("--limit", type=int, help="Evaluate at most this many images")
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    if "static_int8" in args.modes and not args.calibration:
+        parser.error("static_int8 needs --calibration")
+
+    paths = list_images(args.images)[:args.limit]
+    if not paths:
+        parser.error(f"No images found in {args.images}")
+
+    preprocessor = Preprocessor(num_workers=1)
+    inputs = []
+    for path in paths:
+        with open(path, 'rb') as file:
+            inputs.append(preprocessor.preprocess(file.read()))
+    preprocessor.shutdown()
+
+    model = load_model(args.weights)
+    with torch.no_grad():
+        reference_top1 = [model(image_tensor).argmax(1).item() for image_tensor in inputs]
+
+    results = []
+    print(f"Evaluating {len(args.modes)} modes on {len(inputs)} images")
+    print(f"{'mode':<15}{'mean ms':>10}{'p95 ms':>10}{'weights MB':>12}{'RSS +MB':>10}{'top-1 agree':>13}")
+    for mode in args.modes:
+        result = evaluate_mode(mode, model, inputs, reference_top1, args)
+        results.append(result)
+        print(f"{mode:<15}{result['mean_ms']:>10.2f}{result['p95_ms']:>10.2f}{result['weights_mb']:>12.1f}"
+              f"{result['rss_growth_mb']:>10.1f}{result['top1_agreement']:>13.2%}")
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump({"images": len(inputs), "results": results}, file, indent=2)
+        print(f"Results saved to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
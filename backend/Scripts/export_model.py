@@ -0,0 +1,76 @@
+"""
+Export the fine-tuned classifier to TorchScript and ONNX.
+
+Writes model_0.ts and model_0.onnx next to the weights file (where
+backends.load_backend expects them), then loads each artifact through its
+backend and checks its logits against the eager model.
+
+Usage:
+    python export_model.py
+    python export_model.py --weights ../Models/model_0.pth --opset 17
+"""
+import argparse
+import sys
+
+import torch
+
+from backends import OnnxRuntimeBackend, TorchScriptBackend, artifact_paths, check_equivalence
+from model import INPUT_SIZE, load_model
+
+
+def export_torchscript(model, path, example):
+    """Trace the model, freeze it for inference and save it."""
+    with torch.no_grad():
+        traced = torch.jit.trace(model, example)
+    frozen = torch.jit.freeze(traced)
+    frozen.save(path)
+
+def export_onnx(model, path, example, opset):
+    """Export the model to ONNX with a dynamic batch dimension."""
+    torch.onnx.export(
+        model,
+        example,
+        path,
+        input_names=["image"],
+        output_names=["logits"],
+        dynamic_axes={"image": {0: "batch"}, "logits": {0: "batch"}},
+        opset_version=opset,
+        do_constant_folding=True,
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description="Export model weights to TorchScript and ONNX")
+    parser.add_argument("--weights", default="../Models/model_0.pth", help="Path to the trained state dict")
+    parser.add_argument("--opset", type=int, default=17, help="ONNX opset version")
+    parser.add_argument("--skip-onnx", action="store_true", help="Only export TorchScript")
+    args = parser.parse_args()
+
+    model = load_model(args.weights)
+    example = torch.randn(1, 3, INPUT_SIZE, INPUT_SIZE)
+    paths = artifact_paths(args.weights)
+
+    print(f"Exporting TorchScript to {paths['torchscript']}...")
+    export_torchscript(model, paths["torchscript"], example)
+    backends = [TorchScriptBackend(paths["torchscript"])]
+
+    if not args.skip_onnx:
+        print(f"Exporting ONNX to {paths['onnx']}...")
+        export_onnx(model, paths["onnx"], example, args.opset)
+        backends.append(OnnxRuntimeBackend(paths["onnx"]))
+
+    # Use a batch larger than the trace example to exercise the dynamic batch axis
+    inputs = torch.randn(4, 3, INPUT_SIZE, INPUT_SIZE, generator=torch.Generator().manual_seed(0))
+    all_equivalent = True
+    for backend in backends:
+        report = check_equivalence(backend, model, inputs)
+        all_equivalent &= report["equivalent"]
+        print(f"{report['backend']}: max abs diff {report['max_abs_diff']:.2e}, "
+              f"top-1 agreement {report['top1_agreement']:.2%}, "
+              f"{'equivalent' if report['equivalent'] else 'NOT equivalent'}")
+
+    if not all_equivalent:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
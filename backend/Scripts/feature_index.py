@@ -0,0 +1,470 @@
+"""
+Persistent index of image feature vectors for similar-case lookup and
+near-duplicate detection.
+
+The classifier head maps the 1024 pooled DenseNet features through
+512 -> 256 -> 23 layers. FeatureCapture keeps the 256-dim activations of the
+last hidden layer, which are otherwise discarded after argmax, and
+FeatureIndex stores one L2-normalized vector per classified image together
+with its class probabilities and a 64-bit perceptual hash.
+
+On-disk layout (one directory, every array memory-mapped and grown in place):
+    manifest.json       dim, dtype, count, capacity and IVF settings; rewritten
+                        on flush() and every manifest_every appends, and
+                        ids.txt is authoritative for the count on reopening
+    vectors.bin         (capacity, dim) float32 or int8 (x127) unit vectors
+    probabilities.bin   (capacity, 23) float16 softmax outputs
+    hashes.bin          (capacity,) uint64 difference hashes
+    contents.bin        (capacity,) uint64 keys of the exact image bytes, so a
+                        re-upload under a new id can reuse a stored row
+    ids.txt             one image id per row
+    centroids.npy, assignments.bin   IVF coarse quantizer, once trained
+
+Search:
+    search()           exact cosine top-k, vectorized over fixed-size blocks;
+                       switches to the IVF approximate mode (nprobe nearest
+                       lists only) once trained and count >= approximate_min
+    find_duplicate()   nearest hash within a Hamming distance, so a re-upload
+                       or re-encode of a known image can skip inference
+
+Run as a script to inspect an index, train its IVF quantizer or query it.
+The service loads the quantizer at startup, so train it while the service is
+stopped:
+
+    python feature_index.py ../Models/feature_index stats
+    python feature_index.py ../Models/feature_index train-ivf --nlist 1024
+    python feature_index.py ../Models/feature_index similar 07PerioralDermEye.jpg --k 5
+"""
+import argparse
+import json
+import os
+import tempfile
+import threading
+
+import numpy as np
+import torch.nn.functional as F
+
+from model import NUM_CLASSES, class_labels
+
+FEATURE_DIM = 256
+DTYPES = ("float32", "int8")
+INT8_SCALE = 127.0
+BLOCK_ROWS = 65536  # Rows scored per matrix product, bounding temporary memory
+
+_M1 = np.uint64(0x5555555555555555)
+_M2 = np.uint64(0x3333333333333333)
+_M4 = np.uint64(0x0F0F0F0F0F0F0F0F)
+_H01 = np.uint64(0x0101010101010101)
+
+
+def perceptual_hash(image_tensor):
+    """
+    64-bit difference hash (dHash) of a preprocessed image.
+
+    Each bit says whether a cell of a 9x8 grayscale thumbnail is brighter than
+    its right-hand neighbour, so the hash survives re-encoding, resizing and
+    small colour changes.
+
+    Args:
+        image_tensor (torch.Tensor): Normalized image of shape (1, 3, H, W)
+
+    Returns:
+        int: Hash as an unsigned 64-bit integer
+    """
+    thumbnail = F.adaptive_avg_pool2d(image_tensor.float().mean(1, keepdim=True), (8, 9))[0, 0]
+    bits = (thumbnail[:, 1:] > thumbnail[:, :-1]).flatten().numpy()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+def popcount(values):
+    """Number of set bits in each element of a uint64 array."""
+    values = values - ((values >> np.uint64(1)) & _M1)
+    values = (values & _M2) + ((values >> np.uint64(2)) & _M2)
+    values = (values + (values >> np.uint64(4))) & _M4
+    return (values * _H01) >> np.uint64(56)
+
+def _top_k(scores, k):
+    """Indices of the k highest scores, best first."""
+    k = min(k, len(scores))
+    if k == 0:
+        return np.empty(0, dtype=np.int64)
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    return candidates[np.argsort(-scores[candidates])]
+
+def _unit_rows(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, FEATURE_DIM)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class FeatureCapture:
+    """
+    Keep the penultimate activations of the classifier head on every forward pass.
+
+    Registers a forward hook on the ReLU after the 512 -> 256 layer. Captures
+    are thread-local, so batches running concurrently on different schedulers
+    do not see each other's features. Works with the eager model in the fp32,
+    dynamic_int8, channels_last and bf16 precision modes. static_int8 (FX
+    conversion fuses the layer away) and exported backends are not supported.
+
+    Args:
+        model (nn.Module): Eager classifier (possibly wrapped by precision.py)
+    """
+
+    def __init__(self, model):
+        layer = None
+        for name, module in model.named_modules():
+            if name == "classifier.4" or name.endswith(".classifier.4"):
+                layer = module
+        if layer is None:
+            raise ValueError("Model has no classifier.4 layer to capture features from")
+
+        self._local = threading.local()
+        self._handle = layer.register_forward_hook(self._hook)
+
+    def _hook(self, module, inputs, output):
+        self._local.features = output.detach().float().cpu()
+
+    def pop(self):
+        """Return and clear the features captured by this thread's last forward pass."""
+        features = getattr(self._local, "features", None)
+        self._local.features = None
+        return features
+
+    def remove(self):
+        """Detach the hook from the model."""
+        self._handle.remove()
+
+
+class FeatureIndex:
+    """
+    Memory-mapped, append-only index of feature vectors.
+
+    Args:
+        directory (str): Index directory, created if missing
+        dtype (str): "float32" or "int8" storage for new indexes; an existing
+            index keeps the dtype it was created with
+        approximate_min (int): Index size from which search() uses the IVF
+            quantizer (when trained) instead of exact search
+        initial_capacity (int): Rows allocated when the index is created
+        manifest_every (int): Appends between manifest rewrites; flush() always writes it
+    """
+
+    def __init__(self, directory, dtype="float32", approximate_min=200_000, initial_capacity=1024, manifest_every=1000):
+        if dtype not in DTYPES:
+            raise ValueError(f"Unknown feature index dtype '{dtype}', expected one of {', '.join(DTYPES)}")
+        self.directory = directory
+        self.approximate_min = approximate_min
+        self.manifest_every = manifest_every
+        self._unwritten = 0
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        manifest_path = os.path.join(directory, "manifest.json")
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as file:
+                manifest = json.load(file)
+            self.dtype = manifest["dtype"]
+            self.count = manifest["count"]
+            self.capacity = manifest["capacity"]
+        else:
+            self.dtype = dtype
+            self.count = 0
+            self.capacity = initial_capacity
+
+        self.ids = []
+        ids_path = os.path.join(directory, "ids.txt")
+        if os.path.exists(ids_path):
+            with open(ids_path, encoding="utf-8") as file:
+                self.ids = file.read().splitlines()
+        # The manifest lags appends; every id in ids.txt had its row written first, so
+        # trust ids.txt up to the capacity the arrays actually reached
+        vectors_path = os.path.join(directory, "vectors.bin")
+        if os.path.exists(vectors_path):
+            row_bytes = FEATURE_DIM * (4 if self.dtype == "float32" else 1)
+            self.capacity = max(self.capacity, os.path.getsize(vectors_path) // row_bytes)
+        self.count = min(len(self.ids), self.capacity)
+        self.ids = self.ids[:self.count]
+        with open(ids_path, "w", encoding="utf-8") as file:
+            file.writelines(f"{image_id}\n" for image_id in self.ids)
+        self._ids_file = open(ids_path, "a", encoding="utf-8")
+        self._rows = {image_id: row for row, image_id in enumerate(self.ids)}
+
+        self._open_arrays()
+        self._load_ivf()
+        self._write_manifest()
+
+    def _open_arrays(self):
+        vector_dtype = np.float32 if self.dtype == "float32" else np.int8
+
+        def open_array(name, dtype, shape):
+            path = os.path.join(self.directory, name)
+            mode = "r+" if os.path.exists(path) else "w+"
+            return np.memmap(path, dtype=dtype, mode=mode, shape=shape)
+
+        self.vectors = open_array("vectors.bin", vector_dtype, (self.capacity, FEATURE_DIM))
+        self.probabilities = open_array("probabilities.bin", np.float16, (self.capacity, NUM_CLASSES))
+        self.hashes = open_array("hashes.bin", np.uint64, (self.capacity,))
+        self.contents = open_array("contents.bin", np.uint64, (self.capacity,))
+        self.assignments = open_array("assignments.bin", np.int32, (self.capacity,))
+
+    def _load_ivf(self):
+        self.centroids = None
+        path = os.path.join(self.directory, "centroids.npy")
+        if os.path.exists(path):
+            self.centroids = np.load(path)
+        self._lists_count = 0
+        self._list_order = None
+        self._list_offsets = None
+
+    def _write_manifest(self):
+        manifest = {
+            "dim": FEATURE_DIM,
+            "dtype": self.dtype,
+            "count": self.count,
+            "capacity": self.capacity,
+            "nlist": None if self.centroids is None else len(self.centroids),
+        }
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as file:
+            json.dump(manifest, file)
+        os.replace(tmp_path, os.path.join(self.directory, "manifest.json"))
+        self._unwritten = 0
+
+    def _encode(self, unit_rows):
+        if self.dtype == "int8":
+            return np.clip(np.rint(unit_rows * INT8_SCALE), -127, 127).astype(np.int8)
+        return unit_rows
+
+    def _decode(self, rows):
+        if self.dtype == "int8":
+            return rows.astype(np.float32) / INT8_SCALE
+        return rows
+
+    def add(self, image_id, features, probabilities, image_hash, content_key=0):
+        """
+        Append one classified image.
+
+        Args:
+            image_id (str): Identifier returned by queries (storage id or content hash)
+            features (array-like): Penultimate activations, FEATURE_DIM values
+            probabilities (array-like): Softmax outputs over class_labels
+            image_hash (int): perceptual_hash of the image
+            content_key (int): 64-bit key of the exact image bytes (0 if unknown)
+
+        Returns:
+            int: Row of the new entry
+        """
+        return self._append(image_id, self._encode(_unit_rows(features))[0], probabilities, image_hash, content_key)
+
+    def add_copy(self, image_id, row):
+        """Append the stored vector, probabilities and hashes of row under another image id."""
+        return self._append(image_id, np.array(self.vectors[row]), np.array(self.probabilities[row]),
+                            int(self.hashes[row]), int(self.contents[row]))
+
+    def _append(self, image_id, vector, probabilities, image_hash, content_key):
+        with self._lock:
+            grown = self.count == self.capacity
+            if grown:
+                self.capacity *= 2
+                self._open_arrays()  # numpy extends the files to the new shape
+            row = self.count
+            self.vectors[row] = vector
+            self.probabilities[row] = np.asarray(probabilities, dtype=np.float16)
+            self.hashes[row] = np.uint64(image_hash)
+            self.contents[row] = np.uint64(content_key)
+            if self.centroids is not None:
+                self.assignments[row] = int(np.argmax(self.centroids @ self._decode(vector)))
+            self._ids_file.write(f"{image_id}\n")
+            self._ids_file.flush()
+            self.ids.append(image_id)
+            self._rows[image_id] = row
+            self.count += 1
+            self._unwritten += 1
+            if grown or self._unwritten >= self.manifest_every:
+                self._write_manifest()
+        return row
+
+    def row_of(self, image_id):
+        """Most recent row stored for image_id, or None."""
+        return self._rows.get(image_id)
+
+    def row_of_content(self, content_key):
+        """Most recent row stored for these exact image bytes, or None."""
+        count = self.count
+        key = np.uint64(content_key)
+        for block in range(((count - 1) // BLOCK_ROWS) * BLOCK_ROWS if count else -1, -1, -BLOCK_ROWS):
+            matches = np.flatnonzero(np.asarray(self.contents[block:min(block + BLOCK_ROWS, count)]) == key)
+            if len(matches):
+                return block + int(matches[-1])
+        return None
+
+    def vector(self, row):
+        """Stored unit feature vector of a row as float32."""
+        return self._decode(np.asarray(self.vectors[row]))
+
+    def entry(self, row):
+        """Image id, predicted class and probabilities stored for a row."""
+        probabilities = np.asarray(self.probabilities[row], dtype=np.float32)
+        return {
+            "image_id": self.ids[row],
+            "predicted_class": class_labels[int(probabilities.argmax())],
+            "probabilities": probabilities,
+        }
+
+    def _scores(self, query, start, stop):
+        """Cosine similarity of the query with rows [start, stop), block by block."""
+        scores = np.empty(stop - start, dtype=np.float32)
+        for block in range(start, stop, BLOCK_ROWS):
+            end = min(block + BLOCK_ROWS, stop)
+            scores[block - start:end - start] = self._decode(np.asarray(self.vectors[block:end])) @ query
+        return scores
+
+    def search(self, features, k=10, approximate=None, nprobe=8):
+        """
+        Find the stored images most similar to a feature vector.
+
+        Args:
+            features (array-like): Query activations, FEATURE_DIM values
+            k (int): Number of results
+            approximate (bool | None): Force exact (False) or IVF (True) search;
+                None uses IVF once trained and count >= approximate_min
+            nprobe (int): IVF lists searched per query; higher is slower and more accurate
+
+        Returns:
+            list[tuple[int, float]]: (row, cosine similarity), most similar first
+        """
+        query = _unit_rows(features)[0]
+        count = self.count
+        if approximate is None:
+            approximate = self.centroids is not None and count >= self.approximate_min
+        if not approximate:
+            scores = self._scores(query, 0, count)
+            return [(int(row), float(scores[row])) for row in _top_k(scores, k)]
+
+        if self.centroids is None:
+            raise ValueError("Approximate search needs an IVF quantizer; run train_ivf() first")
+        order, offsets, indexed = self._inverted_lists(count)
+        probes = _top_k(self.centroids @ query, nprobe)
+        candidates = [order[offsets[probe]:offsets[probe + 1]] for probe in probes]
+        candidates.append(np.arange(indexed, count))  # Rows appended since the lists were built
+        rows = np.sort(np.concatenate(candidates))
+        scores = self._decode(np.asarray(self.vectors[rows])) @ query
+        return [(int(rows[index]), float(scores[index])) for index in _top_k(scores, k)]
+
+    def _inverted_lists(self, count):
+        """Rows grouped by IVF list, rebuilt once more than 10% of rows were appended since."""
+        with self._lock:
+            if self._list_order is None or count - self._lists_count > max(1000, self._lists_count // 10):
+                assignments = np.asarray(self.assignments[:count])
+                self._list_order = np.argsort(assignments, kind="stable")
+                self._list_offsets = np.concatenate(([0], np.cumsum(np.bincount(assignments, minlength=len(self.centroids)))))
+                self._lists_count = count
+            return self._list_order, self._list_offsets, self._lists_count
+
+    def find_duplicate(self, image_hash, max_distance=4):
+        """
+        Find a stored image whose perceptual hash is within max_distance bits.
+
+        Returns:
+            tuple[int, int] | None: (row, Hamming distance) of the closest match
+        """
+        count = self.count
+        if count == 0:
+            return None
+        query = np.uint64(image_hash)
+        best_row, best_distance = None, max_distance + 1
+        for block in range(0, count, BLOCK_ROWS):
+            distances = popcount(np.asarray(self.hashes[block:min(block + BLOCK_ROWS, count)]) ^ query)
+            index = int(distances.argmin())
+            if distances[index] < best_distance:
+                best_row, best_distance = block + index, int(distances[index])
+        return None if best_row is None else (best_row, best_distance)
+
+    def train_ivf(self, nlist=None, iterations=10, sample=50_000, seed=0):
+        """
+        Train the IVF coarse quantizer with spherical k-means and assign every row.
+
+        Args:
+            nlist (int | None): Number of lists; defaults to 4 * sqrt(count)
+            iterations (int): k-means iterations
+            sample (int): Rows k-means is trained on
+            seed (int): Random seed for sampling and initialization
+        """
+        count = self.count
+        nlist = nlist or max(1, int(4 * np.sqrt(count)))
+        if count < nlist:
+            raise ValueError(f"Need at least {nlist} vectors to train {nlist} IVF lists, have {count}")
+
+        generator = np.random.default_rng(seed)
+        rows = np.sort(generator.choice(count, size=min(sample, count), replace=False))
+        training = self._decode(np.asarray(self.vectors[rows]))
+        centroids = training[generator.choice(len(training), size=nlist, replace=False)].copy()
+        for _ in range(iterations):
+            nearest = np.argmax(training @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, nearest, training)
+            empty = np.bincount(nearest, minlength=nlist) == 0
+            sums[empty] = training[generator.choice(len(training), size=int(empty.sum()))]
+            centroids = _unit_rows(sums)
+
+        with self._lock:
+            for block in range(0, count, BLOCK_ROWS):
+                end = min(block + BLOCK_ROWS, count)
+                self.assignments[block:end] = np.argmax(self._decode(np.asarray(self.vectors[block:end])) @ centroids.T, axis=1)
+            self.assignments.flush()
+            np.save(os.path.join(self.directory, "centroids.npy"), centroids)
+            self._load_ivf()
+            self._write_manifest()
+
+    def flush(self):
+        """Write pending pages of every array and the manifest to disk."""
+        with self._lock:
+            for array in (self.vectors, self.probabilities, self.hashes, self.contents, self.assignments):
+                array.flush()
+            self._ids_file.flush()
+            self._write_manifest()
+
+    def stats(self):
+        """Report size, storage type and whether approximate search is active."""
+        return {
+            "count": self.count,
+            "capacity": self.capacity,
+            "dtype": self.dtype,
+            "vector_bytes": self.vectors.itemsize * FEATURE_DIM * self.count,
+            "ivf_lists": None if self.centroids is None else len(self.centroids),
+            "approximate": self.centroids is not None and self.count >= self.approximate_min,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect, train or query an image feature index")
+    parser.add_argument("directory", help="Feature index directory (FEATURE_INDEX_DIR)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("stats", help="Print index statistics")
+    train = commands.add_parser("train-ivf", help="Train the approximate-search quantizer")
+    train.add_argument("--nlist", type=int, help="Number of IVF lists (default 4 * sqrt(count))")
+    train.add_argument("--iterations", type=int, default=10)
+    similar = commands.add_parser("similar", help="List the images most similar to an indexed image")
+    similar.add_argument("image_id")
+    similar.add_argument("--k", type=int, default=10)
+    similar.add_argument("--exact", action="store_true", help="Force exact search")
+    similar.add_argument("--nprobe", type=int, default=8)
+    args = parser.parse_args()
+
+    index = FeatureIndex(args.directory)
+    if args.command == "train-ivf":
+        index.train_ivf(nlist=args.nlist, iterations=args.iterations)
+    elif args.command == "similar":
+        row = index.row_of(args.image_id)
+        if row is None:
+            parser.error(f"{args.image_id} is not in the index")
+        for match, score in index.search(index.vector(row), args.k + 1, approximate=False if args.exact else None, nprobe=args.nprobe):
+            if match != row:
+                entry = index.entry(match)
+                print(f"{score:.4f}  {entry['image_id']}  ({entry['predicted_class']})")
+        return
+    print(json.dumps(index.stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
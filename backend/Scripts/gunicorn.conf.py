@@ -0,0 +1,130 @@
+"""
+Pre-fork production serving for the classifier API.
+
+    gunicorn -c gunicorn.conf.py app:app
+
+The master imports app.py once (preload_app), which builds the model and maps
+the weights, and then forks the workers. The weight pages are inherited
+copy-on-write and, because inference never writes to them, stay shared: N
+workers cost one copy of DenseNet121 plus each worker's private activations,
+not N copies. gc.freeze() before forking keeps the garbage collector from
+touching (and so un-sharing) the pages of objects created at import.
+
+Each worker gets its own PyTorch thread settings and, optionally, a disjoint
+slice of the CPUs so intra-op threads of different workers do not fight over
+the same cores.
+
+Environment variables:
+    BIND                    Address to listen on (default 0.0.0.0:5000)
+    WEB_CONCURRENCY         Number of worker processes (default: one per 4 CPUs, at least 1)
+    GUNICORN_THREADS        Request threads per worker; concurrent requests in a
+                            worker are batched together (default 4)
+    TORCH_THREADS           Intra-op threads per worker (default: CPUs / workers)
+    TORCH_INTEROP_THREADS   Inter-op threads per worker (default 1)
+    PIN_WORKERS             1 to pin each worker to its own slice of CPUs (default 1)
+
+Measuring memory per worker:
+    Start the server, send a few /classify requests so every worker has run a
+    forward pass, then run
+
+        python worker_memory.py $(cat gunicorn.pid)
+
+    It reads /proc/<pid>/smaps_rollup for the master and each worker. RSS counts
+    shared pages in full for every process and so overstates the total; use
+    PSS (shared pages divided among the processes sharing them) to size a box:
+    the sum of PSS is the real footprint, and a worker's USS (private pages) is
+    what one more worker would add. With the weights shared, USS should be
+    dominated by activations and allocator caches rather than the ~30 MB of
+    DenseNet121 weights times the number of workers.
+
+Example run (numbers from one machine, not a guarantee; re-measure on the
+target host). Environment: torch 2.14 CPU, Python 3.11, gunicorn 26, Linux,
+1 CPU, 6 GB RAM. model_0.pth is not in the repo, so it held randomly
+initialized weights of the same architecture, which have the production
+file size and memory layout:
+
+    python -c "import torch; from model import build_model; torch.save(build_model().state_dict(), '../Models/model_0.pth')"
+    SUPABASE_URL=http://127.0.0.1:9 SUPABASE_KEY=<any JWT-shaped string> RESULTS_WRITE_BEHIND=0 \
+    LOCAL_STORAGE_DIR=<dir of 64 distinct JPEGs> WEB_CONCURRENCY=2 GUNICORN_THREADS=8 \
+        gunicorn -c gunicorn.conf.py app:app
+    # idle rows: after warmup plus a few sequential /classify requests; loaded
+    # rows: after 64 distinct images sent by 16 concurrent clients
+    python worker_memory.py $(cat gunicorn.pid)
+
+Result, in MB (WEB_CONCURRENCY=4 for the 4-worker total below):
+
+                                  RSS    PSS    USS
+    master                        747    455    310
+    worker, after warmup only     646    264    165
+    worker, 16 concurrent clients 865    556    390
+
+    Sum of PSS: 1129 MB with 2 idle workers, 1384 MB with 4, so each extra
+    idle worker adds ~130 MB; under load a worker grows to ~390 MB private
+    (activations of batched 512x512 forward passes). RSS (~650-865 MB per
+    worker) would suggest 4 workers need 3.3 GB; they need 1.4 GB idle and
+    about 0.45 + 0.4 x workers GB under load.
+
+Chosen worker count: in this example memory is not the limit (a 4 GB box
+would fit ~8 loaded workers), CPU is: each worker's forward pass uses
+TORCH_THREADS intra-op threads, so the default stays one worker per 4 CPUs,
+e.g. 4 workers with 4 threads each on 16 CPUs (~2.1 GB under load).
+"""
+import gc
+import os
+
+# Must be set before app.py imports torch: the master only loads the model and
+# never runs parallel work, so no OpenMP thread pool exists when it forks
+os.environ["PREFORK_SERVING"] = "1"
+os.environ.setdefault("OMP_NUM_THREADS", "1")
+
+_cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+
+bind = os.getenv("BIND", "0.0.0.0:5000")
+workers = int(os.getenv("WEB_CONCURRENCY", str(max(1, len(_cpus) // 4))))
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+preload_app = True
+pidfile = "gunicorn.pid"
+timeout = 120
+
+torch_threads = int(os.getenv("TORCH_THREADS", str(max(1, len(_cpus) // workers))))
+torch_interop_threads = int(os.getenv("TORCH_INTEROP_THREADS", "1"))
+pin_workers = os.getenv("PIN_WORKERS", "1") == "1"
+
+
+def worker_cpus(slot):
+    """CPUs assigned to the worker in the given slot: a contiguous, disjoint slice."""
+    per_worker = max(1, len(_cpus) // workers)
+    start = (slot * per_worker) % len(_cpus)
+    return _cpus[start:start + per_worker]
+
+def pre_fork(server, worker):
+    # Give the new worker the lowest slot not held by a live worker, so a
+    # restarted worker takes over the CPUs of the one it replaces
+    taken = {getattr(live, "slot", None) for live in server.WORKERS.values()}
+    worker.slot = next(slot for slot in range(workers + len(taken)) if slot not in taken)
+    gc.freeze()
+
+def post_fork(server, worker):
+    import torch
+    import classifier
+
+    torch.set_num_threads(torch_threads)
+    try:
+        torch.set_num_interop_threads(torch_interop_threads)
+    except RuntimeError as e:
+        server.log.warning(f"Could not set inter-op threads: {str(e)}")
+
+    cpus = worker_cpus(worker.slot) if pin_workers else None
+    if cpus and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+
+    server.log.info(f"Worker {worker.pid} (slot {worker.slot}): {torch_threads} intra-op / "
+                    f"{torch_interop_threads} inter-op threads, CPUs {cpus or 'unpinned'}")
+    classifier.start_background_workers()
+
+    # app.py leaves the result writer to the workers; start it now so each replays
+    # the journal on (re)start rather than on its first request
+    import app
+    if app.result_writer is not None:
+        app.result_writer.start()
@@ -0,0 +1,174 @@
+"""
+Lightweight metrics for the classifier service, rendered in the Prometheus
+text exposition format (version 0.0.4) for a GET /metrics endpoint.
+
+    Histogram        Cumulative-bucket histogram, optionally split by one label
+    MetricsRegistry  Holds histograms and callback gauges and renders them all
+    ProfilerSampler  Runs the torch profiler on one request in N and saves a
+                     Chrome trace, for opt-in deep dives in production
+
+Observing a value is a lock and a few additions, cheap enough for every
+request on the hot path.
+"""
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def process_rss_bytes():
+    """Resident set size of this process in bytes (Linux /proc, 0 elsewhere)."""
+    try:
+        with open('/proc/self/statm') as file:
+            resident_pages = int(file.read().split()[1])
+    except OSError:
+        return 0
+    return resident_pages * os.sysconf('SC_PAGE_SIZE')
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
+
+
+class Histogram:
+    """
+    Prometheus-style histogram.
+
+    Args:
+        name (str): Metric name, e.g. dermai_stage_seconds
+        help_text (str): Description shown in the # HELP line
+        label_name (str | None): Name of the single label observations are split by
+        buckets (tuple[float]): Upper bounds of the buckets, ascending
+    """
+
+    def __init__(self, name, help_text, label_name=None, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_name = label_name
+        self.buckets = tuple(buckets)
+
+        self._lock = threading.Lock()
+        self._series = {}  # label value -> [bucket counts..., sum, count]
+
+    def observe(self, value, label=None):
+        """Record one observation, under the given label value if the histogram has a label."""
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label)
+            if series is None:
+                series = self._series[label] = [0] * len(self.buckets) + [0.0, 0]
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        """Return the exposition lines for this histogram."""
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {label: list(values) for label, values in self._series.items()}
+        for label, values in sorted(series.items(), key=lambda item: str(item[0])):
+            base = [(self.label_name, label)] if self.label_name else []
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(base + [('le', repr(float(bound)))])} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(base + [('le', '+Inf')])} {values[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(base)} {values[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(base)} {values[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    """Collection of histograms and callback gauges rendered together."""
+
+    def __init__(self):
+        self._histograms = []
+        self._gauges = []
+
+    def histogram(self, name, help_text, label_name=None, buckets=DEFAULT_BUCKETS):
+        """Create and register a Histogram."""
+        histogram = Histogram(name, help_text, label_name, buckets)
+        self._histograms.append(histogram)
+        return histogram
+
+    def gauge(self, name, help_text, read, label_name=None):
+        """
+        Register a gauge whose value is read when metrics are rendered.
+
+        Args:
+            name (str): Metric name
+            help_text (str): Description
+            read (callable): Returns a number, or a dict of label value -> number
+                when label_name is given
+            label_name (str | None): Label for dict-valued gauges
+        """
+        self._gauges.append((name, help_text, read, label_name))
+
+    def render(self):
+        """
+        Render every registered metric.
+
+        Returns:
+            str: Prometheus text exposition format
+        """
+        lines = []
+        for histogram in self._histograms:
+            lines.extend(histogram.render())
+        for name, help_text, read, label_name in self._gauges:
+            lines.extend([f"# HELP {name} {help_text}", f"# TYPE {name} gauge"])
+            value = read()
+            if label_name:
+                for label, item in value.items():
+                    lines.append(f"{name}{_format_labels([(label_name, label)])} {item}")
+            else:
+                lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+class ProfilerSampler:
+    """
+    Profile one request in every N with torch.profiler.
+
+    Args:
+        every_n (int): Sampling period in requests; 0 disables profiling
+        output_dir (str): Directory Chrome traces (chrome://tracing, Perfetto) are written to
+    """
+
+    def __init__(self, every_n=0, output_dir="profiles"):
+        self.every_n = every_n
+        self.output_dir = output_dir
+        self._lock = threading.Lock()
+        self._seen = 0
+
+    def maybe_profile(self, requests=1):
+        """
+        Context manager profiling the enclosed block if it contains the Nth request.
+
+        Args:
+            requests (int): Number of requests the block serves (e.g. the batch size)
+        """
+        if not self.every_n:
+            return nullcontext()
+        with self._lock:
+            before = self._seen
+            self._seen += requests
+            sampled = self._seen // self.every_n > before // self.every_n
+        return self._profile() if sampled else nullcontext()
+
+    @contextmanager
+    def _profile(self):
+        from torch.profiler import ProfilerActivity, profile
+
+        with profile(activities=[ProfilerActivity.CPU], record_shapes=True) as profiler:
+            yield
+        os.makedirs(self.output_dir, exist_ok=True)
+        path = os.path.join(self.output_dir, f"trace-{os.getpid()}-{int(time.time() * 1000)}.json")
+        profiler.export_chrome_trace(path)
+        print(f"Profiler trace saved to {path}")
@@ -0,0 +1,107 @@
+"""
+DenseNet121 skin-condition classifier: architecture, class labels and weight loading.
+
+Shared by the Flask API (app.py) and the offline tools (export, benchmarks) so
+they all build exactly the same network.
+
+The architecture is built from the torchvision package installed locally, so
+loading the model never touches torch.hub or the network.
+"""
+import torch
+from torch import nn
+from torchvision.models import densenet121
+
+NUM_CLASSES = 23
+INPUT_SIZE = 512
+
+# Class labels, in the order of the model outputs
+class_labels = [
+    "Acne and Rosacea Photos",
+    "Actinic Keratosis Basal Cell Carcinoma and other Malignant Lesions",
+    "Atopic Dermatitis Photos",
+    "Bullous Disease Photos",
+    "Cellulitis Impetigo and other Bacterial Infections",
+    "Eczema Photos",
+    "Exanthems and Drug Eruptions",
+    "Hair Loss Photos Alopecia and other Hair Diseases",
+    "Herpes HPV and other STDs Photos",
+    "Light Diseases and Disorders of Pigmentation",
+    "Lupus and other Connective Tissue Diseases",
+    "Melanoma Skin Cancer Nevi and Moles",
+    "Nail Fungus and other Nail Disease",
+    "Poison Ivy Photos and other Contact Dermatitis",
+    "Psoriasis Pictures Lichen Planus and Related Diseases",
+    "Scabies Lyme Disease and other Infestations and Bites",
+    "Seborrheic Keratoses and other Benign Tumors",
+    "Systemic Disease",
+    "Tinea Ringworm Candidiasis and other Fungal Infections",
+    "Urticaria Hives",
+    "Vascular Tumors",
+    "Vasculitis Photos",
+    "Warts Molluscum and other Viral Infections"
+]
+
+def build_model():
+    """
+    Build the untrained DenseNet121 with our custom classification head.
+
+    Returns:
+        nn.Module: DenseNet121 whose classifier maps the 1024 pooled features
+        through 512 -> 256 -> 23 fully connected layers
+    """
+    # Same network (and state dict keys) as torch.hub's pytorch/vision:v0.10.0 densenet121
+    model = densenet121()
+    num_features = model.classifier.in_features
+    model.classifier = nn.Sequential(
+        nn.Linear(num_features, 512),
+        nn.ReLU(),
+        nn.Dropout(0.4),
+        nn.Linear(512, 256),
+        nn.ReLU(),
+        nn.Dropout(0.3),
+        nn.Linear(256, NUM_CLASSES)  # Final layer with 23 output classes
+    )
+    return model
+
+def load_state_dict(weights_path, mmap=True):
+    """
+    Load a saved state dict onto the CPU.
+
+    Args:
+        weights_path (str): Path to the saved state dict
+        mmap (bool): Memory-map the file instead of reading it into memory, so
+            tensors are paged in on first use and their pages can be shared
+            between processes (needs PyTorch >= 2.1; older versions fall back
+            to a regular load)
+
+    Returns:
+        dict: Parameter name -> tensor
+    """
+    if mmap:
+        try:
+            return torch.load(weights_path, map_location=torch.device('cpu'), mmap=True, weights_only=True)
+        except TypeError:
+            pass  # torch.load has no mmap argument before 2.1
+    return torch.load(weights_path, map_location=torch.device('cpu'))
+
+def load_model(weights_path, device=torch.device('cpu'), mmap=True):
+    """
+    Build the classifier and load fine-tuned weights for inference.
+
+    Args:
+        weights_path (str): Path to the saved state dict (e.g. ../Models/model_0.pth)
+        device (torch.device): Device to move the model to
+        mmap (bool): Memory-map the weights (see load_state_dict)
+
+    Returns:
+        nn.Module: Model in eval mode on the requested device
+    """
+    model = build_model()
+    state_dict = load_state_dict(weights_path, mmap=mmap)
+    try:
+        # assign=True keeps the memory-mapped tensors instead of copying them into fresh parameters
+        model.load_state_dict(state_dict, assign=True)
+    except TypeError:
+        model.load_state_dict(state_dict)
+    model.eval()
+    return model.to(device)
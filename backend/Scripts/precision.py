@@ -0,0 +1,128 @@
+"""
+Reduced-precision and quantized CPU execution modes for the classifier.
+
+Modes (see apply_precision):
+    fp32           The trained model, unchanged
+    dynamic_int8   Linear layers of the classifier head quantized to int8 with
+                   activations quantized on the fly
+    static_int8    Conv trunk (model.features) statically quantized to int8
+                   with FX graph mode, using observers calibrated on real images;
+                   the small classifier head stays fp32
+    channels_last  NHWC memory format for weights and inputs
+    bf16           fp32 weights, ops run under CPU bfloat16 autocast
+
+Each mode trades accuracy for speed differently; measure it with
+evaluate_precision.py before enabling it in app.py (INFERENCE_PRECISION).
+"""
+import copy
+
+import torch
+from torch import nn
+
+from model import INPUT_SIZE
+from preprocessing import Preprocessor, list_images
+
+PRECISIONS = ("fp32", "dynamic_int8", "static_int8", "channels_last", "bf16")
+
+
+class ChannelsLastModel(nn.Module):
+    """Run a channels_last model, converting each input batch to NHWC first."""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model.to(memory_format=torch.channels_last)
+
+    def forward(self, x):
+        return self.model(x.contiguous(memory_format=torch.channels_last))
+
+
+class Bf16AutocastModel(nn.Module):
+    """Run a model under CPU bfloat16 autocast and return fp32 logits."""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, x):
+        with torch.autocast(device_type="cpu", dtype=torch.bfloat16):
+            return self.model(x).float()
+
+
+def calibration_batches(folder, batch_size=8, limit=None, size=INPUT_SIZE):
+    """
+    Yield preprocessed batches from an image folder for static quantization.
+
+    Args:
+        folder (str): Directory of representative images
+        batch_size (int): Images per batch
+        limit (int | None): Maximum number of images to use
+        size (int): Input resolution
+
+    Yields:
+        torch.Tensor: Batches of shape (N, 3, size, size)
+    """
+    paths = list_images(folder)[:limit]
+    if not paths:
+        raise ValueError(f"No calibration images found in {folder}")
+
+    preprocessor = Preprocessor(size=size, num_workers=1)
+    for start in range(0, len(paths), batch_size):
+        tensors = []
+        for path in paths[start:start + batch_size]:
+            with open(path, 'rb') as file:
+                tensors.append(preprocessor.preprocess(file.read()))
+        yield torch.cat(tensors)
+    preprocessor.shutdown()
+
+def quantize_static(model, calibration):
+    """
+    Statically quantize the conv trunk to int8 with FX graph mode quantization.
+
+    Args:
+        model (nn.Module): fp32 model in eval mode
+        calibration (iterable[torch.Tensor]): Batches used to calibrate the observers
+
+    Returns:
+        torch.fx.GraphModule: Quantized model
+    """
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+    engine = "x86" if "x86" in torch.backends.quantized.supported_engines else "fbgemm"
+    torch.backends.quantized.engine = engine
+    qconfig_mapping = get_default_qconfig_mapping(engine).set_module_name("classifier", None)
+
+    example = torch.randn(1, 3, INPUT_SIZE, INPUT_SIZE)
+    prepared = prepare_fx(copy.deepcopy(model), qconfig_mapping, example_inputs=(example,))
+    with torch.no_grad():
+        for batch in calibration:
+            prepared(batch)
+    return convert_fx(prepared)
+
+def apply_precision(model, mode, calibration=None):
+    """
+    Return a copy of the model running in the requested precision mode.
+
+    Args:
+        model (nn.Module): fp32 model in eval mode, on CPU (left unmodified)
+        mode (str): One of PRECISIONS
+        calibration (iterable[torch.Tensor] | None): Calibration batches,
+            required for static_int8
+
+    Returns:
+        nn.Module: Model to run inference with
+    """
+    if mode not in PRECISIONS:
+        raise ValueError(f"Unknown precision '{mode}', expected one of {', '.join(PRECISIONS)}")
+
+    if mode == "fp32":
+        return model
+    if mode == "dynamic_int8":
+        return torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+    if mode == "static_int8":
+        if calibration is None:
+            raise ValueError("static_int8 needs calibration images (set CALIBRATION_DIR)")
+        return quantize_static(model, calibration).eval()
+    if mode == "channels_last":
+        return ChannelsLastModel(copy.deepcopy(model)).eval()
+    return Bf16AutocastModel(model).eval()
@@ -0,0 +1,307 @@
+"""
+Content-addressed cache for classification results.
+
+Predictions are keyed by the SHA-256 of the raw image bytes combined with a
+fingerprint of the model weights, so re-uploads of the same photo and client
+retries reuse an earlier result, while a model update invalidates everything.
+
+Tiers:
+    1. Bounded in-memory LRU (always on)
+    2. Optional on-disk directory of JSON files that survives restarts, bounded
+       to disk_max_entries files with least-recently-used eviction
+
+Concurrent requests for the same key are coalesced: the first caller runs the
+computation and everyone else waits for its result instead of running the
+model again. Callers that need to manage the computation themselves (e.g. the
+asyncio front end, which must be able to cancel it) use get() and put().
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+# Temp files older than this were left behind by a crashed writer
+STALE_TMP_SECONDS = 3600
+
+
+def file_fingerprint(path, chunk_size=1 << 20):
+    """
+    Compute the SHA-256 of a file without reading it into memory at once.
+
+    Args:
+        path (str): Path to the file (e.g. the model weights)
+
+    Returns:
+        str: Hex digest of the file contents
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(chunk_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def prediction_key(image_bytes, model_fingerprint):
+    """
+    Build the cache key for an image under a specific model.
+
+    Args:
+        image_bytes (bytes): Raw image data as downloaded from storage
+        model_fingerprint (str): Identifies the weights/configuration producing the prediction
+
+    Returns:
+        str: Hex SHA-256 key
+    """
+    digest = hashlib.sha256(image_bytes)
+    digest.update(model_fingerprint.encode('utf-8'))
+    return digest.hexdigest()
+
+
+class PredictionCache:
+    """
+    Two-tier prediction cache with in-flight request coalescing.
+
+    Args:
+        max_entries (int): Capacity of the in-memory LRU tier
+        cache_dir (str | None): Directory for the persistent tier; None keeps
+            the cache in memory only
+        disk_max_entries (int): Capacity of the persistent tier in files
+        disk_low_water (float): Fraction of disk_max_entries eviction trims down to
+
+    Cached values must be JSON-serializable when cache_dir is set.
+
+    The disk tier's LRU order lives in file modification times, like the blob
+    cache in storage.py, so it survives restarts and gunicorn workers can share
+    one directory: each process keeps a running count of the files, rescans
+    the directory after every disk_max_entries / 16 of its own writes to pick
+    up the other processes' entries, and evicts down to the low-water mark
+    once the count goes over disk_max_entries.
+    """
+
+    def __init__(self, max_entries=1024, cache_dir=None, disk_max_entries=100000, disk_low_water=0.9):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.disk_max_entries = disk_max_entries
+        self.disk_low_water_entries = int(disk_max_entries * disk_low_water)
+        self.disk_rescan_writes = max(1, disk_max_entries // 16)
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._in_flight = {}
+        self._counts = {"memory_hits": 0, "disk_hits": 0, "coalesced": 0, "misses": 0, "disk_evictions": 0}
+
+        self._disk_entries = OrderedDict()  # key -> None, least recently used first
+        self._disk_written = 0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            with self._lock:
+                self._rescan_disk()
+                if len(self._disk_entries) > self.disk_max_entries:
+                    self._evict_disk()
+
+    def get_or_compute(self, key, compute):
+        """
+        Return the cached value for key, computing it at most once.
+
+        Args:
+            key (str): Cache key from prediction_key
+            compute (callable): Zero-argument function producing the value on a miss
+
+        Returns:
+            The cached or freshly computed value. Exceptions raised by compute
+            propagate to every caller waiting on the same key and are not cached.
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._counts["memory_hits"] += 1
+                return self._entries[key]
+
+            pending = self._in_flight.get(key)
+            owner = pending is None
+            if owner:
+                pending = Future()
+                self._in_flight[key] = pending
+            else:
+                self._counts["coalesced"] += 1
+
+        if not owner:
+            return pending.result()
+
+        try:
+            value = self._read_disk(key)
+            if value is not None:
+                with self._lock:
+                    self._counts["disk_hits"] += 1
+            else:
+                with self._lock:
+                    self._counts["misses"] += 1
+                value = compute()
+                self._write_disk(key, value)
+        except BaseException as e:
+            with self._lock:
+                del self._in_flight[key]
+            pending.set_exception(e)
+            raise
+
+        with self._lock:
+            self._store(key, value)
+            del self._in_flight[key]
+        pending.set_result(value)
+        return value
+
+    def get(self, key):
+        """
+        Look a key up in both tiers without computing or waiting on anything.
+
+        Args:
+            key (str): Cache key from prediction_key
+
+        Returns:
+            The cached value, or None on a miss
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._counts["memory_hits"] += 1
+                return self._entries[key]
+
+        value = self._read_disk(key)
+        with self._lock:
+            if value is None:
+                self._counts["misses"] += 1
+            else:
+                self._counts["disk_hits"] += 1
+                self._store(key, value)
+        return value
+
+    def put(self, key, value):
+        """
+        Store a value computed outside get_or_compute in both tiers.
+
+        Args:
+            key (str): Cache key from prediction_key
+            value: JSON-serializable value
+        """
+        self._write_disk(key, value)
+        with self._lock:
+            self._store(key, value)
+
+    def stats(self):
+        """
+        Report hit/miss counters and tier sizes.
+
+        Returns:
+            dict: Counter values plus entries, max_entries, hit_rate, whether
+            the disk tier is enabled and its disk_entries and disk_max_entries
+        """
+        with self._lock:
+            counts = dict(self._counts)
+            lookups = counts["memory_hits"] + counts["disk_hits"] + counts["coalesced"] + counts["misses"]
+            hits = counts["memory_hits"] + counts["disk_hits"] + counts["coalesced"]
+            return {
+                **counts,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "in_flight": len(self._in_flight),
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "disk_tier": bool(self.cache_dir),
+                "disk_entries": len(self._disk_entries),
+                "disk_max_entries": self.disk_max_entries,
+            }
+
+    def _store(self, key, value):
+        if self.max_entries <= 0:
+            return
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _disk_path(self, key):
+        # Fan out by prefix so a large cache does not end up in one directory
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def _read_disk(self, key):
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._disk_path(key), 'r', encoding='utf-8') as file:
+                value = json.load(file)
+        except (OSError, ValueError):
+            with self._lock:
+                self._disk_entries.pop(key, None)
+            return None
+        with self._lock:
+            self._disk_entries[key] = None
+            self._disk_entries.move_to_end(key)
+        try:
+            os.utime(self._disk_path(key))  # Keep the order across restarts and processes
+        except OSError:
+            pass
+        return value
+
+    def _write_disk(self, key, value):
+        if not self.cache_dir:
+            return
+        path = self._disk_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temp file and rename so readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as file:
+                json.dump(value, file)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Failed to write prediction cache entry {key}: {str(e)}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+
+        with self._lock:
+            self._disk_entries[key] = None
+            self._disk_entries.move_to_end(key)
+            self._disk_written += 1
+            if self._disk_written >= self.disk_rescan_writes:
+                self._rescan_disk()  # Pick up what other processes wrote and evicted
+            if len(self._disk_entries) > self.disk_max_entries:
+                self._evict_disk()
+
+    def _rescan_disk(self):
+        """Rebuild the disk tier's LRU order from the files every process sharing the directory wrote."""
+        existing = []
+        for shard in os.scandir(self.cache_dir):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                try:
+                    mtime = entry.stat().st_mtime
+                except OSError:
+                    continue  # Evicted by another process meanwhile
+                if entry.name.endswith('.tmp'):
+                    # Other processes may be writing theirs right now; only remove abandoned ones
+                    if time.time() - mtime > STALE_TMP_SECONDS:
+                        try:
+                            os.remove(entry.path)
+                        except OSError:
+                            pass
+                elif entry.name.endswith('.json'):
+                    existing.append((mtime, entry.name[:-len('.json')]))
+        self._disk_entries = OrderedDict((key, None) for _, key in sorted(existing))
+        self._disk_written = 0
+
+    def _evict_disk(self):
+        """Remove least recently used files until the disk tier is down to the low-water mark."""
+        while len(self._disk_entries) > self.disk_low_water_entries and self._disk_entries:
+            key, _ = self._disk_entries.popitem(last=False)
+            self._counts["disk_evictions"] += 1
+            try:
+                os.remove(self._disk_path(key))
+            except OSError:
+                pass
@@ -0,0 +1,258 @@
+"""
+Fast image decode and preprocessing for the DenseNet121 classifier.
+
+Produces the same (1, 3, size, size) ImageNet-normalized tensor as the
+original torchvision pipeline (Resize -> ToTensor -> Normalize) with less work:
+
+1. JPEG draft mode: libjpeg decodes straight to a reduced scale (1/2, 1/4 or
+   1/8) that is still at least `size` pixels, instead of decoding a 12 MP phone
+   photo at full resolution and then throwing most of it away.
+2. Fused normalization: the uint8 HWC pixels are converted into one
+   preallocated float32 CHW buffer and normalized in place with a single
+   multiply-add, (x / 255 - mean) / std == x * scale + shift.
+3. A sized thread pool runs decode/resize off the request thread. Pillow and
+   PyTorch release the GIL for the heavy parts, so preprocessing of one request
+   overlaps with the forward pass of another.
+
+Run as a script to check parity against the torchvision reference and print a
+per-stage timing breakdown:
+
+    python preprocessing.py UploadImages/07PerioralDermEye.jpg
+"""
+import argparse
+import os
+import threading
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import numpy as np
+import torch
+import torchvision.transforms as transforms
+from PIL import Image
+
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+
+STAGES = ("decode", "resize", "normalize")
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+# Pixels are only ever read from the PIL buffer before being copied into the
+# float tensor, so the read-only view numpy hands back is safe to wrap
+warnings.filterwarnings("ignore", message="The given NumPy array is not writable")
+
+
+def reference_transform(size=512):
+    """
+    Build the original torchvision preprocessing pipeline, used for parity checks.
+
+    Args:
+        size (int): Square output resolution
+
+    Returns:
+        transforms.Compose: Resize -> ToTensor -> Normalize
+    """
+    return transforms.Compose([
+        transforms.Resize((size, size)),
+        transforms.ToTensor(),
+        transforms.Normalize(list(IMAGENET_MEAN), list(IMAGENET_STD))
+    ])
+
+
+def list_images(folder):
+    """
+    List the image files in a folder, recursively and in a stable order.
+
+    Args:
+        folder (str): Directory to search
+
+    Returns:
+        list[str]: Paths of files with a known image extension
+    """
+    paths = []
+    for root, _, files in os.walk(folder):
+        paths.extend(os.path.join(root, name) for name in files if name.lower().endswith(IMAGE_EXTENSIONS))
+    return sorted(paths)
+
+
+class Preprocessor:
+    """
+    Reusable preprocessing engine.
+
+    Args:
+        size (int): Square output resolution (512 for the production model)
+        num_workers (int): Threads in the preprocessing pool
+        draft (bool): Use JPEG reduced-scale decoding; disable for bit-exact
+            parity with the torchvision pipeline
+    """
+
+    def __init__(self, size=512, num_workers=2, draft=True):
+        self.size = size
+        self.num_workers = num_workers
+        self.draft = draft
+
+        std = torch.tensor(IMAGENET_STD, dtype=torch.float32).view(3, 1, 1)
+        mean = torch.tensor(IMAGENET_MEAN, dtype=torch.float32).view(3, 1, 1)
+        self._scale = 1.0 / (255.0 * std)
+        self._shift = -mean / std
+
+        self._executor = ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix="preprocess")
+
+        self._stats_lock = threading.Lock()
+        self._count = 0
+        self._totals = dict.fromkeys(STAGES, 0.0)
+
+    def decode(self, image_bytes):
+        """
+        Decode image bytes to an RGB image, at reduced scale when possible.
+
+        Args:
+            image_bytes (bytes): Raw encoded image data
+
+        Returns:
+            PIL.Image.Image: Decoded RGB image
+        """
+        image = Image.open(BytesIO(image_bytes))
+        if self.draft:
+            # Only JPEG honours draft(); other formats ignore it and decode fully
+            image.draft("RGB", (self.size, self.size))
+        return image.convert("RGB")
+
+    def resize(self, image):
+        """Resize to size x size with the same filter torchvision's Resize uses."""
+        if image.size == (self.size, self.size):
+            return image
+        return image.resize((self.size, self.size), Image.BILINEAR)
+
+    def normalize(self, image):
+        """
+        Convert an RGB image to a normalized float tensor in a single buffer.
+
+        Args:
+            image (PIL.Image.Image): RGB image of size x size
+
+        Returns:
+            torch.Tensor: Tensor of shape (1, 3, size, size)
+        """
+        pixels = torch.from_numpy(np.asarray(image)).permute(2, 0, 1)
+        out = torch.empty(pixels.shape, dtype=torch.float32)
+        out.copy_(pixels)  # uint8 -> float32 conversion happens inside the copy
+        torch.addcmul(self._shift, out, self._scale, out=out)
+        return out.unsqueeze(0)
+
+    def preprocess_timed(self, image_bytes):
+        """
+        Preprocess image bytes and report how long each stage took.
+
+        Args:
+            image_bytes (bytes): Raw encoded image data
+
+        Returns:
+            tuple[torch.Tensor, dict]: Model input tensor and stage -> seconds
+        """
+        start = time.perf_counter()
+        image = self.decode(image_bytes)
+        decoded = time.perf_counter()
+        image = self.resize(image)
+        resized = time.perf_counter()
+        tensor = self.normalize(image)
+        done = time.perf_counter()
+
+        timings = {"decode": decoded - start, "resize": resized - decoded, "normalize": done - resized}
+        with self._stats_lock:
+            self._count += 1
+            for stage, seconds in timings.items():
+                self._totals[stage] += seconds
+        return tensor, timings
+
+    def preprocess(self, image_bytes):
+        """Preprocess image bytes on the calling thread."""
+        return self.preprocess_timed(image_bytes)[0]
+
+    def submit(self, image_bytes):
+        """
+        Preprocess image bytes on the worker pool.
+
+        Returns:
+            concurrent.futures.Future: Resolves to the model input tensor
+        """
+        return self._executor.submit(self.preprocess, image_bytes)
+
+    def submit_timed(self, image_bytes):
+        """
+        Preprocess image bytes on the worker pool, keeping the stage timings.
+
+        Returns:
+            concurrent.futures.Future: Resolves to (tensor, stage -> seconds)
+        """
+        return self._executor.submit(self.preprocess_timed, image_bytes)
+
+    def stats(self):
+        """
+        Report the mean time spent in each stage.
+
+        Returns:
+            dict: images processed, pool size and mean milliseconds per stage
+        """
+        with self._stats_lock:
+            count = self._count
+            return {
+                "images": count,
+                "num_workers": self.num_workers,
+                "draft": self.draft,
+                "mean_ms": {stage: (total / count * 1000.0 if count else 0.0) for stage, total in self._totals.items()},
+            }
+
+    def check_parity(self, image_bytes):
+        """
+        Compare this engine's output with the original torchvision pipeline.
+
+        Args:
+            image_bytes (bytes): Raw encoded image data
+
+        Returns:
+            dict: max_abs_diff and mean_abs_diff between the two tensors
+        """
+        reference = reference_transform(self.size)(Image.open(BytesIO(image_bytes)).convert("RGB")).unsqueeze(0)
+        diff = (self.preprocess(image_bytes) - reference).abs()
+        return {"max_abs_diff": diff.max().item(), "mean_abs_diff": diff.mean().item()}
+
+    def shutdown(self):
+        """Stop the worker pool once queued work has finished."""
+        self._executor.shutdown(wait=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check preprocessing parity and timing against torchvision")
+    parser.add_argument("images", nargs="+", help="Image files to preprocess")
+    parser.add_argument("--size", type=int, default=512)
+    parser.add_argument("--repeat", type=int, default=10, help="Timed runs per image")
+    args = parser.parse_args()
+
+    reference = reference_transform(args.size)
+    for path in args.images:
+        with open(path, "rb") as file:
+            image_bytes = file.read()
+
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            reference(Image.open(BytesIO(image_bytes)).convert("RGB"))
+        reference_ms = (time.perf_counter() - start) / args.repeat * 1000.0
+
+        print(f"{os.path.basename(path)} (torchvision reference: {reference_ms:.2f} ms)")
+        for draft in (False, True):
+            engine = Preprocessor(size=args.size, num_workers=1, draft=draft)
+            parity = engine.check_parity(image_bytes)
+            for _ in range(args.repeat):
+                engine.preprocess(image_bytes)
+            stages = engine.stats()["mean_ms"]
+            breakdown = ", ".join(f"{stage} {stages[stage]:.2f} ms" for stage in STAGES)
+            print(f"  draft={draft}: {sum(stages.values()):.2f} ms ({breakdown}); "
+                  f"max abs diff {parity['max_abs_diff']:.5f}, mean abs diff {parity['mean_abs_diff']:.5f}")
+            engine.shutdown()
+
+
+if __name__ == "__main__":
+    main()
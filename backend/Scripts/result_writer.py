@@ -0,0 +1,339 @@
+"""
+Write-behind recording of classification results in the image_results table.
+
+/classify hands each prediction to a WriteBehindQueue and answers straight
+away; a background thread inserts the rows in batches instead of making one
+database round trip per request:
+
+    - Rows are flushed when RESULTS_BATCH_SIZE (default 100) have queued up or
+      RESULTS_FLUSH_MS (default 1000) after the first one arrived.
+    - A failed insert is retried RESULTS_MAX_RETRIES times (default 5) with
+      jittered exponential backoff.
+    - A batch that still fails, or rows arriving while the in-memory queue is
+      full, are spilled to a journal of JSON-lines files in
+      RESULTS_JOURNAL_DIR (default ./results_journal). The journal is replayed
+      on start-up, after every successful insert and every 30 seconds while
+      idle, so results written while the database was unreachable arrive once
+      it is back.
+
+Delivery is at-least-once: a batch whose insert succeeded but whose response
+was lost is inserted again.
+
+Sinks:
+    SupabaseTableSink   Supabase table through the supabase-py client
+    SqliteTableSink     Local SQLite stand-in table (RESULTS_DB_PATH), for
+                        development and tests without a database
+"""
+import atexit
+import glob
+import json
+import os
+import queue
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+
+
+def _process_alive(pid):
+    """Whether a process with this pid exists on this host."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class SupabaseTableSink:
+    """
+    Insert rows into a Supabase table.
+
+    Args:
+        client (supabase.Client): Authenticated Supabase client
+        table (str): Table name
+    """
+
+    def __init__(self, client, table='image_results'):
+        self.client = client
+        self.table = table
+
+    def insert(self, rows):
+        self.client.table(self.table).insert(rows).execute()
+
+
+class SqliteTableSink:
+    """
+    Local stand-in for the image_results table in a SQLite file.
+
+    Args:
+        path (str): Database file, created if missing
+        table (str): Table name
+    """
+
+    def __init__(self, path, table='image_results'):
+        self.path = path
+        self.table = table
+        with sqlite3.connect(path) as connection:
+            connection.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, image_id TEXT NOT NULL, class TEXT, "
+                "created_at TEXT DEFAULT CURRENT_TIMESTAMP)"
+            )
+
+    def insert(self, rows):
+        with sqlite3.connect(self.path) as connection:
+            connection.executemany(
+                f"INSERT INTO {self.table} (image_id, class) VALUES (?, ?)",
+                [(row["image_id"], row.get("class")) for row in rows],
+            )
+
+    def count(self):
+        """Number of rows in the table."""
+        with sqlite3.connect(self.path) as connection:
+            return connection.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+
+class WriteBehindQueue:
+    """
+    Batch rows into a sink from a background thread, spilling to a disk journal on failure.
+
+    Call start() to replay the journal right away; otherwise the thread starts
+    on the first submit(), so a queue created before a pre-fork server forks
+    works in every worker.
+
+    Args:
+        sink: Object with insert(rows: list[dict]), raising on failure
+        journal_dir (str): Directory for spilled batches
+        batch_size (int): Maximum rows per insert
+        flush_interval (float): Seconds to wait for a batch to fill
+        max_retries (int): Retries of a failed insert before spilling it
+        backoff (float): First retry delay in seconds, doubled on every retry
+        max_backoff (float): Upper bound on the retry delay
+        max_queue (int): Rows held in memory; beyond that rows go straight to the journal
+        replay_interval (float): Seconds between journal replays while no rows arrive
+    """
+
+    def __init__(self, sink, journal_dir='results_journal', batch_size=100, flush_interval=1.0,
+                 max_retries=5, backoff=0.5, max_backoff=30.0, max_queue=10000, replay_interval=30.0):
+        self.sink = sink
+        self.journal_dir = journal_dir
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.replay_interval = replay_interval
+        os.makedirs(journal_dir, exist_ok=True)
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._stats_lock = threading.Lock()
+        self._counts = {"submitted": 0, "inserted": 0, "batches": 0, "retries": 0,
+                        "spilled": 0, "replayed": 0, "failed_replays": 0}
+
+        # Segments claimed by a process that died mid-replay go back into the journal;
+        # those of live processes (e.g. the old server during a rolling restart) are left alone
+        for path in glob.glob(os.path.join(journal_dir, "*.replaying")):
+            segment, owner = path[:-len(".replaying")], None
+            if not segment.endswith(".jsonl"):  # Claimed as <segment>.<pid>.replaying
+                segment, owner = segment.rsplit(".", 1)
+            if owner is None or not owner.isdigit() or not _process_alive(int(owner)):
+                try:
+                    os.replace(path, segment)
+                except OSError:
+                    pass  # Restored by another process starting at the same time
+
+    def submit(self, row):
+        """Queue one row for insertion without blocking; spills to the journal if the queue is full."""
+        self.start()
+        self._count("submitted")
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self._spill([row])
+
+    def start(self):
+        """Start the background thread, which first replays the journal (no-op if already running)."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopping.clear()
+                self._thread = threading.Thread(target=self._run, name="result-writer", daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout=10.0):
+        """Flush queued rows (to the sink or the journal) and stop the background thread."""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _count(self, name, amount=1):
+        with self._stats_lock:
+            self._counts[name] += amount
+
+    def _collect_batch(self):
+        """Block for the first row, then gather more until the batch is full or the interval expires."""
+        try:
+            batch = [self._queue.get(timeout=0.1)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _drain(self):
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                return batch
+
+    def _run(self):
+        self._replay()
+        last_replay = time.monotonic()
+        while not self._stopping.is_set():
+            batch = self._collect_batch()
+            if batch and self._insert_with_retries(batch):
+                self._replay()
+                last_replay = time.monotonic()
+            elif batch:
+                self._spill(batch)
+            elif time.monotonic() - last_replay >= self.replay_interval:
+                self._replay()
+                last_replay = time.monotonic()
+
+        # Shutting down: one attempt for what is left, then keep it on disk
+        remaining = self._drain()
+        for start in range(0, len(remaining), self.batch_size):
+            batch = remaining[start:start + self.batch_size]
+            if not self._insert(batch):
+                self._spill(batch)
+
+    def _insert(self, rows):
+        try:
+            self.sink.insert(rows)
+        except Exception as e:
+            print(f"Failed to save {len(rows)} classification results to database: {str(e)}")
+            return False
+        self._count("inserted", len(rows))
+        self._count("batches")
+        return True
+
+    def _insert_with_retries(self, rows):
+        delay = self.backoff
+        for attempt in range(self.max_retries + 1):
+            if self._insert(rows):
+                return True
+            if attempt == self.max_retries or self._stopping.is_set():
+                break
+            self._count("retries")
+            # Full jitter keeps many workers from retrying in lockstep
+            if self._stopping.wait(random.uniform(0, delay)):
+                break
+            delay = min(delay * 2, self.max_backoff)
+        return False
+
+    def _write_segment(self, path, rows):
+        """Write rows to a journal segment atomically and durably."""
+        fd, tmp_path = tempfile.mkstemp(dir=self.journal_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as file:
+                file.writelines(json.dumps(row) + "\n" for row in rows)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Failed to journal {len(rows)} classification results, dropping them: {str(e)}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return False
+        return True
+
+    def _spill(self, rows):
+        """Write rows to a new journal segment, named so segments replay oldest first."""
+        name = f"{time.time_ns():020d}-{os.getpid()}.jsonl"
+        if self._write_segment(os.path.join(self.journal_dir, name), rows):
+            self._count("spilled", len(rows))
+
+    def _replay(self):
+        """Insert journaled rows, oldest segment first, until the journal is empty or an insert fails."""
+        for path in sorted(glob.glob(os.path.join(self.journal_dir, "*.jsonl"))):
+            claimed = f"{path}.{os.getpid()}.replaying"
+            try:
+                os.rename(path, claimed)  # Another worker process may be replaying it already
+            except OSError:
+                continue
+            with open(claimed, encoding='utf-8') as file:
+                rows = [json.loads(line) for line in file if line.strip()]
+            for start in range(0, len(rows), self.batch_size):
+                if not self._insert(rows[start:start + self.batch_size]):
+                    # Put back what has not been inserted yet, in its place in the order
+                    self._count("failed_replays")
+                    if self._write_segment(path, rows[start:]):
+                        os.remove(claimed)
+                    return
+                self._count("replayed", len(rows[start:start + self.batch_size]))
+            os.remove(claimed)
+
+    def stats(self):
+        """
+        Report queue depth, insert counters and journal backlog.
+
+        Returns:
+            dict: Counters plus queue_depth and journal_segments
+        """
+        with self._stats_lock:
+            counts = dict(self._counts)
+        return {
+            **counts,
+            "queue_depth": self._queue.qsize(),
+            "journal_segments": len(glob.glob(os.path.join(self.journal_dir, "*.jsonl"))),
+        }
+
+
+def result_writer_from_env(supabase_client=None):
+    """
+    Create the write-behind queue configured in the environment.
+
+    Args:
+        supabase_client (supabase.Client | None): Client for the image_results table
+
+    Returns:
+        WriteBehindQueue | None: Writing to the SQLite stand-in when
+        RESULTS_DB_PATH is set, else to Supabase when a client is given;
+        None when RESULTS_WRITE_BEHIND=0 or there is nowhere to write
+    """
+    if os.getenv("RESULTS_WRITE_BEHIND", "1") != "1":
+        return None
+    if os.getenv("RESULTS_DB_PATH"):
+        sink = SqliteTableSink(os.getenv("RESULTS_DB_PATH"))
+    elif supabase_client is not None:
+        sink = SupabaseTableSink(supabase_client)
+    else:
+        return None
+
+    writer = WriteBehindQueue(
+        sink,
+        journal_dir=os.getenv("RESULTS_JOURNAL_DIR", "results_journal"),
+        batch_size=int(os.getenv("RESULTS_BATCH_SIZE", "100")),
+        flush_interval=float(os.getenv("RESULTS_FLUSH_MS", "1000")) / 1000.0,
+        max_retries=int(os.getenv("RESULTS_MAX_RETRIES", "5")),
+    )
+    atexit.register(writer.stop)
+    return writer
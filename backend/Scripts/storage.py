@@ -0,0 +1,477 @@
+"""
+Image storage backends for the classifier API.
+
+Every storage exposes download(image_id) -> bytes, version(image_id), a cheap
+metadata lookup of the object's etag or modification time, and list(prefix),
+which yields the image ids under a prefix, so the HTTP front ends and the bulk tools
+can run against Supabase in production and against a local directory in
+tests or offline development.
+
+    SupabaseHttpStorage   Supabase storage REST API over a pooled keep-alive session
+    SupabaseStorage       Supabase storage bucket through the supabase-py client
+    LocalStorage          Files under a local directory, with optional artificial
+                          latency to simulate slow storage
+    CachedStorage         Wraps any of the above with a size-bounded on-disk
+                          BlobCache, prefetching and hit-rate/latency stats
+
+storage_from_env() builds the configured stack:
+    LOCAL_STORAGE_DIR           Use LocalStorage (else SUPABASE_URL / SUPABASE_KEY are required)
+    LOCAL_STORAGE_LATENCY_MS    Artificial LocalStorage latency (default 0)
+    HTTP_POOL_SIZE              Keep-alive connections to Supabase (default 32)
+    BLOB_CACHE_DIR              Enable the on-disk blob cache in this directory
+    BLOB_CACHE_MAX_MB           Blob cache size bound (default 1024)
+"""
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from urllib.parse import quote
+
+import requests
+from requests.adapters import HTTPAdapter
+
+STALE_TMP_SECONDS = 3600  # Temporary cache files older than this were left by a crashed writer
+
+
+class SupabaseHttpStorage:
+    """
+    Download images through the Supabase storage REST API.
+
+    One requests.Session is shared by all threads, so connections to Supabase
+    are kept alive and reused instead of being opened for every download.
+
+    Args:
+        url (str): Supabase project URL
+        key (str): Supabase API key
+        bucket (str): Storage bucket name
+        pool_size (int): Maximum keep-alive connections
+        timeout (float): Per-request timeout in seconds
+    """
+
+    def __init__(self, url, key, bucket='images', pool_size=32, timeout=30.0):
+        self.base_url = f"{url.rstrip('/')}/storage/v1/object/{bucket}/"
+        self.list_url = f"{url.rstrip('/')}/storage/v1/object/list/{bucket}"
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({"apikey": key, "Authorization": f"Bearer {key}"})
+
+    def download(self, image_id):
+        try:
+            response = self.session.get(self.base_url + quote(image_id), timeout=self.timeout)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            raise Exception(f"Failed to download image from Supabase: {str(e)}")
+        return response.content
+
+    def version(self, image_id):
+        """ETag (or Last-Modified) of the object, from a HEAD request without the body."""
+        try:
+            response = self.session.head(self.base_url + quote(image_id), timeout=self.timeout)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            raise Exception(f"Failed to look up image in Supabase: {str(e)}")
+        return response.headers.get("ETag") or response.headers.get("Last-Modified")
+
+    def list(self, prefix='', page_size=1000):
+        """Yield the ids of all objects under prefix, descending into folders."""
+        folders = [prefix.strip('/')]
+        while folders:
+            folder = folders.pop()
+            offset = 0
+            while True:
+                body = {"prefix": folder, "limit": page_size, "offset": offset, "sortBy": {"column": "name", "order": "asc"}}
+                try:
+                    response = self.session.post(self.list_url, json=body, timeout=self.timeout)
+                    response.raise_for_status()
+                except requests.RequestException as e:
+                    raise Exception(f"Failed to list images in Supabase: {str(e)}")
+                entries = response.json()
+                for entry in entries:
+                    path = f"{folder}/{entry['name']}" if folder else entry['name']
+                    if entry.get("id") is None:
+                        folders.append(path)  # Folders have no object id
+                    else:
+                        yield path
+                if len(entries) < page_size:
+                    break
+                offset += page_size
+
+
+class SupabaseStorage:
+    """
+    Download images from a Supabase storage bucket.
+
+    Args:
+        client (supabase.Client): Authenticated Supabase client
+        bucket (str): Storage bucket name
+    """
+
+    def __init__(self, client, bucket='images'):
+        self.client = client
+        self.bucket = bucket
+
+    def download(self, image_id):
+        try:
+            return self.client.storage.from_(self.bucket).download(image_id)
+        except Exception as e:
+            raise Exception(f"Failed to download image from Supabase: {str(e)}")
+
+    def version(self, image_id):
+        """ETag (or last update time) of the object, from its folder listing."""
+        folder, _, name = image_id.strip('/').rpartition('/')
+        try:
+            entries = self.client.storage.from_(self.bucket).list(folder, {"search": name, "limit": 100})
+        except Exception as e:
+            raise Exception(f"Failed to look up image in Supabase: {str(e)}")
+        for entry in entries:
+            if entry['name'] == name:
+                return (entry.get('metadata') or {}).get('eTag') or entry.get('updated_at')
+        return None
+
+    def list(self, prefix='', page_size=1000):
+        """Yield the ids of all objects under prefix, descending into folders."""
+        folders = [prefix.strip('/')]
+        while folders:
+            folder = folders.pop()
+            offset = 0
+            while True:
+                try:
+                    entries = self.client.storage.from_(self.bucket).list(folder, {"limit": page_size, "offset": offset})
+                except Exception as e:
+                    raise Exception(f"Failed to list images in Supabase: {str(e)}")
+                for entry in entries:
+                    path = f"{folder}/{entry['name']}" if folder else entry['name']
+                    if entry.get("id") is None:
+                        folders.append(path)
+                    else:
+                        yield path
+                if len(entries) < page_size:
+                    break
+                offset += page_size
+
+
+class LocalStorage:
+    """
+    Serve images from a local directory, standing in for Supabase storage.
+
+    Args:
+        root (str): Directory that image ids are resolved against
+        latency (float): Seconds to sleep before every download, to simulate
+            a slow remote store
+    """
+
+    def __init__(self, root, latency=0.0):
+        self.root = os.path.abspath(root)
+        self.latency = latency
+
+    def path_for(self, image_id):
+        """Resolve an image id to a path inside root, rejecting ids that escape it."""
+        path = os.path.abspath(os.path.join(self.root, image_id))
+        if os.path.commonpath([self.root, path]) != self.root:
+            raise ValueError(f"Invalid image id: {image_id}")
+        return path
+
+    def download(self, image_id):
+        if self.latency:
+            time.sleep(self.latency)
+        try:
+            with open(self.path_for(image_id), 'rb') as file:
+                return file.read()
+        except OSError as e:
+            raise Exception(f"Failed to read image from local storage: {str(e)}")
+
+    def version(self, image_id):
+        """Modification time and size of the file."""
+        try:
+            stat = os.stat(self.path_for(image_id))
+        except OSError as e:
+            raise Exception(f"Failed to read image from local storage: {str(e)}")
+        return f"{stat.st_mtime_ns}-{stat.st_size}"
+
+    def list(self, prefix=''):
+        """Yield the ids (paths relative to root, '/'-separated) of all files under prefix, sorted."""
+        ids = []
+        for directory, _, files in os.walk(self.path_for(prefix) if prefix else self.root):
+            for name in files:
+                ids.append(os.path.relpath(os.path.join(directory, name), self.root).replace(os.sep, '/'))
+        yield from sorted(ids)
+
+
+class BlobCache:
+    """
+    On-disk cache of downloaded images with byte-size-bounded LRU eviction.
+
+    Entries are files named by the SHA-256 of the image id and its version
+    (etag or modification time), so an overwritten image is downloaded again
+    rather than served stale. The LRU order lives in file modification times,
+    so the cache survives restarts and one directory can be shared by several
+    processes (gunicorn or bulk_classify workers): reads go to the directory
+    rather than this process's view of it, and the directory is rescanned
+    after every rescan_bytes written, so together the processes stay within
+    max_bytes plus rescan_bytes each. Between rescans a running byte count
+    decides when to evict, and eviction goes down to low_water of max_bytes
+    so the next puts do not each evict again.
+
+    Args:
+        directory (str): Cache directory
+        max_bytes (int): Total size the cached files may take up
+        rescan_bytes (int | None): Bytes written between rescans (default max_bytes / 16)
+        low_water (float): Fraction of max_bytes eviction trims down to
+    """
+
+    def __init__(self, directory, max_bytes, rescan_bytes=None, low_water=0.9):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.rescan_bytes = rescan_bytes if rescan_bytes is not None else max(1, max_bytes // 16)
+        self.low_water_bytes = int(max_bytes * low_water)
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # file name -> size, least recently used first
+        self._bytes = 0
+        self._written = 0
+        with self._lock:
+            self._rescan()
+            if self._bytes > self.max_bytes:
+                self._evict()
+
+    @staticmethod
+    def _name(image_id, version):
+        return hashlib.sha256(f"{image_id}\0{version}".encode('utf-8')).hexdigest()
+
+    def _rescan(self):
+        """Rebuild the LRU order from the files every process sharing the directory wrote."""
+        existing = []
+        for entry in os.scandir(self.directory):
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue  # Evicted by another process meanwhile
+            if entry.name.endswith('.tmp'):
+                # Other processes may be writing theirs right now; only remove abandoned ones
+                if time.time() - stat.st_mtime > STALE_TMP_SECONDS:
+                    try:
+                        os.remove(entry.path)
+                    except OSError:
+                        pass
+            elif entry.is_file():
+                existing.append((stat.st_mtime, entry.name, stat.st_size))
+        self._entries = OrderedDict((name, size) for _, name, size in sorted(existing))
+        self._bytes = sum(self._entries.values())
+        self._written = 0
+
+    def get(self, image_id, version):
+        """Return the cached bytes for this version of image_id, or None."""
+        name = self._name(image_id, version)
+        path = os.path.join(self.directory, name)
+        try:
+            with open(path, 'rb') as file:
+                data = file.read()
+        except OSError:
+            with self._lock:
+                self._bytes -= self._entries.pop(name, 0)
+            return None
+        with self._lock:
+            self._bytes += len(data) - self._entries.pop(name, 0)
+            self._entries[name] = len(data)
+        try:
+            os.utime(path)  # Keep the order across restarts and processes
+        except OSError:
+            pass
+        return data
+
+    def put(self, image_id, version, data):
+        """Store data for this version of image_id, evicting least recently used entries to stay under max_bytes."""
+        if len(data) > self.max_bytes:
+            return
+        name = self._name(image_id, version)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                file.write(data)
+            os.replace(tmp_path, os.path.join(self.directory, name))
+        except OSError as e:
+            print(f"Failed to write blob cache entry for {image_id}: {str(e)}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+
+        with self._lock:
+            self._bytes += len(data) - self._entries.pop(name, 0)
+            self._entries[name] = len(data)
+            self._written += len(data)
+            if self._written >= self.rescan_bytes:
+                self._rescan()  # Pick up what other processes wrote and evicted
+            if self._bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Remove least recently used entries until the cache is down to the low-water mark."""
+        while self._bytes > self.low_water_bytes and self._entries:
+            name, size = self._entries.popitem(last=False)
+            self._bytes -= size
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+    def stats(self):
+        """Report the number of cached images and bytes used, as of this process's last rescan."""
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes, "max_bytes": self.max_bytes}
+
+
+class CachedStorage:
+    """
+    Storage wrapper adding a blob cache, prefetching and download statistics.
+
+    Concurrent downloads of the same image (e.g. a prefetch racing the
+    /classify request it was meant for) share one transfer. With a cache,
+    every download first looks up the object's version, so a hit costs a
+    metadata round trip instead of the transfer; storages without a version
+    for an object are not cached.
+
+    Args:
+        storage: Underlying storage with download(image_id) -> bytes
+        cache (BlobCache | None): On-disk cache; None only pools and measures
+        prefetch_workers (int): Threads used by prefetch()
+        latency_window (int): Number of recent downloads kept for latency percentiles
+    """
+
+    def __init__(self, storage, cache=None, prefetch_workers=4, latency_window=1024):
+        self.storage = storage
+        self.cache = cache
+
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self._prefetcher = ThreadPoolExecutor(max_workers=prefetch_workers, thread_name_prefix="prefetch")
+        self._latencies = deque(maxlen=latency_window)
+        self._counts = {"hits": 0, "misses": 0, "coalesced": 0, "downloads": 0, "download_errors": 0, "prefetches": 0}
+
+    def download(self, image_id):
+        version = None
+        if self.cache is not None:
+            try:
+                version = self.storage.version(image_id)
+            except Exception as e:
+                print(f"Version lookup of {image_id} failed, bypassing the blob cache: {str(e)}")
+            data = self.cache.get(image_id, version) if version is not None else None
+            if data is not None:
+                with self._lock:
+                    self._counts["hits"] += 1
+                return data
+
+        with self._lock:
+            pending = self._in_flight.get(image_id)
+            owner = pending is None
+            if owner:
+                self._counts["misses"] += 1
+                pending = Future()
+                self._in_flight[image_id] = pending
+            else:
+                self._counts["coalesced"] += 1
+        if not owner:
+            return pending.result()
+
+        started = time.perf_counter()
+        try:
+            data = self.storage.download(image_id)
+        except Exception as e:
+            with self._lock:
+                self._counts["download_errors"] += 1
+                del self._in_flight[image_id]
+            pending.set_exception(e)
+            raise
+
+        if version is not None:
+            self.cache.put(image_id, version, data)
+        with self._lock:
+            self._counts["downloads"] += 1
+            self._latencies.append(time.perf_counter() - started)
+            del self._in_flight[image_id]
+        pending.set_result(data)
+        return data
+
+    def list(self, prefix=''):
+        """Yield the ids of all images under prefix in the underlying storage."""
+        return self.storage.list(prefix)
+
+    def prefetch(self, image_id):
+        """
+        Download an image into the cache in the background, e.g. right after upload.
+
+        Returns:
+            concurrent.futures.Future: Resolves when the image is cached
+        """
+        with self._lock:
+            self._counts["prefetches"] += 1
+        return self._prefetcher.submit(self._prefetch, image_id)
+
+    def _prefetch(self, image_id):
+        try:
+            self.download(image_id)
+        except Exception as e:
+            print(f"Prefetch of {image_id} failed: {str(e)}")
+
+    def stats(self):
+        """
+        Report cache hit rate, download latency percentiles and cache usage.
+
+        Returns:
+            dict: Counters, hit_rate, download latency (ms) and blob cache stats
+        """
+        with self._lock:
+            counts = dict(self._counts)
+            latencies = sorted(self._latencies)
+        lookups = counts["hits"] + counts["misses"] + counts["coalesced"]
+
+        def percentile(q):
+            if not latencies:
+                return 0.0
+            return latencies[min(len(latencies) - 1, int(q / 100.0 * len(latencies)))] * 1000.0
+
+        return {
+            **counts,
+            "hit_rate": counts["hits"] / lookups if lookups else 0.0,
+            "download_ms": {
+                "mean": sum(latencies) / len(latencies) * 1000.0 if latencies else 0.0,
+                "p50": percentile(50),
+                "p95": percentile(95),
+                "p99": percentile(99),
+            },
+            "blob_cache": self.cache.stats() if self.cache is not None else None,
+        }
+
+
+def storage_from_env():
+    """
+    Create the storage stack configured in the environment.
+
+    Returns:
+        CachedStorage: LocalStorage when LOCAL_STORAGE_DIR is set, otherwise
+        SupabaseHttpStorage over the 'images' bucket; with a BlobCache when
+        BLOB_CACHE_DIR is set
+    """
+    local_dir = os.getenv("LOCAL_STORAGE_DIR")
+    if local_dir:
+        storage = LocalStorage(local_dir, latency=float(os.getenv("LOCAL_STORAGE_LATENCY_MS", "0")) / 1000.0)
+    else:
+        supabase_url = os.getenv("SUPABASE_URL")
+        supabase_key = os.getenv("SUPABASE_KEY")
+        if not supabase_url or not supabase_key:
+            raise ValueError("SUPABASE_URL and SUPABASE_KEY must be set in environment variables")
+        storage = SupabaseHttpStorage(supabase_url, supabase_key, pool_size=int(os.getenv("HTTP_POOL_SIZE", "32")))
+
+    cache = None
+    if os.getenv("BLOB_CACHE_DIR"):
+        cache = BlobCache(os.getenv("BLOB_CACHE_DIR"), max_bytes=int(float(os.getenv("BLOB_CACHE_MAX_MB", "1024")) * 1024 * 1024))
+    return CachedStorage(storage, cache)
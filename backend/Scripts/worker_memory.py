@@ -0,0 +1,67 @@
+"""
+Report memory per process for the pre-fork server (Linux only).
+
+    python worker_memory.py <master-pid>
+
+Prints RSS, PSS and USS (private pages) for the gunicorn master and each of
+its workers, read from /proc/<pid>/smaps_rollup. See gunicorn.conf.py for how
+to interpret them.
+"""
+import argparse
+import glob
+
+ROLLUP_FIELDS = ("Rss", "Pss", "Shared_Clean", "Shared_Dirty", "Private_Clean", "Private_Dirty")
+
+
+def read_rollup(pid):
+    """
+    Read the memory summary of one process.
+
+    Args:
+        pid (int): Process id
+
+    Returns:
+        dict: Field name -> size in MB for the ROLLUP_FIELDS, plus "Uss"
+    """
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as file:
+        for line in file:
+            parts = line.split()
+            if len(parts) >= 2 and parts[0].rstrip(":") in ROLLUP_FIELDS:
+                values[parts[0].rstrip(":")] = int(parts[1]) / 1024.0  # kB -> MB
+    values["Uss"] = values.get("Private_Clean", 0.0) + values.get("Private_Dirty", 0.0)
+    return values
+
+def child_pids(pid):
+    """Direct children of a process, from /proc/<pid>/task/*/children."""
+    children = []
+    for path in glob.glob(f"/proc/{pid}/task/*/children"):
+        with open(path) as file:
+            children.extend(int(child) for child in file.read().split())
+    return sorted(children)
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory per gunicorn worker")
+    parser.add_argument("master_pid", type=int, help="PID of the gunicorn master (see gunicorn.pid)")
+    args = parser.parse_args()
+
+    processes = [("master", args.master_pid)] + [("worker", pid) for pid in child_pids(args.master_pid)]
+    totals = dict.fromkeys(("Rss", "Pss", "Uss"), 0.0)
+
+    print(f"{'role':<8}{'pid':>8}{'RSS MB':>10}{'PSS MB':>10}{'USS MB':>10}{'shared MB':>11}")
+    for role, pid in processes:
+        memory = read_rollup(pid)
+        shared = memory.get("Shared_Clean", 0.0) + memory.get("Shared_Dirty", 0.0)
+        print(f"{role:<8}{pid:>8}{memory['Rss']:>10.1f}{memory['Pss']:>10.1f}{memory['Uss']:>10.1f}{shared:>11.1f}")
+        for field in totals:
+            totals[field] += memory[field]
+
+    workers = len(processes) - 1
+    print(f"{'total':<16}{totals['Rss']:>10.1f}{totals['Pss']:>10.1f}{totals['Uss']:>10.1f}")
+    if workers:
+        print(f"Real footprint (sum of PSS): {totals['Pss']:.1f} MB for {workers} workers, "
+              f"{totals['Pss'] / workers:.1f} MB per worker including its share of the master")
+
+
+if __name__ == "__main__":
+    main()